@@ -1,10 +1,30 @@
-from flask import Flask, request, jsonify
+import time
+_import_started = time.perf_counter()  # Mốc đo thời gian startup
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import pickle
 import numpy as np
-import pandas as pd
 import os
+import json
+import itertools
+import threading
 from datetime import datetime
+from compiled_tree import compile_model
+from coalescer import PredictionCoalescer
+from prediction_cache import PredictionCache, cache_steps, quantize_features, split_thresholds
+from profiling import PROFILE_OUTPUTS, RequestProfiler
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, RequestTimer, ServingMetrics
+from model_artifact import ARTIFACT_EXTENSION, artifact_path_for, is_artifact, load_artifact
+from model_registry import ModelRegistry
+from payload_formats import (ARROW_MIMETYPE, BATCH_FORMATS, BINARY_MIMETYPE, BinaryResponse,
+                             PayloadError, arrow_to_matrix, binary_to_matrix, columnar_to_matrix,
+                             encode_arrow, encode_binary)
+from serving_plan import ServingPlan
+from streaming import (csv_chunks, format_csv, format_ndjson, iter_text_lines,
+                       ndjson_chunks, stream_format)
+
+_import_seconds = time.perf_counter() - _import_started
 
 app = Flask(__name__)
 CORS(app)  # Cho phép CORS để frontend gọi được
@@ -21,17 +41,113 @@ MODEL_PATHS = {
 # Hoặc load tất cả models trong 1 thư mục
 MODELS_FOLDER = 'models'  # Thư mục chứa tất cả models
 
+# Thứ tự feature mặc định khi file pkl không lưu feature_names
+DEFAULT_FEATURE_ORDER = ['TSP', 'O3', 'CO', 'NO2', 'SO2', 'Temperature', 'Humidity']
+
+# Nếu cạnh file .pkl có artifact .aqm (do script train ghi ra) thì load artifact
+# (memory-mapped, không unpickle). Đặt False để luôn dùng pkl.
+PREFER_ARTIFACTS = os.environ.get('PREFER_ARTIFACTS', '1') == '1'
+
+# Model chỉ được load khi dùng lần đầu; vượt budget → evict model ít dùng gần đây nhất
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get('MODEL_MEMORY_BUDGET_MB', '512'))
+
+# ==================== CẤU HÌNH SERVING ====================
+
+# Gom các request /api/predict đồng thời (cùng model) thành 1 batch
+COALESCE_ENABLED = os.environ.get('COALESCE_ENABLED', '0') == '1'
+COALESCE_WINDOW_MS = float(os.environ.get('COALESCE_WINDOW_MS', '2'))  # Thời gian chờ gom batch
+COALESCE_MAX_BATCH = int(os.environ.get('COALESCE_MAX_BATCH', '64'))   # Batch tối đa
+
+# Cache response của /api/predict theo vector feature đã lượng tử hóa.
+# Tắt mặc định: request được predict trên tâm bucket (không phải giá trị gửi lên).
+# Bước lượng tử của từng feature = CACHE_STEP_FRACTION × khoảng cách nhỏ nhất giữa hai
+# threshold split của model (chỉ giá trị cách threshold dưới nửa bước có thể đổi kết quả);
+# CACHE_DEFAULT_STEP chỉ dùng cho feature không được split / model không có cây.
+CACHE_ENABLED = os.environ.get('CACHE_ENABLED', '0') == '1'
+CACHE_MAX_SIZE = int(os.environ.get('CACHE_MAX_SIZE', '10000'))
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '300'))
+CACHE_STEP_FRACTION = float(os.environ.get('CACHE_STEP_FRACTION', '0.1'))
+CACHE_DEFAULT_STEP = float(os.environ.get('CACHE_DEFAULT_STEP', '0.01'))
+
+# /api/predict-stream xử lý body theo từng chunk cố định số dòng
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', '1000'))
+
+# Lúc start server: load song song các models (trong memory budget) và chạy warm-up,
+# /api/ready trả về 200 khi xong. Đặt '0' để chỉ load khi dùng lần đầu.
+STARTUP_PRELOAD = os.environ.get('STARTUP_PRELOAD', '1') == '1'
+STARTUP_LOAD_WORKERS = int(os.environ.get('STARTUP_LOAD_WORKERS', '4'))
+
+# Profile request theo yêu cầu (flag "profile" trong request hoặc /api/admin/profile).
+# Tắt mặc định: cProfile làm request chậm đi nhiều lần.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')      # Nơi ghi file .prof
+PROFILE_TOP_N = int(os.environ.get('PROFILE_TOP_N', '25'))   # Số hàm trả về trong response
+PROFILE_MAX_ARMED = int(os.environ.get('PROFILE_MAX_ARMED', '100'))  # Tối đa N của admin endpoint
+
+# Màu sắc và mức độ hiển thị cho mỗi category
+CATEGORY_INFO = {
+    'Tốt': {'color': 'bg-green-500', 'level': 1},
+    'Trung bình': {'color': 'bg-yellow-500', 'level': 2},
+    'Kém': {'color': 'bg-orange-500', 'level': 3},
+    'Xấu': {'color': 'bg-red-500', 'level': 4},
+    'Good': {'color': 'bg-green-500', 'level': 1},
+    'Moderate': {'color': 'bg-yellow-500', 'level': 2},
+    'Không tốt cho người nhạy cảm': {'color': 'bg-orange-500', 'level': 3},
+    'Không tốt cho sức khỏe': {'color': 'bg-red-500', 'level': 4},
+    'Rất xấu': {'color': 'bg-purple-500', 'level': 5},
+    'Nguy hại': {'color': 'bg-purple-500', 'level': 6}
+}
+
 # ==================== GLOBAL VARIABLES ====================
 
-loaded_models = {}
-model_metadata = {}
+# Request / lỗi / latency theo endpoint, model và stage → /api/metrics
+metrics = ServingMetrics()
+
+# model_id → đường dẫn của mọi model trên đĩa + LRU các model đang nằm trong RAM
+model_registry = ModelRegistry(lambda path: load_and_warm_model(path),
+                               int(MODEL_MEMORY_BUDGET_MB * 1024 * 1024),
+                               on_load=metrics.observe_model_load)
+coalescer = None
+reload_listeners = []   # listener(report) sau mỗi lần reload (kể cả ?wait=false)
+inference_executor = None   # 'process': /api/predict(-batch) chạy trong worker process (asgi_server)
+prediction_cache = PredictionCache(CACHE_MAX_SIZE, CACHE_TTL_SECONDS) if CACHE_ENABLED else None
+request_profiler = RequestProfiler(PROFILE_DIR, PROFILE_TOP_N) if PROFILING_ENABLED else None
+_model_versions = itertools.count(1)
+_unpickle_lock = threading.Lock()
+startup_state = {
+    'ready': False,
+    'phase': 'starting',
+    'ready_at': None,
+    'phases': {'imports_seconds': _import_seconds},
+    'models': {}
+}
 
 # ==================== HELPER FUNCTIONS ====================
 
+def resolve_model_path(model_path):
+    """File thực sự được load: artifact .aqm cạnh file .pkl nếu có (PREFER_ARTIFACTS)"""
+    if PREFER_ARTIFACTS and model_path.endswith('.pkl') and is_artifact(artifact_path_for(model_path)):
+        return artifact_path_for(model_path)
+    return model_path
+
 def load_model_from_file(model_path):
-    """Load model từ file pkl"""
+    """Load model từ file pkl hoặc artifact .aqm"""
     try:
-        with open(model_path, 'rb') as f:
+        model_path = resolve_model_path(model_path)
+        
+        if is_artifact(model_path):
+            # Artifact: mảng cây được np.memmap, không unpickle
+            model_data = load_artifact(model_path)
+            model_data.update({
+                'path': model_path,
+                'format': 'artifact',
+                'version': next(_model_versions)
+            })
+            return with_serving_plan(model_data)
+        
+        # Unpickle tuần tự: lần đầu unpickle import sklearn, nhiều thread cùng import lần
+        # đầu (preload song song + request) có thể gặp module "partially initialized"
+        with _unpickle_lock, open(model_path, 'rb') as f:
             model_data = pickle.load(f)
         
         # Xử lý các trường hợp cấu trúc pkl khác nhau
@@ -40,132 +156,233 @@ def load_model_from_file(model_path):
             model = model_data.get('model')
             feature_names = model_data.get('feature_names')
             label_encoder = model_data.get('label_encoder')
+            preprocessor = model_data.get('preprocessor')
         else:
             # Nếu pkl chỉ là model thuần
             model = model_data
             feature_names = None
             label_encoder = None
+            preprocessor = None
         
-        return {
+        return with_serving_plan({
             'model': model,
+            'compiled': compile_model(model) if model is not None else None,
             'feature_names': feature_names,
             'label_encoder': label_encoder,
-            'path': model_path
-        }
+            'preprocessor': preprocessor,
+            'path': model_path,
+            'format': 'pickle',
+            'version': next(_model_versions)  # Tăng mỗi lần load → key cache cũ tự hết hiệu lực
+        })
     except Exception as e:
         print(f"Error loading model from {model_path}: {e}")
         return None
 
-def load_all_models_from_folder(folder_path):
-    """Load tất cả models từ một thư mục"""
+def with_serving_plan(model_data):
+    """Tính sẵn serving plan (thứ tự feature, tên class, bảng category) cho model vừa load"""
+    if model_data['model'] is not None:
+        plan = ServingPlan(model_data, DEFAULT_FEATURE_ORDER, get_category_info)
+        if CACHE_ENABLED:
+            thresholds = split_thresholds(model_data['model'], model_data.get('compiled'))
+            plan.cache_steps = cache_steps(thresholds, plan.feature_order, CACHE_DEFAULT_STEP,
+                                           CACHE_STEP_FRACTION)
+        model_data['plan'] = plan
+    return model_data
+
+def warm_up_model(model_data):
+    """Chạy thử prediction (1 dòng, batch, decision path) để request thật đầu tiên không chậm"""
+    plan = model_data['plan']
+    X = np.zeros((2, len(plan.feature_order)))
+    predict_rows(model_data, X[:1])
+    predict_rows(model_data, X)
+    if plan.has_tree:
+        extract_decision_paths(model_data, X[:1], plan.feature_order)
+
+def load_and_warm_model(model_path):
+    """load_model_from_file + warm-up, ghi lại thời gian từng bước vào model_data['timings']"""
+    started = time.perf_counter()
+    model_data = load_model_from_file(model_path)
+    read_seconds = time.perf_counter() - started
+    if not model_data or model_data['model'] is None:
+        return model_data
+    
+    started = time.perf_counter()
+    try:
+        warm_up_model(model_data)
+    except Exception as e:
+        print(f"Warm-up failed for {model_path}: {e}")
+    model_data['timings'] = {
+        'read_seconds': read_seconds,
+        'warmup_seconds': time.perf_counter() - started
+    }
+    return model_data
+
+def discover_models_in_folder(folder_path):
+    """Tìm tất cả models trong một thư mục → {model_id: path} (chưa load)"""
+    found = {}
     if not os.path.exists(folder_path):
         print(f"Folder {folder_path} không tồn tại")
-        return
+        return found
     
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.pkl'):
-            model_path = os.path.join(folder_path, filename)
-            model_id = filename.replace('.pkl', '')
+    filenames = os.listdir(folder_path)
+    for filename in filenames:
+        model_path = os.path.join(folder_path, filename)
+        is_pkl = filename.endswith('.pkl')
+        if is_pkl or (filename.endswith(ARTIFACT_EXTENSION) and is_artifact(model_path)):
+            model_id = os.path.splitext(filename)[0]
             
-            print(f"Loading model: {filename}...")
-            model_data = load_model_from_file(model_path)
+            # Có cả .pkl và .aqm → chỉ ghi nhận một lần (load_model_from_file tự chọn)
+            if not is_pkl and model_id + '.pkl' in filenames:
+                continue
             
-            if model_data and model_data['model']:
-                loaded_models[model_id] = model_data
-                model_metadata[model_id] = {
-                    'filename': filename,
-                    'filepath': model_path,
-                    'loaded_at': datetime.now().isoformat(),
-                    'model_type': type(model_data['model']).__name__,
-                    'has_feature_names': model_data['feature_names'] is not None,
-                    'has_label_encoder': model_data['label_encoder'] is not None
-                }
-                print(f"Loaded: {model_id}")
-            else:
-                print(f"Failed to load: {filename}")
+            found[model_id] = resolve_model_path(model_path)
+            print(f"Found model: {filename}")
+    return found
 
-def load_predefined_models():
-    """Load các models đã định nghĩa trong MODEL_PATHS"""
+def discover_predefined_models():
+    """Các models đã định nghĩa trong MODEL_PATHS mà file tồn tại → {model_id: path}"""
+    found = {}
     for model_id, model_path in MODEL_PATHS.items():
         if os.path.exists(model_path):
-            print(f"Loading model '{model_id}' from {model_path}...")
-            model_data = load_model_from_file(model_path)
-            
-            if model_data and model_data['model']:
-                loaded_models[model_id] = model_data
-                model_metadata[model_id] = {
-                    'filename': os.path.basename(model_path),
-                    'filepath': model_path,
-                    'loaded_at': datetime.now().isoformat(),
-                    'model_type': type(model_data['model']).__name__,
-                    'has_feature_names': model_data['feature_names'] is not None,
-                    'has_label_encoder': model_data['label_encoder'] is not None
-                }
-                print(f"Model '{model_id}' loaded successfully")
-            else:
-                print(f"Failed to load model '{model_id}'")
+            found[model_id] = resolve_model_path(model_path)
+            print(f"Found model '{model_id}' at {model_path}")
         else:
             print(f"Model file not found: {model_path}")
+    return found
+
+def discover_models():
+    """Quét MODEL_PATHS và MODELS_FOLDER → {model_id: path}"""
+    found = discover_predefined_models()
+    if os.path.exists(MODELS_FOLDER):
+        print(f"\nScanning folder: {MODELS_FOLDER}")
+        found.update(discover_models_in_folder(MODELS_FOLDER))
+    else:
+        print(f"\nFolder '{MODELS_FOLDER}' not found. Create it to auto-load models.")
+    return found
+
+def model_type_name(model):
+    """Tên loại model (model load từ artifact giữ tên model gốc)"""
+    return getattr(model, 'model_type', type(model).__name__)
+
+def predict_rows(model_data, X):
+    """
+    Dự đoán cho ma trận X, trả về (class index, xác suất hoặc None)
+
+    class index là vị trí trong plan.classes / plan.class_names. Một lần
+    predict_proba rồi argmax; ưu tiên cây đã compile, sklearn làm fallback.
+    """
+    model = model_data['model']
+    compiled = model_data.get('compiled')
+    # Batch nhiều dòng với forest: sklearn (đa luồng) nhanh hơn, artifact thì luôn dùng compiled
+    if compiled is not None and (len(X) == 1 or compiled.n_trees == 1 or model_data['format'] == 'artifact'):
+        if len(X) == 1:
+            class_idx, probabilities, _ = compiled.predict_one(X[0])
+            return np.array([class_idx]), probabilities[np.newaxis, :]
+        class_idx, probabilities, _ = compiled.predict(X)
+        return class_idx, probabilities
+    
+    plan = model_data['plan']
+    if plan.has_proba:
+        probabilities = model.predict_proba(X)
+        return probabilities.argmax(axis=1), probabilities
+    return plan.class_index(model.predict(X)), None
+
+def predict_single(model_id, model_data, X):
+    """Dự đoán 1 dòng → (class index, xác suất hoặc None), đi qua coalescer nếu được bật"""
+    if coalescer is not None:
+        return coalescer.submit((model_id, id(model_data)), model_data, X[0])
+    class_idx, probabilities = predict_rows(model_data, X)
+    return int(class_idx[0]), None if probabilities is None else probabilities[0]
 
 def get_category_info(category_name):
     """Trả về màu sắc và thông tin cho mỗi category"""
-    categories = {
-        'Tốt': {'color': 'bg-green-500', 'level': 1},
-        'Trung bình': {'color': 'bg-yellow-500', 'level': 2},
-        'Kém': {'color': 'bg-orange-500', 'level': 3},
-        'Xấu': {'color': 'bg-red-500', 'level': 4},
-        'Good': {'color': 'bg-green-500', 'level': 1},
-        'Moderate': {'color': 'bg-yellow-500', 'level': 2},
-        'Không tốt cho người nhạy cảm': {'color': 'bg-orange-500', 'level': 3},
-        'Không tốt cho sức khỏe': {'color': 'bg-red-500', 'level': 4},
-        'Rất xấu': {'color': 'bg-purple-500', 'level': 5},
-        'Nguy hại': {'color': 'bg-purple-500', 'level': 6}
-    }
-    return categories.get(category_name, {'color': 'bg-gray-500', 'level': 0})
+    return CATEGORY_INFO.get(category_name, {'color': 'bg-gray-500', 'level': 0})
+
+def extract_decision_paths(model_data, X, feature_order):
+    """
+    Trích xuất decision path cho mọi dòng của X (Decision Tree)
 
-def extract_decision_path(model, X):
-    """Trích xuất decision path từ Decision Tree"""
+    Làm việc trực tiếp trên CSR (indptr, indices), không densify ma trận.
+    Trả về list các path, mỗi path là list node (bỏ leaf).
+    """
     try:
-        # Lấy decision path
-        decision_path = model.decision_path(X)
-        node_indicator = decision_path.toarray()[0]
+        model = model_data['model']
+        compiled = model_data.get('compiled')
         
-        # Lấy thông tin về cây
-        tree = model.tree_
-        feature_names = model.feature_names_in_.tolist()
+        if hasattr(model, 'feature_names_in_'):
+            feature_names = model.feature_names_in_.tolist()
+        else:
+            feature_names = list(feature_order)
         
-        path_nodes = []
-        nodes = np.where(node_indicator == 1)[0]
+        if compiled is not None and len(X) == 1:
+            return [single_decision_path(compiled, X[0], feature_names)]
         
-        for node_id in nodes[:-1]:  # Bỏ node cuối (leaf)
-            feature_id = tree.feature[node_id]
-            threshold = tree.threshold[node_id]
-            
-            if feature_id >= 0 and feature_id < len(feature_names):
-                feature_name = feature_names[feature_id]
-                
-                # Xác định đi left hay right
-                left_child = tree.children_left[node_id]
-                right_child = tree.children_right[node_id]
-                
-                if len(nodes) > list(nodes).index(node_id) + 1:
-                    next_node = nodes[list(nodes).index(node_id) + 1]
-                    direction = "left" if next_node == left_child else "right"
-                else:
-                    direction = "left"
-                
-                path_nodes.append({
-                    'id': int(node_id),
-                    'feature': feature_name,
-                    'threshold': float(threshold),
-                    'direction': direction,
-                    'samples': int(tree.n_node_samples[node_id])
-                })
-        
-        return path_nodes
+        # Lấy decision path dạng CSR và thông tin về cây
+        if compiled is not None:
+            tree = compiled
+            indptr, indices = compiled.decision_path(X)
+        else:
+            tree = model.tree_
+            csr = model.decision_path(X)
+            indptr, indices = csr.indptr, csr.indices
+        
+        # Node kế tiếp trên cùng path (node cuối mỗi dòng là leaf → bỏ)
+        indptr = np.asarray(indptr)
+        n_rows = len(indptr) - 1
+        counts = np.diff(indptr)
+        is_leaf_step = np.zeros(len(indices), dtype=bool)
+        is_leaf_step[indptr[1:][counts > 0] - 1] = True
+        next_nodes = np.empty_like(indices)
+        next_nodes[:-1] = indices[1:]
+        next_nodes[-1:] = -1
+        
+        features = tree.feature[indices]
+        keep = ~is_leaf_step & (features >= 0) & (features < len(feature_names))
+        row_of = np.repeat(np.arange(n_rows), counts)[keep]
+        
+        # Xác định đi left hay right bằng so sánh child id
+        nodes = indices[keep]
+        go_left = next_nodes[keep] == tree.children_left[nodes]
+        
+        ids = nodes.tolist()
+        names = np.asarray(feature_names, dtype=object)[features[keep]].tolist()
+        thresholds = tree.threshold[nodes].tolist()
+        directions = np.where(go_left, "left", "right").tolist()
+        samples = tree.n_node_samples[nodes].tolist()
+        
+        bounds = np.searchsorted(row_of, np.arange(n_rows + 1)).tolist()
+        return [
+            [
+                {
+                    'id': ids[k],
+                    'feature': names[k],
+                    'threshold': thresholds[k],
+                    'direction': directions[k],
+                    'samples': samples[k]
+                }
+                for k in range(bounds[i], bounds[i + 1])
+            ]
+            for i in range(n_rows)
+        ]
     except Exception as e:
         print(f"Error extracting decision path: {e}")
-        return []
+        return [[] for _ in range(len(X))]
+
+def single_decision_path(compiled, row, feature_names):
+    """Decision path của 1 dòng, duyệt cây bằng list Python (đường nhanh của /api/predict)"""
+    path = compiled.path_one(row)
+    left, _, feature, threshold, _, samples = compiled.lists()
+    return [
+        {
+            'id': node,
+            'feature': feature_names[feature[node]],
+            'threshold': threshold[node],
+            'direction': "left" if next_node == left[node] else "right",
+            'samples': samples[node]
+        }
+        for node, next_node in zip(path[:-1], path[1:])
+        if 0 <= feature[node] < len(feature_names)
+    ]
 
 def build_rule_string(decision_path):
     """Tạo rule string từ decision path"""
@@ -179,97 +396,180 @@ def build_rule_string(decision_path):
     
     return "IF " + " AND ".join(rules) + " THEN [PREDICTION]"
 
-# ==================== API ENDPOINTS ====================
+def predict_batch_columns(model_data, X, feature_order, explain=False):
+    """
+    Dự đoán ma trận X → kết quả dạng cột (dùng chung cho mọi format của batch/stream)
+    
+    class_index trỏ vào labels (= plan.class_names); tên, màu, level lấy từ serving plan.
+    """
+    plan = model_data['plan']
+    
+    # Điền median / kẹp giá trị như lúc train
+    if plan.has_preprocessor:
+        with metrics.stage('preprocess'):
+            X = plan.preprocess(X)
+    
+    # Dự đoán: một lần predict_proba + argmax
+    with metrics.stage('predict_proba' if plan.has_proba else 'predict'):
+        class_index, probabilities = predict_rows(model_data, X)
+    class_index = np.asarray(class_index, dtype=np.int64)
+    
+    # Tính confidence
+    if probabilities is not None:
+        confidence = probabilities[np.arange(len(class_index)), class_index].astype(np.float64)
+    else:
+        confidence = np.full(len(class_index), 0.85)
+    
+    # Decision path cho cả batch (chỉ cho Decision Tree)
+    decision_paths = None
+    rules = None
+    if explain and plan.has_tree:
+        with metrics.stage('decision_path'):
+            decision_paths = extract_decision_paths(model_data, X, feature_order)
+        with metrics.stage('rule_building'):
+            rules = batch_rule_strings(plan.class_names, decision_paths, class_index)
+    
+    return {
+        'labels': plan.class_names,
+        'class_index': class_index,
+        'confidence': confidence,
+        'color': plan.color[class_index],
+        'level': plan.level[class_index],
+        'decision_paths': decision_paths,
+        'rules': rules
+    }
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'ok',
-        'timestamp': datetime.now().isoformat(),
-        'loaded_models': len(loaded_models),
-        'models': list(loaded_models.keys())
-    })
+def batch_rule_strings(labels, decision_paths, class_index):
+    return [build_rule_string(path).replace('[PREDICTION]', str(labels[i]))
+            for path, i in zip(decision_paths, class_index.tolist())]
 
-@app.route('/api/models', methods=['GET'])
-def list_models():
-    """Liệt kê tất cả models đã load"""
-    models_info = []
-    for model_id, metadata in model_metadata.items():
-        models_info.append({
-            'id': model_id,
-            'name': metadata['filename'],
-            'type': metadata['model_type'],
-            'loaded_at': metadata['loaded_at'],
-            'path': metadata['filepath'],
-            'is_loaded': model_id in loaded_models,
-            'has_feature_names': metadata['has_feature_names'],
-            'has_label_encoder': metadata['has_label_encoder']
-        })
+def batch_rows(columns, offset=0):
+    """Kết quả dạng cột → list kết quả từng dòng (format JSON mặc định)"""
+    labels = columns['labels']
+    class_index = columns['class_index'].tolist()
+    confidences = columns['confidence'].tolist()
+    colors = columns['color'].tolist()
+    levels = columns['level'].tolist()
+    decision_paths = columns['decision_paths']
+    rules = columns['rules']
     
-    return jsonify({
-        'models': models_info,
-        'count': len(models_info)
-    })
+    results = []
+    for i in range(len(class_index)):
+        result = {
+            'index': offset + i,
+            'category': labels[class_index[i]],
+            'confidence': confidences[i],
+            'color': colors[i],
+            'level': levels[i]
+        }
+        if decision_paths is not None:
+            result['decision_path'] = decision_paths[i]
+            result['rule'] = rules[i]
+        results.append(result)
+    return results
 
-@app.route('/api/predict', methods=['POST'])
-def predict():
+def batch_columnar(columns):
+    """Kết quả dạng cột → JSON columnar (một mảng cho mỗi trường)"""
+    labels = np.asarray([str(label) for label in columns['labels']], dtype=object)
+    result = {
+        'index': list(range(len(columns['class_index']))),
+        'category': labels[columns['class_index']].tolist(),
+        'confidence': columns['confidence'].tolist(),
+        'color': columns['color'].tolist(),
+        'level': columns['level'].tolist()
+    }
+    if columns['decision_paths'] is not None:
+        result['decision_path'] = columns['decision_paths']
+        result['rule'] = columns['rules']
+    return result
+
+def build_batch_results(model_data, X, feature_order, explain=False, offset=0):
+    """
+    Dự đoán ma trận X và format kết quả từng dòng (dùng chung cho batch và stream)
+    
+    offset: index của dòng đầu tiên trong X (stream xử lý theo chunk)
+    """
+    return batch_rows(predict_batch_columns(model_data, X, feature_order, explain), offset)
+
+# ==================== REQUEST HANDLERS ====================
+
+def profiled_call(endpoint, model_id, flag, handler, *args):
+    """
+    Chạy handler(*args) dưới profiler nếu request bật profile hoặc admin đã arm model_id
+
+    Trả về (payload, status), hoặc None nếu request này không cần profile.
+    """
+    if request_profiler is None or model_id not in model_registry:
+        return None
+    choice = request_profiler.choose(model_id, flag)
+    if choice is None:
+        return None
+    return request_profiler.run(choice, model_id, endpoint, handler, *args)
+
+def handle_predict(data, args=None):
     """
     Dự đoán chất lượng không khí
     
+    Trả về (payload, status) để dùng chung cho Flask và ASGI server.
+    "profile": true|"response"|"file" (khi PROFILING_ENABLED) → kết quả profile trong payload['profile']
     """
     try:
-        data = request.json
+        args = args or {}
         model_id = data.get('model_id', 'default')  # Mặc định dùng model 'default'
         features = data.get('features')
         
+        profiled = profiled_call('/api/predict', model_id, data.get('profile', args.get('profile')),
+                                 handle_predict, data, args)
+        if profiled is not None:
+            return profiled
+        
         if not features:
-            return jsonify({'error': 'Missing features'}), 400
+            return {'error': 'Missing features'}, 400
         
-        # Kiểm tra model có tồn tại không
-        if model_id not in loaded_models:
-            return jsonify({
+        # Kiểm tra model có tồn tại không (load nếu chưa có trong RAM)
+        model_data = model_registry.get(model_id)
+        if model_data is None:
+            return {
                 'error': f'Model "{model_id}" not found',
-                'available_models': list(loaded_models.keys()),
+                'available_models': model_registry.model_ids(),
                 'message': 'Please use one of the available models or check MODEL_PATHS in code'
-            }), 404
+            }, 404
+        metrics.set_model(model_id)
         
-        model_data = loaded_models[model_id]
-        model = model_data['model']
-        feature_names = model_data['feature_names']
-        label_encoder = model_data['label_encoder']
+        # Thứ tự feature, tên class, bảng category đã tính sẵn khi load model
+        plan = model_data['plan']
+        feature_order = plan.feature_order
         
-        # Chuẩn bị dữ liệu đầu vào
-        if feature_names:
-            feature_order = feature_names
-        else:
-            # Default order
-            feature_order = ['TSP', 'O3', 'CO', 'NO2', 'SO2', 'Temperature', 'Humidity']
+        # Trả về response đã cache nếu vector feature (đã lượng tử hóa) trùng; cache miss
+        # cũng predict trên vector đã lượng tử hóa để mọi request cùng bucket có cùng kết quả
+        # (request đang được profile luôn chạy prediction thật)
+        cache_key = None
+        if prediction_cache is not None and not (request_profiler and request_profiler.active()):
+            key, features = quantize_features(features, feature_order, plan.cache_steps)
+            cache_key = (model_id, model_data['version'], key)
+            cached = prediction_cache.get(cache_key)
+            if cached is not None:
+                return dict(cached, timestamp=datetime.now().isoformat()), 200
         
         # Tạo array features theo đúng thứ tự
-        X = np.array([[features.get(f, 0) for f in feature_order]])
-        
-        # Dự đoán
-        prediction_encoded = model.predict(X)[0]
+        with metrics.stage('feature_assembly'):
+            X = plan.row(features)
+        if plan.has_preprocessor:
+            with metrics.stage('preprocess'):
+                X = plan.preprocess(X)
         
-        # Decode prediction nếu có label encoder
-        if label_encoder:
-            try:
-                prediction = label_encoder.inverse_transform([prediction_encoded])[0]
-            except:
-                prediction = str(prediction_encoded)
-        else:
-            prediction = str(prediction_encoded)
+        # Dự đoán: một lần predict_proba + argmax
+        with metrics.stage('predict_proba' if plan.has_proba else 'predict'):
+            class_idx, probabilities = predict_single(model_id, model_data, X)
+        category_info = plan.category_info[class_idx]
+        prediction = str(category_info['category'])
         
         # Tính confidence (xác suất)
-        try:
-            probabilities = model.predict_proba(X)[0]
-            confidence = float(probabilities.max())
-            all_probs = {
-                str(label_encoder.inverse_transform([i])[0] if label_encoder else i): float(prob)
-                for i, prob in enumerate(probabilities)
-            }
-        except:
+        if probabilities is not None:
+            probs = probabilities.tolist()
+            confidence = probs[class_idx]
+            all_probs = dict(zip(plan.prob_keys, probs))
+        else:
             confidence = 0
             all_probs = {}
         
@@ -278,17 +578,16 @@ def predict():
         rule = ""
         
         try:
-            if hasattr(model, 'tree_'):  # Kiểm tra xem có phải Decision Tree không
-                decision_path = extract_decision_path(model, X)
-                rule = build_rule_string(decision_path)
-                rule = rule.replace('[PREDICTION]', prediction)
+            if plan.has_tree:
+                with metrics.stage('decision_path'):
+                    decision_path = extract_decision_paths(model_data, X, feature_order)[0]
+                with metrics.stage('rule_building'):
+                    rule = build_rule_string(decision_path)
+                    rule = rule.replace('[PREDICTION]', prediction)
         except Exception as e:
             print(f"Error extracting decision path: {e}")
         
-        # Lấy thông tin category
-        category_info = get_category_info(prediction)
-        
-        return jsonify({
+        payload = {
             'success': True,
             'prediction': {
                 'category': prediction,
@@ -301,18 +600,61 @@ def predict():
             'rule': rule,
             'features_used': feature_order,
             'model_id': model_id,
-            'model_type': type(model).__name__,
+            'model_type': plan.model_type,
             'timestamp': datetime.now().isoformat()
-        })
+        }
+        if cache_key is not None:
+            prediction_cache.put(cache_key, payload)
+        return payload, 200
     
     except Exception as e:
-        return jsonify({
+        return {
             'error': str(e),
             'message': 'Prediction failed'
-        }), 500
+        }, 500
 
-@app.route('/api/predict-batch', methods=['POST'])
-def predict_batch():
+def batch_response(model_id, model_data, X, feature_order, explain, output_format):
+    """Dự đoán X và đóng gói theo output_format (json | columnar | binary | arrow)"""
+    metrics.observe_batch(len(X))
+    columns = predict_batch_columns(model_data, X, feature_order, explain and output_format in ('json', 'columnar'))
+    count = len(columns['class_index'])
+    
+    with metrics.stage('serialization'):
+        if output_format == 'binary':
+            body, headers = encode_binary(columns['class_index'], columns['confidence'], columns['level'],
+                                          'float32', columns['labels'])
+            headers['X-Model-Id'] = model_id
+            return BinaryResponse(body, BINARY_MIMETYPE, headers), 200
+        if output_format == 'arrow':
+            labels = np.asarray([str(label) for label in columns['labels']], dtype=object)
+            body = encode_arrow({
+                'index': np.arange(count),
+                'category': labels[columns['class_index']],
+                'confidence': columns['confidence'],
+                'color': columns['color'],
+                'level': columns['level']
+            })
+            return BinaryResponse(body, ARROW_MIMETYPE, {'X-Model-Id': model_id}), 200
+        
+        predictions = batch_columnar(columns) if output_format == 'columnar' else batch_rows(columns)
+    return {
+        'success': True,
+        'predictions': predictions,
+        'count': count,
+        'model_id': model_id,
+        'timestamp': datetime.now().isoformat()
+    }, 200
+
+def model_not_found(model_id):
+    return {
+        'error': f'Model "{model_id}" not found',
+        'available_models': model_registry.model_ids()
+    }, 404
+
+def parse_flag(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def handle_predict_batch(data, args=None):
     """
     Dự đoán cho nhiều samples cùng lúc
     
@@ -322,97 +664,334 @@ def predict_batch():
         "samples": [
             {"TSP": 150, "PM2.5": 45, ...},
             {"TSP": 120, "PM2.5": 30, ...}
-        ]
+        ],
+        "explain": false   // true → thêm decision_path và rule cho từng sample
     }
+    
+    Hoặc dạng columnar (một mảng cho mỗi feature, nhanh hơn với batch lớn):
+    {"model_id": "default", "columns": {"PM2.5": [45, 30], "PM10": [80, 60], ...}}
+    
+    Có thể bật explain qua query string: /api/predict-batch?explain=true
+    Format response: "format" trong body hoặc ?format=json|columnar|binary|arrow
+    (mặc định json, hoặc columnar nếu request dùng columns)
+    Profile (khi PROFILING_ENABLED): "profile": true|"response"|"file" hoặc ?profile=...
     """
     try:
-        data = request.json
+        args = args or {}
         model_id = data.get('model_id', 'default')
         samples = data.get('samples')
+        columns = data.get('columns')
+        explain = parse_flag(data.get('explain', args.get('explain', 'false')))
+        output_format = data.get('format') or args.get('format') or ('columnar' if columns else 'json')
         
-        if not samples:
-            return jsonify({'error': 'Missing samples'}), 400
+        profiled = profiled_call('/api/predict-batch', model_id, data.get('profile', args.get('profile')),
+                                 handle_predict_batch, data, args)
+        if profiled is not None:
+            return profiled
         
-        if model_id not in loaded_models:
-            return jsonify({
-                'error': f'Model "{model_id}" not found',
-                'available_models': list(loaded_models.keys())
-            }), 404
+        if not samples and not columns:
+            return {'error': 'Missing samples'}, 400
+        if output_format not in BATCH_FORMATS:
+            return {'error': f'Unsupported format: {output_format}'}, 400
         
-        model_data = loaded_models[model_id]
-        model = model_data['model']
-        feature_names = model_data['feature_names']
-        label_encoder = model_data['label_encoder']
+        model_data = model_registry.get(model_id)
+        if model_data is None:
+            return model_not_found(model_id)
+        metrics.set_model(model_id)
         
-        feature_order = feature_names or ['TSP', 'O3', 'CO', 'NO2', 'SO2', 'Temperature', 'Humidity']
+        feature_order = model_data['plan'].feature_order
         
-        # Tạo array cho tất cả samples
-        X = np.array([[sample.get(f, 0) for f in feature_order] for sample in samples])
+        with metrics.stage('feature_assembly'):
+            if columns:
+                X = columnar_to_matrix(columns, feature_order)
+            else:
+                # Tạo array cho tất cả samples
+                X = np.array([[sample.get(f, 0) for f in feature_order] for sample in samples])
         
-        # Dự đoán
-        predictions_encoded = model.predict(X)
+        return batch_response(model_id, model_data, X, feature_order, explain, output_format)
+    
+    except PayloadError as e:
+        return {'error': str(e)}, e.status
+    except Exception as e:
+        return {
+            'error': str(e),
+            'message': 'Batch prediction failed'
+        }, 500
+
+def handle_predict_batch_binary(body, mimetype, headers, args):
+    """
+    Batch dạng nhị phân: ma trận raw (application/octet-stream) hoặc Arrow IPC
+    
+    Raw: little-endian, row-major, header X-Feature-Order (tên cột, cách nhau bởi dấu phẩy)
+    và X-Dtype (float32 | float64, mặc định float64). model_id, explain, format qua query string.
+    """
+    try:
+        model_id = args.get('model_id', 'default')
+        output_format = args.get('format') or ('arrow' if mimetype == ARROW_MIMETYPE else 'binary')
         
-        # Decode predictions
-        if label_encoder:
-            predictions = label_encoder.inverse_transform(predictions_encoded)
-        else:
-            predictions = [str(p) for p in predictions_encoded]
+        profiled = profiled_call('/api/predict-batch', model_id, args.get('profile'),
+                                 handle_predict_batch_binary, body, mimetype, headers, args)
+        if profiled is not None:
+            return profiled
         
-        # Tính confidence
-        try:
-            probabilities = model.predict_proba(X)
-            confidences = [float(prob.max()) for prob in probabilities]
-        except:
-            confidences = [0.85] * len(predictions)
-        
-        # Format results
-        results = []
-        for i, pred in enumerate(predictions):
-            category_info = get_category_info(pred)
-            results.append({
-                'index': i,
-                'category': pred,
-                'confidence': confidences[i],
-                'color': category_info['color'],
-                'level': category_info['level']
-            })
+        if output_format not in BATCH_FORMATS:
+            return {'error': f'Unsupported format: {output_format}'}, 400
+        if not body:
+            return {'error': 'Missing samples'}, 400
         
-        return jsonify({
-            'success': True,
-            'predictions': results,
-            'count': len(results),
-            'model_id': model_id,
-            'timestamp': datetime.now().isoformat()
-        })
+        model_data = model_registry.get(model_id)
+        if model_data is None:
+            return model_not_found(model_id)
+        metrics.set_model(model_id)
+        
+        feature_order = model_data['plan'].feature_order
+        with metrics.stage('feature_assembly'):
+            if mimetype == ARROW_MIMETYPE:
+                X = arrow_to_matrix(body, feature_order)
+            else:
+                X = binary_to_matrix(body, headers.get('x-feature-order'), headers.get('x-dtype'), feature_order)
+        
+        return batch_response(model_id, model_data, X, feature_order,
+                              parse_flag(args.get('explain', 'false')), output_format)
     
+    except PayloadError as e:
+        return {'error': str(e)}, e.status
     except Exception as e:
-        return jsonify({
+        return {
             'error': str(e),
             'message': 'Batch prediction failed'
-        }), 500
+        }, 500
+
+def handle_predict_batch_request(body, mimetype, headers, args):
+    """
+    Điểm vào chung của /api/predict-batch cho Flask và ASGI server
+    
+    headers: dict tên header viết thường. Chọn handler theo Content-Type; Accept
+    application/octet-stream hoặc Arrow → response nhị phân tương ứng.
+    """
+    args = dict(args or {})
+    accept = headers.get('accept', '').split(',')[0].split(';')[0].strip()
+    if 'format' not in args and accept in (BINARY_MIMETYPE, ARROW_MIMETYPE):
+        args['format'] = 'binary' if accept == BINARY_MIMETYPE else 'arrow'
+    
+    if mimetype in (BINARY_MIMETYPE, ARROW_MIMETYPE):
+        return handle_predict_batch_binary(body, mimetype, headers, args)
+    
+    try:
+        with metrics.stage('json_parse'):
+            data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+    return handle_predict_batch(data if isinstance(data, dict) else {}, args)
+
+# ==================== API ENDPOINTS ====================
+
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return jsonify({
+        'status': 'ok',
+        'timestamp': datetime.now().isoformat(),
+        'loaded_models': len(model_registry.resident_ids()),
+        'models': model_registry.model_ids(),
+        'model_memory': model_registry.stats(),
+        'coalescer': coalescer.stats() if coalescer is not None else None,
+        'prediction_cache': prediction_cache.stats() if prediction_cache is not None else None
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Metrics dạng Prometheus text (request, lỗi, latency theo endpoint / model / stage)"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+def collect_runtime_metrics():
+    """Gauge/counter đọc lúc scrape từ registry, prediction cache và coalescer"""
+    registry = model_registry.stats()
+    collected = [
+        ('aq_models_available', 'gauge', 'Models found on disk', [({}, registry['available'])]),
+        ('aq_models_resident', 'gauge', 'Models loaded in memory', [({}, registry['resident'])]),
+        ('aq_model_memory_bytes', 'gauge', 'Estimated memory of resident models',
+         [({}, registry['memory_bytes'])]),
+        ('aq_model_evictions_total', 'counter', 'Models evicted from memory (LRU budget)',
+         [({'model_id': model_id}, info['eviction_count'])
+          for model_id, info in sorted(model_registry.metadata().items())]),
+    ]
+    if prediction_cache is not None:
+        cache = prediction_cache.stats()
+        collected += [
+            ('aq_prediction_cache_hits_total', 'counter', 'Prediction cache hits', [({}, cache['hits'])]),
+            ('aq_prediction_cache_misses_total', 'counter', 'Prediction cache misses', [({}, cache['misses'])]),
+            ('aq_prediction_cache_entries', 'gauge', 'Prediction cache size', [({}, cache['size'])]),
+        ]
+    if coalescer is not None:
+        coalesced = coalescer.stats()
+        collected += [
+            ('aq_coalescer_batches_total', 'counter', 'Coalesced predict batches', [({}, coalesced['batches'])]),
+            ('aq_coalescer_requests_total', 'counter', 'Requests served by the coalescer',
+             [({}, coalesced['requests'])]),
+        ]
+    return collected
+
+metrics.add_collector(collect_runtime_metrics)
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness endpoint: 200 khi mọi model cần preload đã load và warm-up xong, ngược lại 503
+    
+    Khác /api/health (chỉ báo process còn sống). Kèm thời gian startup theo phase và theo model.
+    """
+    state = dict(startup_state, snapshot_version=model_registry.snapshot().version)
+    return jsonify(state), 200 if state['ready'] else 503
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """Liệt kê tất cả models trên đĩa (kể cả chưa load hoặc đã bị evict)"""
+    models_info = []
+    for model_id, metadata in model_registry.metadata().items():
+        models_info.append({
+            'id': model_id,
+            'name': metadata['filename'],
+            'type': metadata['model_type'],
+            'loaded_at': metadata['loaded_at'],
+            'path': metadata['filepath'],
+            'is_loaded': metadata['state'] == 'resident',
+            'state': metadata['state'],
+            'last_used': metadata['last_used'],
+            'memory_bytes': metadata['memory_bytes'],
+            'has_feature_names': metadata['has_feature_names'],
+            'has_label_encoder': metadata['has_label_encoder'],
+            'compiled': metadata['compiled'],
+            'format': metadata['format']
+        })
+    
+    return jsonify({
+        'models': models_info,
+        'count': len(models_info)
+    })
+
+@app.route('/api/predict', methods=['POST'])
+def predict():
+    """Dự đoán chất lượng không khí"""
+    with metrics.track('/api/predict') as req:
+        with metrics.stage('json_parse'):
+            data = request.get_json(silent=True) or {}
+        payload, status = handle_predict(data)
+        with metrics.stage('serialization'):
+            response = jsonify(payload)
+        req.status = status
+    return response, status
+
+@app.route('/api/predict-batch', methods=['POST'])
+def predict_batch():
+    """Dự đoán cho nhiều samples cùng lúc (JSON theo dòng, columnar, binary hoặc Arrow)"""
+    headers = {name.lower(): value for name, value in request.headers.items()}
+    with metrics.track('/api/predict-batch') as req:
+        payload, status = handle_predict_batch_request(request.get_data(), request.mimetype, headers, request.args)
+        if isinstance(payload, BinaryResponse):
+            response = Response(payload.body, status, mimetype=payload.mimetype, headers=payload.headers)
+        else:
+            with metrics.stage('serialization'):
+                response = jsonify(payload), status
+        req.status = status
+    return response
+
+@app.route('/api/predict-stream', methods=['POST'])
+def predict_stream():
+    """
+    Dự đoán dạng stream cho input rất lớn (backfill)
+    
+    Body: NDJSON (mỗi dòng một object feature) hoặc CSV có header (Content-Type: text/csv)
+    Query: ?model_id=default&format=ndjson|csv&explain=true&chunk_size=1000
+    Response: NDJSON/CSV trả về theo từng chunk (chunked transfer), bộ nhớ không tăng theo input.
+    Lỗi giữa chừng được ghi thành dòng {"error": ...} (CSV: index = "error") rồi dừng stream.
+    """
+    model_id = request.args.get('model_id', 'default')
+    model_data = model_registry.get(model_id)
+    if model_data is None:
+        return jsonify({
+            'error': f'Model "{model_id}" not found',
+            'available_models': model_registry.model_ids()
+        }), 404
+    
+    input_format = stream_format(request.mimetype)
+    output_format = request.args.get('format') or stream_format(request.accept_mimetypes.best, input_format)
+    if output_format not in ('ndjson', 'csv'):
+        return jsonify({'error': f'Unsupported format: {output_format}'}), 400
+    explain = request.args.get('explain', 'false').lower() in ('1', 'true', 'yes')
+    chunk_size = max(1, request.args.get('chunk_size', STREAM_CHUNK_SIZE, type=int))
+    
+    feature_order = model_data['plan'].feature_order
+    read_chunks = csv_chunks if input_format == 'csv' else ndjson_chunks
+    
+    parse_stage = 'csv_parse' if input_format == 'csv' else 'json_parse'
+    
+    def generate():
+        # Stage được cộng dồn qua các chunk; thời gian client đọc response không tính vào stage
+        timer = RequestTimer('/api/predict-stream')
+        timer.model_id = model_id
+        offset = 0
+        try:
+            chunks = read_chunks(iter_text_lines(request.stream), feature_order, chunk_size)
+            while True:
+                with metrics.activate(timer):
+                    with metrics.stage(parse_stage):
+                        X = next(chunks, None)
+                    if X is None:
+                        break
+                    metrics.observe_batch(len(X))
+                    columns = predict_batch_columns(model_data, X, feature_order, explain)
+                    with metrics.stage('serialization'):
+                        results = batch_rows(columns, offset)
+                        if output_format == 'csv':
+                            text = format_csv(results, header=offset == 0)
+                        else:
+                            text = format_ndjson(results)
+                yield text
+                offset += len(results)
+        except Exception as e:
+            print(f"Stream prediction failed after {offset} rows: {e}")
+            if output_format == 'csv':
+                yield format_csv([{'index': 'error', 'category': str(e)}], header=offset == 0)
+            else:
+                yield format_ndjson([{'error': str(e), 'message': 'Stream prediction failed', 'rows_done': offset}])
+        finally:
+            metrics.record(timer.finish())
+    
+    mimetype = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
 @app.route('/api/model-info/<model_id>', methods=['GET'])
 def get_model_info(model_id):
     """Lấy thông tin chi tiết về model"""
-    if model_id not in loaded_models:
+    model_data = model_registry.get(model_id)
+    if model_data is None:
         return jsonify({
             'error': f'Model "{model_id}" not found',
-            'available_models': list(loaded_models.keys())
+            'available_models': model_registry.model_ids()
         }), 404
     
-    model_data = loaded_models[model_id]
     model = model_data['model']
-    metadata = model_metadata.get(model_id, {})
+    metadata = model_registry.metadata(model_id) or {}
     
     info = {
         'model_id': model_id,
-        'model_type': type(model).__name__,
+        'model_type': model_type_name(model),
         'metadata': metadata,
         'has_feature_names': model_data['feature_names'] is not None,
         'has_label_encoder': model_data['label_encoder'] is not None,
         'feature_names': model_data['feature_names']
     }
     
+    # Preprocessor lúc train (serving điền median / kẹp theo các giá trị này)
+    preprocessor = model_data.get('preprocessor')
+    if preprocessor is not None:
+        info['preprocessor'] = {
+            col: {'median': float(median), 'lower': float(lower), 'upper': float(upper)}
+            for col, median, lower, upper in zip(preprocessor.columns, preprocessor.median,
+                                                 preprocessor.lower, preprocessor.upper)
+        }
+    
     # Thêm thông tin về Decision Tree nếu có
     if hasattr(model, 'tree_'):
         info['tree_info'] = {
@@ -431,61 +1010,134 @@ def get_model_info(model_id):
     
     return jsonify(info)
 
+def on_models_reloaded(report):
+    """
+    Sau khi swap snapshot: bỏ response đã cache của model đã đổi/bị xóa, gọi
+    reload_listeners (vd. ASGI server tạo lại process pool), in báo cáo
+    """
+    if prediction_cache is not None:
+        for model_id in report['updated'] + report['removed']:
+            prediction_cache.invalidate(model_id)
+    for listener in list(reload_listeners):
+        try:
+            listener(report)
+        except Exception as e:
+            print(f"Reload listener failed: {e}")
+    
+    print("="*60)
+    print(f" Registry v{report['version']}: {len(report['added'])} added, "
+          f"{len(report['updated'])} updated, {len(report['removed'])} removed, "
+          f"{len(report['unchanged'])} unchanged ({report['timings']['total_seconds']:.3f}s)")
+    for model_id, path in report['failed'].items():
+        print(f"   Failed to load '{model_id}' from {path}")
+    print("="*60 + "\n")
+
 @app.route('/api/reload-models', methods=['POST'])
 def reload_models():
-    """Reload tất cả models (dùng khi cập nhật file model)"""
-    global loaded_models, model_metadata
-    loaded_models = {}
-    model_metadata = {}
+    """
+    Reload models đã thay đổi trên đĩa (dùng khi cập nhật file model)
     
+    Chỉ model mới/đã đổi (mtime + hash nội dung) được load, trên thread nền;
+    snapshot mới được swap khi load xong nên prediction không bị gián đoạn.
+    ?wait=false → trả về 202 ngay, xem kết quả ở /api/reload-status
+    """
     print("\n" + "="*60)
-    print("RELOADING ALL MODELS...")
+    print("RELOADING CHANGED MODELS...")
     print("="*60)
     
-    # Load predefined models
-    load_predefined_models()
-    
-    # Load models từ folder
-    if os.path.exists(MODELS_FOLDER):
-        load_all_models_from_folder(MODELS_FOLDER)
+    future = model_registry.reload_async(discover_models, callback=on_models_reloaded)
     
-    print("="*60)
-    print(f" Reloaded {len(loaded_models)} models")
-    print("="*60 + "\n")
+    if request.args.get('wait', 'true').lower() in ('0', 'false', 'no'):
+        return jsonify({
+            'success': True,
+            'message': 'Reload started',
+            'status_url': '/api/reload-status'
+        }), 202
     
+    report = future.result()
     return jsonify({
         'success': True,
-        'message': f'Reloaded {len(loaded_models)} models',
-        'models': list(loaded_models.keys())
+        'message': f"Reloaded {len(report['added']) + len(report['updated'])} models, "
+                   f"removed {len(report['removed'])}",
+        'models': model_registry.model_ids(),
+        **report
     })
 
+@app.route('/api/reload-status', methods=['GET'])
+def reload_status():
+    """Báo cáo của lần reload gần nhất"""
+    return jsonify({
+        'snapshot_version': model_registry.snapshot().version,
+        'last_reload': model_registry.last_reload
+    })
+
+@app.route('/api/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    Profile N request tiếp theo của một model
+    
+    POST {"model_id": "hanoi", "count": 5, "output": "file"|"response"} → arm (count=0: hủy)
+    GET → các model đang chờ profile và kết quả gần nhất (top hàm, file .prof)
+    409 khi inference chạy trong worker process: arm / kết quả chỉ nằm trong process này
+    """
+    if request_profiler is None:
+        return jsonify({'error': 'Profiling is disabled (set PROFILING_ENABLED=1)'}), 403
+    if inference_executor == 'process':
+        return jsonify({
+            'error': 'Admin profiling is not available with the process executor',
+            'message': 'Predictions run in worker processes; send "profile": true with the request '
+                       'or use --executor thread'
+        }), 409
+    
+    if request.method == 'GET':
+        return jsonify({
+            'armed': request_profiler.armed(),
+            'recent': request_profiler.recent(),
+            'output_dir': os.path.abspath(PROFILE_DIR)
+        })
+    
+    data = request.get_json(silent=True) or {}
+    model_id = data.get('model_id', 'default')
+    output = data.get('output', 'file')
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'count must be an integer'}), 400
+    if output not in PROFILE_OUTPUTS:
+        return jsonify({'error': f'Unsupported output: {output} (use file or response)'}), 400
+    if model_id not in model_registry:
+        return jsonify(model_not_found(model_id)[0]), 404
+    
+    if count <= 0:
+        return jsonify({'success': True, 'model_id': model_id, 'disarmed': request_profiler.disarm(model_id)})
+    state = request_profiler.arm(model_id, min(count, PROFILE_MAX_ARMED), output)
+    return jsonify({'success': True, 'model_id': model_id, **state})
+
 # ==================== KHỞI TẠO & RUN SERVER ====================
 
 def initialize_models():
-    """Khởi tạo và load tất cả models khi start server"""
+    """Khởi tạo danh sách models khi start server (model được load khi dùng lần đầu)"""
     print("\n" + "="*60)
     print("AIR QUALITY PREDICTION API")
     print("="*60)
-    print("LOADING MODELS...")
+    print("DISCOVERING MODELS...")
     print("="*60)
     
-    # Load predefined models từ MODEL_PATHS
-    load_predefined_models()
-    
-    # Load tất cả models từ MODELS_FOLDER
-    if os.path.exists(MODELS_FOLDER):
-        print(f"\nScanning folder: {MODELS_FOLDER}")
-        load_all_models_from_folder(MODELS_FOLDER)
-    else:
-        print(f"\nFolder '{MODELS_FOLDER}' not found. Create it to auto-load models.")
+    # Quét MODEL_PATHS và MODELS_FOLDER (chưa load)
+    startup_state['phase'] = 'discovery'
+    started = time.perf_counter()
+    found = discover_models()
+    model_registry.reload(found, preload=False)
+    startup_state['phases']['discovery_seconds'] = time.perf_counter() - started
+    startup_state['models'] = {model_id: {'status': 'pending'} for model_id in found}
     
     print("\n" + "="*60)
-    print(f" LOADED {len(loaded_models)} MODELS SUCCESSFULLY")
+    print(f" FOUND {len(found)} MODELS (memory budget {MODEL_MEMORY_BUDGET_MB:.0f} MB)")
     print("="*60)
     
-    if loaded_models:
+    if found:
         print("\nAvailable models:")
-        for model_id in loaded_models.keys():
+        for model_id in found.keys():
             print(f"   • {model_id}")
     else:
         print("\nNO MODELS LOADED!")
@@ -495,12 +1147,84 @@ def initialize_models():
         print("   3. MODELS_FOLDER contains .pkl files")
     
     print("="*60)
-    print("Server starting on http://localhost:5000")
+    print("Server starting...")
     print("="*60 + "\n")
+    
+    # Load + warm-up chạy nền: server nhận request ngay, /api/ready báo khi xong
+    if STARTUP_PRELOAD and found:
+        startup_state['phase'] = 'preload'
+        threading.Thread(target=preload_models, name='model-startup', daemon=True).start()
+    else:
+        mark_ready()
+
+def preload_models():
+    """Load song song tất cả models + warm-up, ghi thời gian từng model vào startup_state"""
+    started = time.perf_counter()
+    results = model_registry.preload(workers=STARTUP_LOAD_WORKERS)
+    for model_id, result in results.items():
+        metadata = model_registry.metadata(model_id) or {}
+        result['read_seconds'] = metadata.get('read_seconds')
+        result['warmup_seconds'] = metadata.get('warmup_seconds')
+    startup_state['models'] = results
+    startup_state['phases']['preload_seconds'] = time.perf_counter() - started
+    mark_ready()
+    
+    print("="*60)
+    print(f" STARTUP: {startup_state['phases']['total_seconds']:.2f}s "
+          f"(imports {_import_seconds:.2f}s, preload {startup_state['phases']['preload_seconds']:.2f}s, "
+          f"{STARTUP_LOAD_WORKERS} workers)")
+    for model_id, result in results.items():
+        if result['status'] == 'ready':
+            print(f"   • {model_id}: read {result['read_seconds']:.3f}s, "
+                  f"warm-up {result['warmup_seconds']:.3f}s")
+        else:
+            print(f"   • {model_id}: {result['status']}")
+    print("="*60 + "\n")
+
+def mark_ready():
+    startup_state['phases']['total_seconds'] = time.perf_counter() - _import_started
+    startup_state['phase'] = 'ready'
+    startup_state['ready_at'] = datetime.now().isoformat()
+    startup_state['ready'] = True
+
+def initialize_coalescer():
+    """Bật micro-batching cho /api/predict nếu COALESCE_ENABLED"""
+    global coalescer
+    if COALESCE_ENABLED:
+        coalescer = PredictionCoalescer(predict_rows, COALESCE_WINDOW_MS, COALESCE_MAX_BATCH)
+        print(f"Request coalescing: window={COALESCE_WINDOW_MS}ms, max_batch={COALESCE_MAX_BATCH}")
+
+def parse_args():
+    """Tham số dòng lệnh khi start server"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Air Quality Prediction API')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask',
+                        help='flask: dev server (mặc định), asgi: uvicorn + inference executor')
+    parser.add_argument('--executor', choices=['thread', 'process'], default=None,
+                        help='Loại pool chạy inference ở ASGI mode')
+    parser.add_argument('--workers', type=int, default=None, help='Số worker cho /api/predict')
+    parser.add_argument('--batch-workers', type=int, default=None, help='Số worker cho /api/predict-batch')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    # Load models trước khi start server
-    initialize_models()
+    args = parse_args()
     
-    # Start Flask server
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    if args.server == 'asgi':
+        # ASGI server tự load models trong lifespan startup
+        import asgi_server
+        asgi_server.run_asgi(
+            host=args.host,
+            port=args.port,
+            executor=args.executor or asgi_server.EXECUTOR_TYPE,
+            workers=args.workers or asgi_server.INFERENCE_WORKERS,
+            batch_workers=args.batch_workers or asgi_server.BATCH_WORKERS
+        )
+    else:
+        # Load models trước khi start server
+        initialize_models()
+        initialize_coalescer()
+        
+        # Start Flask server
+        app.run(debug=True, host=args.host, port=args.port)
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+# ==============================
+# BẢNG BREAKPOINT AQI (EPA)
+# ==============================
+# Mỗi bảng: [(C_low, C_high, I_low, I_high), ...] theo đúng thứ tự tăng dần
+EPA_BREAKPOINTS = {
+    'PM2.5': [
+        (0.0, 12.0, 0, 50),
+        (12.1, 35.4, 51, 100),
+        (35.5, 55.4, 101, 150),
+        (55.5, 150.4, 151, 200),
+        (150.5, 250.4, 201, 300),
+        (250.5, 500.0, 301, 500)
+    ],
+    'PM10': [
+        (0, 54, 0, 50),
+        (55, 154, 51, 100),
+        (155, 254, 101, 150),
+        (255, 354, 151, 200),
+        (355, 424, 201, 300),
+        (425, 604, 301, 500)
+    ],
+    'O3': [
+        (0, 54, 0, 50),
+        (55, 70, 51, 100),
+        (71, 85, 101, 150),
+        (86, 105, 151, 200),
+        (106, 200, 201, 300)
+    ],
+    'CO': [
+        (0.0, 4.4, 0, 50),
+        (4.5, 9.4, 51, 100),
+        (9.5, 12.4, 101, 150),
+        (12.5, 15.4, 151, 200),
+        (15.5, 30.4, 201, 300),
+        (30.5, 50.4, 301, 500)
+    ],
+    'NO2': [
+        (0, 53, 0, 50),
+        (54, 100, 51, 100),
+        (101, 360, 101, 150),
+        (361, 649, 151, 200),
+        (650, 1249, 201, 300),
+        (1250, 2049, 301, 500)
+    ],
+    'SO2': [
+        (0, 35, 0, 50),
+        (36, 75, 51, 100),
+        (76, 185, 101, 150),
+        (186, 304, 151, 200),
+        (305, 604, 201, 300),
+        (605, 1004, 301, 500)
+    ],
+}
+
+# train_model_v2 dùng bảng CO ngắn hơn (không có đoạn 30.5 - 50.4)
+V2_BREAKPOINTS = {
+    'PM2.5': EPA_BREAKPOINTS['PM2.5'],
+    'PM10': EPA_BREAKPOINTS['PM10'],
+    'CO': EPA_BREAKPOINTS['CO'][:5],
+}
+
+# Ngưỡng AQI chia category (aqi <= 50 → 0, <= 100 → 1, ...)
+AQI_CATEGORY_THRESHOLDS = np.array([50, 100, 150, 200, 300], dtype=np.float64)
+
+# Nhãn theo thứ tự category (train_model.py)
+EPA_LABELS = ['Tốt', 'Trung bình', 'Không tốt cho người nhạy cảm',
+              'Không tốt cho sức khỏe', 'Rất xấu', 'Nguy hại']
+
+# Nhãn theo thứ tự category (train_model_v2.py)
+V2_LABELS = ['Tốt', 'Trung bình', 'Kém', 'Xấu', 'Rất xấu', 'Nguy hại']
+
+
+def co_to_ppm(conc):
+    """Chuyển CO từ µg/m³ sang ppm (giá trị > 100 coi là µg/m³)"""
+    conc = np.asarray(conc, dtype=np.float64)
+    return np.where(conc > 100, conc / 1150, conc)
+
+
+# ==============================
+# AQI ENGINE (VECTORIZED)
+# ==============================
+class AQIEngine:
+    """
+    Tính AQI cho cả cột dữ liệu cùng lúc bằng NumPy (searchsorted + nội suy)
+
+    Giữ đúng hành vi của các hàm scalar cũ:
+    - giá trị rơi vào khoảng hở giữa 2 breakpoint hoặc vượt ngưỡng → I_high cuối
+    - negative_as_zero=True: giá trị âm → 0 (giống AQICalculator của v2)
+    - NaN → NaN (được bỏ qua khi lấy max)
+    """
+
+    def __init__(self, breakpoints=None, negative_as_zero=False):
+        self.negative_as_zero = negative_as_zero
+        self.tables = {}
+        for pollutant, bps in (breakpoints or EPA_BREAKPOINTS).items():
+            bps = np.asarray(bps, dtype=np.float64)
+            c_low, c_high, i_low, i_high = bps.T
+            self.tables[pollutant] = {
+                'c_low': c_low,
+                'c_high': c_high,
+                'i_low': i_low,
+                'slope': (i_high - i_low) / (c_high - c_low),
+                'overflow': i_high[-1],
+            }
+
+    def sub_index(self, pollutant, conc):
+        """AQI thành phần cho một mảng nồng độ"""
+        table = self.tables[pollutant]
+        conc = np.asarray(conc, dtype=np.float64)
+        if pollutant == 'CO':
+            conc = co_to_ppm(conc)
+
+        # Đoạn đầu tiên có C_high >= conc (NaN rơi ra cuối mảng)
+        idx = np.searchsorted(table['c_high'], conc, side='left')
+        seg = np.minimum(idx, len(table['c_high']) - 1)
+        c_low = table['c_low'][seg]
+
+        aqi = table['slope'][seg] * (conc - c_low) + table['i_low'][seg]
+        in_range = (idx < len(table['c_high'])) & (conc >= c_low)
+        aqi = np.where(in_range, aqi, table['overflow'])
+
+        if self.negative_as_zero:
+            aqi = np.where(conc < 0, 0.0, aqi)
+        return np.where(np.isnan(conc), np.nan, aqi)
+
+    def sub_indices(self, df, columns):
+        """
+        Tính nhiều AQI thành phần từ DataFrame
+        columns: {tên cột kết quả: (pollutant, cột nguồn)}
+        """
+        return pd.DataFrame({
+            out_col: self.sub_index(pollutant, df[src_col].to_numpy(dtype=np.float64, na_value=np.nan))
+            for out_col, (pollutant, src_col) in columns.items()
+        }, index=df.index)
+
+    @staticmethod
+    def max_aqi(sub_indices):
+        """AQI tổng hợp = max các AQI thành phần (bỏ qua NaN, cả dòng NaN → NaN)"""
+        values = np.asarray(sub_indices, dtype=np.float64)
+        all_nan = np.isnan(values).all(axis=1)
+        result = np.max(np.where(np.isnan(values), -np.inf, values), axis=1)
+        return np.where(all_nan, np.nan, result)
+
+    @staticmethod
+    def category_codes(aqi):
+        """Mã category 0..5 theo thang AQI, NaN → -1"""
+        aqi = np.asarray(aqi, dtype=np.float64)
+        codes = np.searchsorted(AQI_CATEGORY_THRESHOLDS, aqi, side='left').astype(np.int8)
+        codes[np.isnan(aqi)] = -1
+        return codes
+
+    def labels(self, aqi, labels=EPA_LABELS):
+        """Nhãn category dạng pd.Categorical (NaN → missing)"""
+        return pd.Categorical.from_codes(self.category_codes(aqi), categories=labels)
+
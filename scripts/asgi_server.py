@@ -0,0 +1,336 @@
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import parse_qsl
+
+import app as app_module
+from metrics import RequestRecord
+
+# ==================== CẤU HÌNH ASGI ====================
+
+EXECUTOR_TYPE = os.environ.get('INFERENCE_EXECUTOR', 'thread')   # 'thread' hoặc 'process'
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', '4'))  # Pool cho /api/predict
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '2'))          # Pool riêng cho /api/predict-batch
+IO_WORKERS = int(os.environ.get('IO_WORKERS', '8'))                # Các endpoint còn lại (health, models, ...)
+
+# Endpoint inference → (handler, tên pool, message lỗi, handler nhận body thô)
+INFERENCE_ROUTES = {
+    '/api/predict': ('handle_predict', 'predict', 'Prediction failed', False),
+    '/api/predict-batch': ('handle_predict_batch_request', 'batch', 'Batch prediction failed', True),
+}
+
+# Endpoint stream: body và response đi qua từng phần, không gom vào bộ nhớ
+STREAMING_ROUTES = ('/api/predict-stream',)
+
+# ==================== WORKER PROCESS ====================
+
+def _init_worker():
+    """
+    Khởi tạo registry trong worker process (mỗi process load model riêng khi dùng)
+
+    Worker được spawn (không fork): fork lúc thread preload của process chính đang
+    giữ lock của ModelRegistry sẽ copy lock bị khóa vĩnh viễn sang worker.
+    """
+    if not app_module.model_registry.model_ids():
+        app_module.initialize_models()
+        app_module.initialize_coalescer()
+
+def _run_handler(path, handler_name, raw, body, args, headers):
+    """
+    Parse JSON, chạy handler và encode response trong pool (hàm top-level để pickle
+    được cho process pool)
+
+    Parse/encode trong worker để body lớn không chặn event loop. Handler raw tự xử lý
+    body theo Content-Type (JSON, binary, Arrow). Trả về (status, headers, content,
+    metrics record): record được ghi ở process chính nên process pool không mất số đo.
+    """
+    metrics = app_module.metrics
+    with metrics.track(path, defer=True) as req:
+        handler = getattr(app_module, handler_name)
+        if raw:
+            mimetype = headers.get('content-type', '').split(';')[0].strip().lower()
+            payload, status = handler(body, mimetype, headers, args)
+        else:
+            try:
+                with metrics.stage('json_parse'):
+                    data = json.loads(body) if body else {}
+            except ValueError:
+                data = {}
+            if not isinstance(data, dict):
+                data = {}
+            payload, status = handler(data, args)
+        with metrics.stage('serialization'):
+            response_headers, content = _encode_payload(payload)
+        req.status = status
+    return status, response_headers, content, req.result
+
+def _encode_payload(payload):
+    headers = [(b'access-control-allow-origin', b'*')]  # Giống CORS(app)
+    if isinstance(payload, app_module.BinaryResponse):
+        headers.append((b'content-type', payload.mimetype.encode('latin-1')))
+        headers.extend((k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in payload.headers.items())
+        return headers, payload.body
+    headers.append((b'content-type', b'application/json'))
+    return headers, app_module.app.json.dumps(payload).encode('utf-8') + b'\n'
+
+# ==================== STREAMING BRIDGE ====================
+
+class _ReceiveStream(io.RawIOBase):
+    """wsgi.input đọc body trực tiếp từ ASGI receive (gọi từ worker thread)"""
+
+    def __init__(self, loop, receive):
+        self._loop = loop
+        self._receive = receive
+        self._buffer = b''
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._done:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            self._buffer = message.get('body', b'')
+            self._done = not message.get('more_body', False)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+# ==================== ASGI APPLICATION ====================
+
+class AirQualityASGI:
+    """
+    ASGI app cho các endpoint của app.py
+
+    - /api/predict và /api/predict-batch chạy trên 2 pool riêng (thread hoặc process)
+      nên batch chậm không chặn prediction nhỏ
+    - Các endpoint còn lại đi qua Flask app (WSGI) trên pool I/O riêng,
+      health check không bao giờ phải chờ inference
+    """
+
+    def __init__(self, executor=EXECUTOR_TYPE, workers=INFERENCE_WORKERS,
+                 batch_workers=BATCH_WORKERS, io_workers=IO_WORKERS):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor type: {executor}")
+        self.executor = executor
+        self.workers = workers
+        self.batch_workers = batch_workers
+        self.io_workers = io_workers
+        self.pools = {}
+        self._loop = None
+
+    def _make_pool(self, size):
+        if self.executor == 'process':
+            return ProcessPoolExecutor(max_workers=size, initializer=_init_worker,
+                                       mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=size)
+
+    def startup(self):
+        if not app_module.model_registry.model_ids():
+            app_module.initialize_models()
+            app_module.initialize_coalescer()
+        self.pools = {
+            'predict': self._make_pool(self.workers),
+            'batch': self._make_pool(self.batch_workers),
+            'io': ThreadPoolExecutor(max_workers=self.io_workers),
+            # Stream luôn chạy bằng thread (cần đọc/ghi socket trong lúc inference)
+            'stream': ThreadPoolExecutor(max_workers=self.batch_workers),
+        }
+        app_module.inference_executor = self.executor
+        if self.executor == 'process':
+            self._loop = asyncio.get_running_loop()
+            app_module.reload_listeners.append(self._on_models_reloaded)
+        print(f"Inference executor: {self.executor} "
+              f"(predict={self.workers}, batch={self.batch_workers}, io={self.io_workers})")
+
+    def shutdown(self):
+        if self._on_models_reloaded in app_module.reload_listeners:
+            app_module.reload_listeners.remove(self._on_models_reloaded)
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self.pools = {}
+
+    def _on_models_reloaded(self, report):
+        """Reload xong (thread nền của registry, cả khi ?wait=false) → recycle pool trên event loop"""
+        if report['added'] or report['updated'] or report['removed']:
+            self._loop.call_soon_threadsafe(self.recycle_process_pools)
+
+    def recycle_process_pools(self):
+        """Process worker giữ bản model riêng → tạo lại pool sau khi reload"""
+        if self.executor != 'process':
+            return
+        for name, size in (('predict', self.workers), ('batch', self.batch_workers)):
+            old = self.pools[name]
+            self.pools[name] = self._make_pool(size)
+            old.shutdown(wait=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        if not self.pools:
+            self.startup()
+
+        loop = asyncio.get_running_loop()
+        if scope['path'] in STREAMING_ROUTES:
+            await loop.run_in_executor(self.pools['stream'], self._call_wsgi_streaming,
+                                       scope, loop, receive, send)
+            return
+
+        body = await self._read_body(receive)
+        route = INFERENCE_ROUTES.get(scope['path'])
+
+        if route is not None and scope['method'] == 'POST':
+            handler_name, pool_name, error_message, raw = route
+            args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+            request_headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                               for name, value in scope.get('headers', [])}
+            started = time.perf_counter()
+            try:
+                status, headers, content, record = await loop.run_in_executor(
+                    self.pools[pool_name], _run_handler, scope['path'], handler_name, raw, body,
+                    args, request_headers)
+            except Exception as e:
+                status = 500
+                headers, content = _encode_payload({'error': str(e), 'message': error_message})
+                record = RequestRecord(scope['path'], None, status, time.perf_counter() - started, {}, None)
+            app_module.metrics.record(record)
+            await self._send(send, status, headers, [content])
+            return
+
+        status, headers, chunks = await loop.run_in_executor(
+            self.pools['io'], self._call_wsgi, scope, body)
+        await self._send(send, status, headers, chunks)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    @staticmethod
+    async def _send(send, status, headers, chunks):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    @staticmethod
+    def _wsgi_environ(scope, input_stream, content_length):
+        """WSGI environ từ ASGI scope (content_length=None → body chunked, đọc tới EOF)"""
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': input_stream,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            key = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if key == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif key != 'CONTENT_LENGTH':
+                environ[f'HTTP_{key}'] = value
+        if content_length is not None:
+            environ['CONTENT_LENGTH'] = str(content_length)
+        else:
+            environ['wsgi.input_terminated'] = True  # Đọc tới hết body (chunked)
+        return environ
+
+    @classmethod
+    def _call_wsgi(cls, scope, body):
+        """Gọi Flask app (WSGI) cho các endpoint không phải inference"""
+        environ = cls._wsgi_environ(scope, io.BytesIO(body), len(body))
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        result = app_module.app.wsgi_app(environ, start_response)
+        try:
+            chunks = [chunk for chunk in result if chunk]
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], chunks
+
+    @classmethod
+    def _call_wsgi_streaming(cls, scope, loop, receive, send):
+        """
+        Gọi Flask app cho endpoint stream trên worker thread
+
+        Body được đọc dần qua receive, mỗi chunk response được gửi ngay và chờ
+        gửi xong mới sinh chunk tiếp (client chậm → server tự chậm lại).
+        """
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        environ = cls._wsgi_environ(scope, io.BufferedReader(_ReceiveStream(loop, receive)), None)
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers
+                                   if k.lower() != 'content-length']
+
+        result = app_module.app.wsgi_app(environ, start_response)
+        try:
+            call({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            for chunk in result:
+                if chunk:
+                    call({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            call({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+application = AirQualityASGI()
+
+def run_asgi(host='0.0.0.0', port=5000, executor=EXECUTOR_TYPE, workers=INFERENCE_WORKERS,
+             batch_workers=BATCH_WORKERS, io_workers=IO_WORKERS):
+    """Chạy ASGI server bằng uvicorn"""
+    try:
+        import uvicorn
+    except ImportError:
+        print("ASGI mode cần uvicorn: pip install uvicorn")
+        sys.exit(1)
+
+    asgi_app = AirQualityASGI(executor, workers, batch_workers, io_workers)
+    uvicorn.run(asgi_app, host=host, port=port, lifespan='on')
@@ -0,0 +1,533 @@
+"""
+Benchmark tải cho prediction API (app.py)
+
+Tạo model tổng hợp cùng cấu trúc output của train_model.py (Decision Tree) và
+train_model_v2.py (RandomForest trong ImbPipeline), rồi đo /api/predict,
+/api/predict-batch và /api/reload-models qua Flask test client (in-process)
+và/hoặc HTTP thật (server tự spawn hoặc --url), ở nhiều mức concurrency.
+Kết quả (throughput, p50/p95/p99) ghi ra JSON để so sánh giữa các lần chạy.
+
+Ví dụ:
+    python benchmark_api.py --transport test_client http --concurrency 1,8
+    python benchmark_api.py --compare benchmark_api_old.json
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import pickle
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from aqi_engine import AQIEngine, EPA_LABELS, V2_BREAKPOINTS, V2_LABELS
+from model_artifact import artifact_path_for, save_artifact
+
+# ==================== CẤU HÌNH BENCHMARK ====================
+
+# Feature giống output của train_model.py (không có cột thời gian) và train_model_v2.py
+DT_FEATURES = ['PM2.5', 'PM10', 'O3', 'CO', 'NO2', 'SO2', 'Temperature', 'Humidity',
+               'PM_ratio', 'Pollution_Index', 'Temp_Humidity']
+V2_FEATURES = ['PM2.5', 'PM10', 'O3', 'CO', 'NO2', 'SO2', 'Temperature', 'Humidity',
+               'PM_ratio', 'Temp_Humid_Idx']
+
+# model_id = tên file trong <workdir>/models (app.py tự quét MODELS_FOLDER)
+BENCH_MODELS = {'bench_dt': 'models/bench_dt.pkl', 'bench_rf': 'models/bench_rf.pkl'}
+
+DEFAULT_WORKDIR = 'benchmark_api_work'
+DEFAULT_OUTPUT = 'benchmark_api.json'
+SERVER_READY_TIMEOUT = 120
+MIN_CLASS_SAMPLES = 10   # SMOTE cần đủ láng giềng trong mỗi class
+
+
+# ==================== DỮ LIỆU & MODEL TỔNG HỢP ====================
+
+def synthetic_pollution(n, seed=42):
+    """
+    n dòng đo giả lập: các chất ô nhiễm tương quan qua một mức ô nhiễm chung
+    (giờ cao điểm cao hơn), phân phối lệch phải như dữ liệu thật
+    """
+    rng = np.random.default_rng(seed)
+    hour = rng.integers(0, 24, n)
+    rush = np.isin(hour, [7, 8, 9, 17, 18, 19])
+    episode = rng.lognormal(0.0, 0.6, n) * (1 + 0.3 * rush)
+
+    pm25 = 35 * episode * rng.lognormal(0.0, 0.25, n)
+    df = pd.DataFrame({
+        'PM2.5': pm25,
+        'PM10': pm25 * rng.uniform(1.3, 2.2, n),
+        'O3': rng.gamma(2.0, 25.0, n),
+        'CO': 800 * episode * rng.lognormal(0.0, 0.3, n),   # µg/m³
+        'NO2': 30 * episode * rng.lognormal(0.0, 0.35, n),
+        'SO2': 15 * episode * rng.lognormal(0.0, 0.5, n),
+        'Temperature': rng.normal(27, 5, n),
+        'Humidity': np.clip(rng.normal(75, 12, n), 20, 100),
+    })
+
+    # Feature engineering giống create_features (v1) và prepare_data (v2)
+    df['PM_ratio'] = df['PM2.5'] / (df['PM10'] + 1e-6)
+    df['Pollution_Index'] = (df['PM2.5'] * 0.35 + df['PM10'] * 0.25 + df['O3'] * 0.15 +
+                             df['NO2'] * 0.10 + df['SO2'] * 0.10 + df['CO'] * 0.05)
+    df['Temp_Humidity'] = df['Temperature'] * df['Humidity'] / 100
+    df['Temp_Humid_Idx'] = df['Temp_Humidity']
+    return df
+
+
+def sample_features(feature_names, n, seed=0):
+    """n vector feature (dict) cho request, khác seed với dữ liệu train"""
+    df = synthetic_pollution(n, seed)
+    return df[list(feature_names)].round(3).to_dict('records')
+
+
+def _drop_rare_classes(X, y):
+    labels, counts = np.unique(y, return_counts=True)
+    keep = np.isin(y, labels[counts >= MIN_CLASS_SAMPLES])
+    return X[keep], y[keep]
+
+
+def build_dt_model(df):
+    """Decision Tree + LabelEncoder như train_model.py (nhãn EPA 6 mức)"""
+    from sklearn.preprocessing import LabelEncoder
+    from sklearn.tree import DecisionTreeClassifier
+
+    engine = AQIEngine()
+    sub_aqi = engine.sub_indices(df, {p: (p, p) for p in ['PM2.5', 'PM10', 'O3', 'CO', 'NO2', 'SO2']})
+    y = np.asarray(engine.labels(engine.max_aqi(sub_aqi), EPA_LABELS).astype(str))
+    X, y = _drop_rare_classes(df[DT_FEATURES], y)
+
+    le = LabelEncoder()
+    model = DecisionTreeClassifier(max_depth=15, min_samples_split=50, min_samples_leaf=20,
+                                   class_weight='balanced', random_state=42)
+    model.fit(X, le.fit_transform(y))
+    return {
+        'model': model,
+        'model_name': 'Decision Tree',
+        'feature_names': DT_FEATURES,
+        'label_encoder': le,
+        'training_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'version': '2.0'
+    }
+
+
+def build_rf_model(df, n_estimators=100):
+    """StandardScaler → SMOTE → RandomForest (ImbPipeline) như train_model_v2.py"""
+    from imblearn.over_sampling import SMOTE
+    from imblearn.pipeline import Pipeline as ImbPipeline
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+    engine = AQIEngine(V2_BREAKPOINTS, negative_as_zero=True)
+    sub_aqi = engine.sub_indices(df, {'AQI_PM25': ('PM2.5', 'PM2.5'), 'AQI_PM10': ('PM10', 'PM10'),
+                                      'AQI_CO': ('CO', 'CO')})
+    y = np.asarray(engine.labels(engine.max_aqi(sub_aqi), V2_LABELS).astype(str))
+    X, y = _drop_rare_classes(df[V2_FEATURES], y)
+
+    le = LabelEncoder()
+    pipeline = ImbPipeline([
+        ('scaler', StandardScaler()),
+        ('smote', SMOTE(random_state=42)),
+        ('rf', RandomForestClassifier(n_estimators=n_estimators, max_depth=15, random_state=42, n_jobs=-1))
+    ])
+    pipeline.fit(X, le.fit_transform(y))
+    return {
+        'model': pipeline,
+        'feature_names': V2_FEATURES,
+        'label_encoder': le,
+        'date': datetime.now()
+    }
+
+
+def save_bench_model(model_data, path, artifact=True):
+    """Ghi pkl (và artifact .aqm giống script train) → đường dẫn app.py sẽ load"""
+    with open(path, 'wb') as f:
+        pickle.dump(model_data, f)
+    if artifact:
+        saved = save_artifact(artifact_path_for(path), model_data['model'], model_data['feature_names'],
+                              model_data['label_encoder'])
+        if saved:
+            return saved
+    shutil.rmtree(artifact_path_for(path), ignore_errors=True)
+    return path
+
+
+def build_models(workdir, n_rows=20000, rf_trees=100, artifacts=True, seed=42):
+    """Train và lưu 2 model tổng hợp vào <workdir>/models, trả về thông tin từng model"""
+    os.makedirs(os.path.join(workdir, 'models'), exist_ok=True)
+    df = synthetic_pollution(n_rows, seed)
+    builders = {
+        'bench_dt': lambda: build_dt_model(df),
+        'bench_rf': lambda: build_rf_model(df, rf_trees),
+    }
+    info = {}
+    for model_id, build in builders.items():
+        started = time.perf_counter()
+        model_data = build()
+        served = save_bench_model(model_data, os.path.join(workdir, BENCH_MODELS[model_id]), artifacts)
+        info[model_id] = {
+            'path': os.path.relpath(served, workdir),
+            'format': 'artifact' if served.endswith('.aqm') else 'pickle',
+            'model_type': type(model_data['model']).__name__,
+            'n_features': len(model_data['feature_names']),
+            'classes': [str(c) for c in model_data['label_encoder'].classes_],
+            'build_seconds': time.perf_counter() - started
+        }
+        print(f"✓ {model_id}: {info[model_id]['model_type']} → {served} ({info[model_id]['build_seconds']:.1f}s)")
+    return info
+
+
+def change_model_file(workdir, model_id):
+    """Ghi lại model với nội dung khác (hash đổi) để reload phải load thật"""
+    pkl_path = os.path.join(workdir, BENCH_MODELS[model_id])
+    aqm_path = artifact_path_for(pkl_path)
+    if os.path.isdir(aqm_path):
+        manifest_path = os.path.join(aqm_path, 'manifest.json')
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        manifest['metadata']['benchmark_nonce'] = time.time_ns()
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return
+    with open(pkl_path, 'rb') as f:
+        model_data = pickle.load(f)
+    model_data['benchmark_nonce'] = time.time_ns()
+    with open(pkl_path, 'wb') as f:
+        pickle.dump(model_data, f)
+
+
+# ==================== TRANSPORT ====================
+
+class TestClientTransport:
+    """Gọi app.py in-process qua Flask test client (mỗi thread một client)"""
+
+    name = 'test_client'
+
+    def __init__(self, workdir, cache=False):
+        os.chdir(workdir)
+        import app as app_module
+        self.app_module = app_module
+        app_module.STARTUP_PRELOAD = False
+        if not cache:
+            app_module.prediction_cache = None
+        app_module.initialize_models()
+        app_module.initialize_coalescer()
+        app_module.model_registry.preload(workers=app_module.STARTUP_LOAD_WORKERS)
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app_module.app.test_client()
+        response = client.open(path, method=method, data=body, content_type='application/json')
+        return response.status_code, response.get_data()
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    """HTTP/1.1 keep-alive (mỗi thread một connection), tự kết nối lại khi server đóng"""
+
+    name = 'http'
+
+    def __init__(self, base_url, process=None, log=None):
+        parsed = urllib.parse.urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.process = process
+        self.log = log
+        self._local = threading.local()
+
+    def _connection(self, fresh=False):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or fresh:
+            if conn is not None:
+                conn.close()
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        return conn
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            conn = self._connection(fresh=attempt > 0)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                if response.will_close:
+                    self._local.conn = None
+                    conn.close()
+                return response.status, data
+            except (http.client.HTTPException, ConnectionError):
+                if attempt:
+                    raise
+
+    def wait_ready(self, timeout=SERVER_READY_TIMEOUT):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}")
+            try:
+                status, _ = self.request('GET', '/api/ready')
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise TimeoutError(f"Server not ready after {timeout}s")
+
+    def close(self):
+        if self.process is not None:
+            # Server chạy trong process group riêng (Flask debug reloader có process con)
+            os.killpg(self.process.pid, signal.SIGTERM)
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+        if self.log is not None:
+            self.log.close()
+
+
+def spawn_server(workdir, server, port, cache=False, log_path=None):
+    """Chạy app.py (flask hoặc asgi) trong workdir, trả về HTTPTransport khi /api/ready = 200"""
+    env = dict(os.environ, CACHE_ENABLED='1' if cache else '0', PYTHONUNBUFFERED='1')
+    log = open(log_path or os.path.join(workdir, f'server_{server}.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPTS_DIR, 'app.py'), '--server', server,
+         '--host', '127.0.0.1', '--port', str(port)],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    transport = HTTPTransport(f'http://127.0.0.1:{port}', process, log)
+    try:
+        transport.wait_ready()
+    except Exception:
+        transport.close()
+        raise
+    return transport
+
+
+# ==================== CHẠY TẢI & THỐNG KÊ ====================
+
+def summarize(latencies, errors, wall_seconds, rows_per_request=1):
+    """Latency (ms) → throughput và các percentile"""
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000.0
+    n = len(latencies)
+    summary = {
+        'requests': n,
+        'errors': errors,
+        'wall_seconds': wall_seconds,
+        'throughput_rps': n / wall_seconds if wall_seconds > 0 else 0.0,
+        'latency_ms': {
+            'mean': float(latencies.mean()) if n else None,
+            'p50': float(np.percentile(latencies, 50)) if n else None,
+            'p95': float(np.percentile(latencies, 95)) if n else None,
+            'p99': float(np.percentile(latencies, 99)) if n else None,
+            'max': float(latencies.max()) if n else None,
+        }
+    }
+    if rows_per_request > 1:
+        summary['rows_per_request'] = rows_per_request
+        summary['rows_per_second'] = summary['throughput_rps'] * rows_per_request
+    return summary
+
+
+def run_load(transport, method, path, bodies, total, concurrency, warmup=0):
+    """
+    Gửi `total` request (bodies dùng xoay vòng) từ `concurrency` thread
+
+    Trả về (latencies giây, số lỗi, wall time). Warm-up không tính vào kết quả.
+    """
+    for i in range(warmup):
+        transport.request(method, path, bodies[i % len(bodies)])
+
+    counter = itertools.count()
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+
+    def worker(slot):
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            started = time.perf_counter()
+            try:
+                status, _ = transport.request(method, path, bodies[i % len(bodies)])
+            except Exception:
+                status = 599
+            latencies[slot].append(time.perf_counter() - started)
+            if status >= 400:
+                errors[slot] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+    return [x for chunk in latencies for x in chunk], sum(errors), wall
+
+
+def run_scenarios(transport, workdir, args):
+    """Chạy predict / predict-batch / reload cho mọi model và mức concurrency"""
+    results = {}
+
+    def record(name, concurrency, latencies, errors, wall, rows=1):
+        key = f'{name}@c{concurrency}'
+        results[key] = summarize(latencies, errors, wall, rows)
+        r = results[key]
+        print(f"   {key:<40} {r['throughput_rps']:>9.1f} req/s  p50 {r['latency_ms']['p50']:>8.2f}ms  "
+              f"p95 {r['latency_ms']['p95']:>8.2f}ms  p99 {r['latency_ms']['p99']:>8.2f}ms  errors {errors}")
+
+    for model_id in BENCH_MODELS:
+        features = DT_FEATURES if model_id == 'bench_dt' else V2_FEATURES
+        # Vector khác nhau cho mỗi request → không trúng prediction cache
+        pool = sample_features(features, max(args.requests, 1), seed=args.seed + 1)
+        bodies = [json.dumps({'model_id': model_id, 'features': f}).encode() for f in pool]
+        for concurrency in args.concurrency:
+            record(f'predict:{model_id}', concurrency,
+                   *run_load(transport, 'POST', '/api/predict', bodies, args.requests, concurrency, args.warmup))
+
+        for size in args.batch_sizes:
+            samples = sample_features(features, size, seed=args.seed + 2)
+            body = [json.dumps({'model_id': model_id, 'samples': samples}).encode()]
+            for concurrency in args.concurrency:
+                record(f'predict-batch:{model_id}:{size}', concurrency,
+                       *run_load(transport, 'POST', '/api/predict-batch', body, args.batch_requests,
+                                 concurrency, min(args.warmup, 2)), rows=size)
+
+    # Reload: không đổi gì (chỉ scan) và sau khi ghi lại file RF (load + warm-up thật)
+    if args.reload_requests:
+        latencies, errors, wall = run_load(transport, 'POST', '/api/reload-models', [b'{}'], args.reload_requests, 1)
+        record('reload:unchanged', 1, latencies, errors, wall)
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(args.reload_requests):
+            change_model_file(workdir, 'bench_rf')
+            t0 = time.perf_counter()
+            status, _ = transport.request('POST', '/api/reload-models', b'{}')
+            latencies.append(time.perf_counter() - t0)
+            errors += status >= 400
+        record('reload:changed', 1, latencies, errors, time.perf_counter() - started)
+    return results
+
+
+# ==================== REPORT ====================
+
+def environment_info():
+    import sklearn
+    info = {
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+    }
+    try:
+        info['git_commit'] = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPTS_DIR, capture_output=True,
+                                            text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        info['git_commit'] = None
+    return info
+
+
+def compare_reports(current, baseline_path):
+    """In thay đổi throughput / p95 so với một report cũ (+ = nhanh hơn)"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nSo sánh với {baseline_path} ({baseline['environment'].get('git_commit')}):")
+    for transport, results in current['results'].items():
+        for key, result in results.items():
+            old = baseline.get('results', {}).get(transport, {}).get(key)
+            if not old or not old['throughput_rps']:
+                continue
+            rps = result['throughput_rps'] / old['throughput_rps'] - 1
+            p95 = old['latency_ms']['p95'] / result['latency_ms']['p95'] - 1
+            flag = '  ⚠️' if rps < -0.1 or p95 < -0.1 else ''
+            print(f"   {transport}/{key:<40} throughput {rps:+7.1%}  p95 {p95:+7.1%}{flag}")
+
+
+def parse_int_list(value):
+    return [int(x) for x in value.split(',') if x.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test benchmark cho prediction API')
+    parser.add_argument('--transport', nargs='+', choices=['test_client', 'http'], default=['test_client'])
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='asgi', help='Server spawn cho HTTP')
+    parser.add_argument('--url', default=None, help='Dùng server có sẵn (phải thấy models trong --workdir)')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--concurrency', type=parse_int_list, default=[1, 8], help='VD: 1,8,32')
+    parser.add_argument('--requests', type=int, default=500, help='Số request /api/predict mỗi kịch bản')
+    parser.add_argument('--batch-sizes', type=parse_int_list, default=[100, 1000])
+    parser.add_argument('--batch-requests', type=int, default=20)
+    parser.add_argument('--reload-requests', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=20000, help='Số dòng train cho model tổng hợp')
+    parser.add_argument('--rf-trees', type=int, default=100)
+    parser.add_argument('--no-artifacts', action='store_true', help='Chỉ lưu pkl (không ghi .aqm)')
+    parser.add_argument('--cache', action='store_true', help='Bật prediction cache của server')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--compare', default=None, help='Report JSON cũ để so sánh')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output)
+    compare = os.path.abspath(args.compare) if args.compare else None
+    workdir = os.path.abspath(args.workdir)
+
+    print("=" * 70)
+    print("BUILD SYNTHETIC MODELS")
+    print("=" * 70)
+    models = build_models(workdir, args.rows, args.rf_trees, not args.no_artifacts, args.seed)
+
+    report = {
+        'environment': environment_info(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'models': models,
+        'results': {}
+    }
+
+    for name in args.transport:
+        print("\n" + "=" * 70)
+        print(f"TRANSPORT: {name}")
+        print("=" * 70)
+        if name == 'test_client':
+            transport = TestClientTransport(workdir, args.cache)
+        elif args.url:
+            transport = HTTPTransport(args.url)
+            transport.wait_ready()
+        else:
+            transport = spawn_server(workdir, args.server, args.port, args.cache)
+        try:
+            report['results'][name] = run_scenarios(transport, workdir, args)
+        finally:
+            transport.close()
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✓ Report: {output}")
+
+    if compare:
+        compare_reports(report, compare)
+    return report
+
+
+if __name__ == '__main__':
+    main()
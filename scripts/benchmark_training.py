@@ -0,0 +1,284 @@
+"""
+Benchmark pipeline train (train_model.main và AirQualityModel.train)
+
+Sinh CSV trạm quan trắc tổng hợp (PM2.5, TSP, O3, CO, NO2, SO2, Temperature,
+Humidity, DateTime) ở nhiều kích thước, chạy từng pipeline trong một process
+riêng (peak memory không lẫn giữa các lần chạy) và đo thời gian + peak memory
+từng stage: load_data, create_pollution_labels, create_features,
+preprocess_data, resample (SMOTE), fit (gồm cross-validation), evaluation, save. Kết quả ghi
+ra JSON kèm hệ số scaling giữa các kích thước để thấy stage nào tăng nhanh nhất.
+
+Ví dụ:
+    python benchmark_training.py --sizes 10000,100000
+    python benchmark_training.py --pipelines v2 --sizes 1000000,10000000 --timeout 7200
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from benchmark_api import environment_info, parse_int_list, synthetic_pollution
+from dataset_cache import load_dataset
+from stage_timer import StageTimer
+
+# ==================== CẤU HÌNH BENCHMARK ====================
+
+DEFAULT_SIZES = '10000,100000,1000000,10000000'
+PIPELINES = ('v1', 'v2')   # v1 = train_model.main, v2 = AirQualityModel.train
+DEFAULT_DATADIR = 'benchmark_training_data'
+DEFAULT_WORKDIR = 'benchmark_training_work'
+DEFAULT_OUTPUT = 'benchmark_training.json'
+CHUNK_ROWS = 1_000_000     # Sinh CSV theo chunk để 10M dòng không cần giữ cả bảng trong RAM
+N_STATIONS = 20
+NAN_FRACTION = 0.005       # Tỉ lệ ô trống trong mỗi cột đo (giống dữ liệu trạm thật)
+MIN_STAGE_SECONDS = 0.05   # Stage ngắn hơn không dùng để xếp hạng scaling (nhiễu)
+
+MEASURED_COLUMNS = ['PM2.5', 'TSP', 'O3', 'CO', 'NO2', 'SO2', 'Temperature', 'Humidity']
+
+
+# ==================== DỮ LIỆU TỔNG HỢP ====================
+
+def station_chunk(start, n, seed):
+    """n dòng CSV trạm, bắt đầu từ dòng thứ start (các trạm xen kẽ, mỗi trạm 1 dòng / giờ)"""
+    rng = np.random.default_rng(seed)
+    df = synthetic_pollution(n, seed)
+    df['TSP'] = df['PM10'] * 1.5   # Trạm đo TSP, pipeline tự ước lượng PM10 = TSP / 1.5
+    df = df[MEASURED_COLUMNS]
+
+    mask = rng.random(df.shape) < NAN_FRACTION
+    df = df.mask(mask)
+
+    index = np.arange(start, start + n)
+    df.insert(0, 'Station', 'ST' + pd.Series(index % N_STATIONS).astype(str).str.zfill(3))
+    df['DateTime'] = pd.Timestamp('2020-01-01') + pd.to_timedelta(index // N_STATIONS, unit='h')
+    return df
+
+
+def ensure_dataset(datadir, n, seed=42):
+    """Đường dẫn CSV n dòng (sinh nếu chưa có, dùng lại cho các lần chạy sau)"""
+    os.makedirs(datadir, exist_ok=True)
+    path = os.path.join(datadir, f'stations_{n}.csv')
+    if os.path.exists(path):
+        return path
+
+    print(f"⏳ Sinh {n:,} dòng → {path}")
+    started = time.perf_counter()
+    tmp_path = path + '.tmp'
+    for i, start in enumerate(range(0, n, CHUNK_ROWS)):
+        chunk = station_chunk(start, min(CHUNK_ROWS, n - start), seed + i)
+        chunk.to_csv(tmp_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False,
+                      float_format='%.3f', date_format='%Y-%m-%d %H:%M:%S')
+    os.replace(tmp_path, path)
+    print(f"   ✓ {os.path.getsize(path) / 1024**2:.1f} MB trong {time.perf_counter() - started:.1f}s")
+    return path
+
+
+# ==================== CHẠY MỘT PIPELINE ====================
+
+def run_pipeline(pipeline, csv_path, memory, cache=False):
+    """
+    Chạy pipeline trên csv_path trong thư mục hiện tại → report từng stage
+
+    cache=True: load_data đọc từ cache dạng cột (đã build sẵn) thay vì parse CSV.
+    """
+    import train_model
+    import train_model_v2
+
+    timer = StageTimer(memory)
+    started = time.perf_counter()
+    if pipeline == 'v1':
+        train_model.main(csv_path, timer=timer, cache=cache, use_stage_cache=False)
+    else:
+        with timer.stage('load_data'):
+            df = train_model_v2.load_data(csv_path, columns=train_model_v2.DATA_COLUMNS, cache=cache)
+        model = train_model_v2.AirQualityModel()
+        model.train(df, timer=timer)
+        with timer.stage('save'):
+            model.save()
+    return {
+        'total_seconds': time.perf_counter() - started,
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'stages': timer.report()
+    }
+
+
+def run_isolated(pipeline, csv_path, n, args):
+    """Chạy pipeline trong process con (log riêng, timeout); lỗi được ghi lại thay vì dừng benchmark"""
+    workdir = os.path.join(args.workdir, f'{pipeline}_{n}')
+    os.makedirs(workdir, exist_ok=True)
+    result_path = os.path.join(workdir, 'result.json')
+    log_path = os.path.join(workdir, 'train.log')
+    if os.path.exists(result_path):
+        os.remove(result_path)
+
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-one', pipeline,
+           '--csv', csv_path, '--result', result_path, '--memory', args.memory]
+    if args.dataset_cache:
+        cmd.append('--dataset-cache')
+    env = dict(os.environ, MPLBACKEND='Agg', DATASET_CACHE_DIR=dataset_cache_dir(args))
+    started = time.perf_counter()
+    result = {'pipeline': pipeline, 'rows': n, 'log': log_path}
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log:
+            proc = subprocess.run(cmd, cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+                                  env=env, timeout=args.timeout)
+        if proc.returncode == 0 and os.path.exists(result_path):
+            with open(result_path, encoding='utf-8') as f:
+                result.update(json.load(f))
+        else:
+            result['error'] = f'exit code {proc.returncode}: {_last_line(log_path)}'
+    except subprocess.TimeoutExpired:
+        result['error'] = f'timeout after {args.timeout}s'
+    result['wall_seconds'] = time.perf_counter() - started
+    return result
+
+
+def dataset_cache_dir(args):
+    return os.path.join(args.datadir, '.cache')
+
+
+def _last_line(path):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return lines[-1] if lines else ''
+
+
+# ==================== PHÂN TÍCH ====================
+
+def scaling_exponents(runs):
+    """
+    Hệ số k của t ~ n^k cho từng stage giữa hai kích thước liên tiếp
+    (k ≈ 1: tuyến tính, k > 1: tăng nhanh hơn dữ liệu)
+    """
+    ok = sorted((r for r in runs if 'stages' in r), key=lambda r: r['rows'])
+    scaling = {}
+    for small, large in zip(ok, ok[1:]):
+        key = f"{small['rows']}->{large['rows']}"
+        ratio = math.log(large['rows'] / small['rows'])
+        scaling[key] = {}
+        for stage, entry in large['stages'].items():
+            before = small['stages'].get(stage, {}).get('seconds', 0.0)
+            if before > 0 and entry['seconds'] > 0:
+                scaling[key][stage] = round(math.log(entry['seconds'] / before) / ratio, 3)
+    return scaling
+
+
+def worst_stage(runs, scaling):
+    """Stage tăng nhanh nhất ở cặp kích thước lớn nhất (bỏ qua stage quá ngắn)"""
+    ok = sorted((r for r in runs if 'stages' in r), key=lambda r: r['rows'])
+    if len(ok) < 2:
+        return None
+    largest = ok[-1]
+    exponents = scaling[f"{ok[-2]['rows']}->{largest['rows']}"]
+    candidates = [(k, stage) for stage, k in exponents.items()
+                  if largest['stages'][stage]['seconds'] >= MIN_STAGE_SECONDS]
+    if not candidates:
+        return None
+    k, stage = max(candidates)
+    return {'stage': stage, 'exponent': k, 'seconds': largest['stages'][stage]['seconds'],
+            'rows': largest['rows']}
+
+
+def print_results(pipeline, runs):
+    for run in runs:
+        print(f"\n📊 {pipeline} — {run['rows']:,} dòng")
+        if 'error' in run:
+            print(f"   ❌ {run['error']}")
+            continue
+        for stage, entry in run['stages'].items():
+            peak = entry.get('peak_rss_bytes', entry.get('peak_alloc_bytes'))
+            peak_text = f"  peak {peak / 1024**2:8.1f} MB" if peak is not None else ''
+            print(f"   {stage:<25s}: {entry['seconds']:9.3f}s{peak_text}")
+        print(f"   {'TOTAL':<25s}: {run['total_seconds']:9.3f}s  max RSS {run['max_rss_bytes'] / 1024**2:8.1f} MB")
+
+
+# ==================== CLI ====================
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pipeline train theo kích thước dữ liệu')
+    parser.add_argument('--sizes', type=parse_int_list, default=parse_int_list(DEFAULT_SIZES),
+                        help='Số dòng CSV, phân cách bằng dấu phẩy')
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument('--memory', choices=('rss', 'tracemalloc'), default='rss',
+                        help='rss: peak RSS từng stage (nhanh); tracemalloc: peak cấp phát (chậm hơn)')
+    parser.add_argument('--dataset-cache', action='store_true',
+                        help='load_data đọc từ cache dạng cột (build sẵn trước khi đo) thay vì CSV')
+    parser.add_argument('--timeout', type=float, default=None, help='Giới hạn giây cho mỗi lần chạy')
+    parser.add_argument('--datadir', default=DEFAULT_DATADIR)
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--seed', type=int, default=42)
+    # Nội bộ: process con chạy đúng một pipeline
+    parser.add_argument('--run-one', choices=PIPELINES, help=argparse.SUPPRESS)
+    parser.add_argument('--csv', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.run_one:
+        result = run_pipeline(args.run_one, args.csv, args.memory, args.dataset_cache)
+        with open(args.result, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return result
+
+    args.datadir = os.path.abspath(args.datadir)
+    args.workdir = os.path.abspath(args.workdir)
+    output = os.path.abspath(args.output)
+
+    report = {
+        'environment': environment_info(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('run_one', 'csv', 'result', 'output')},
+        'results': {pipeline: [] for pipeline in args.pipelines}
+    }
+
+    for n in sorted(args.sizes):
+        print("\n" + "=" * 70)
+        print(f"KÍCH THƯỚC: {n:,} dòng")
+        print("=" * 70)
+        csv_path = ensure_dataset(args.datadir, n, args.seed)
+        if args.dataset_cache:
+            # Build cache ngoài phần đo: mọi lần chạy đều đo load từ cache "ấm"
+            _, _, info = load_dataset(csv_path, cache_dir=dataset_cache_dir(args))
+            print(f"   cache: {info['cache_path']} (parse CSV {info['csv_seconds']:.1f}s)")
+        for pipeline in args.pipelines:
+            print(f"⏳ {pipeline} ...")
+            run = run_isolated(pipeline, csv_path, n, args)
+            report['results'][pipeline].append(run)
+            status = run.get('error') or f"{run['total_seconds']:.1f}s"
+            print(f"   → {status}  (log: {run['log']})")
+            # Ghi report sau mỗi lần chạy: 10M dòng có thể mất hàng giờ
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    report['scaling'] = {}
+    report['worst_scaling_stage'] = {}
+    for pipeline, runs in report['results'].items():
+        print_results(pipeline, runs)
+        report['scaling'][pipeline] = scaling_exponents(runs)
+        report['worst_scaling_stage'][pipeline] = worst_stage(runs, report['scaling'][pipeline])
+        worst = report['worst_scaling_stage'][pipeline]
+        if worst:
+            print(f"\n⚠️  {pipeline}: stage tăng nhanh nhất là {worst['stage']} (t ~ n^{worst['exponent']})")
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✓ Report: {output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import threading
+import time
+import numpy as np
+
+# ==================== MICRO-BATCHING COALESCER ====================
+
+class _Pending:
+    """Một request 1 dòng đang chờ trong hàng đợi"""
+
+    __slots__ = ('row', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, row):
+        self.row = row
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PredictionCoalescer:
+    """
+    Gom các request dự đoán 1 dòng (cùng model) thành một batch
+
+    Request đầu tiên vào hàng đợi rỗng làm "leader": chờ tối đa window_ms
+    (hoặc tới khi đủ max_batch), chạy predict_fn một lần cho cả batch rồi
+    trả kết quả về cho từng request đang chờ.
+
+    predict_fn(context, X) → (class index, xác suất hoặc None) cho mỗi dòng.
+    """
+
+    # Biên của histogram batch size
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+    def __init__(self, predict_fn, window_ms=2.0, max_batch=64):
+        self.predict_fn = predict_fn
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self._lock = threading.Lock()
+        self._queues = {}
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._max_batch_seen = 0
+        self._batch_size_hist = [0] * (len(self.BATCH_SIZE_BUCKETS) + 1)
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._fallbacks = 0
+
+    def submit(self, key, context, row):
+        """Đưa 1 dòng vào hàng đợi của key, block tới khi có kết quả"""
+        item = _Pending(row)
+        with self._lock:
+            entry = self._queues.get(key)
+            leader = entry is None
+            if leader:
+                entry = self._queues[key] = ([], threading.Event())
+            batch, full = entry
+            batch.append(item)
+            if len(batch) >= self.max_batch:
+                # Batch đã đủ: request tiếp theo sẽ mở batch mới
+                del self._queues[key]
+                full.set()
+
+        if leader:
+            full.wait(self.window)
+            with self._lock:
+                if self._queues.get(key) is entry:
+                    del self._queues[key]
+            self._run_batch(context, batch)
+
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _run_batch(self, context, batch):
+        started = time.perf_counter()
+        try:
+            X = np.vstack([item.row for item in batch])
+            class_idx, probabilities = self.predict_fn(context, X)
+            for i, item in enumerate(batch):
+                item.result = (class_idx[i], None if probabilities is None else probabilities[i])
+        except Exception:
+            # Một dòng lỗi không được làm hỏng cả batch → chạy lại từng dòng
+            with self._stats_lock:
+                self._fallbacks += 1
+            for item in batch:
+                try:
+                    class_idx, probabilities = self.predict_fn(context, np.atleast_2d(item.row))
+                    item.result = (class_idx[0], None if probabilities is None else probabilities[0])
+                except Exception as e:
+                    item.error = e
+        finally:
+            self._record(batch, started)
+            for item in batch:
+                item.done.set()
+
+    def _record(self, batch, started):
+        waits = [started - item.enqueued_at for item in batch]
+        size = len(batch)
+        bucket = next((i for i, b in enumerate(self.BATCH_SIZE_BUCKETS) if size <= b),
+                      len(self.BATCH_SIZE_BUCKETS))
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += size
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._batch_size_hist[bucket] += 1
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, max(waits))
+
+    def stats(self):
+        """Thống kê batch size và thời gian chờ trong hàng đợi"""
+        with self._stats_lock:
+            labels = [f'<={b}' for b in self.BATCH_SIZE_BUCKETS] + [f'>{self.BATCH_SIZE_BUCKETS[-1]}']
+            return {
+                'window_ms': self.window * 1000.0,
+                'max_batch': self.max_batch,
+                'batches': self._batches,
+                'requests': self._requests,
+                'avg_batch_size': self._requests / self._batches if self._batches else 0.0,
+                'max_batch_size': self._max_batch_seen,
+                'batch_size_histogram': dict(zip(labels, self._batch_size_hist)),
+                'avg_queue_wait_ms': self._wait_total / self._requests * 1000.0 if self._requests else 0.0,
+                'max_queue_wait_ms': self._wait_max * 1000.0,
+                'fallbacks': self._fallbacks
+            }
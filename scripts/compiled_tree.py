@@ -0,0 +1,289 @@
+import math
+import warnings
+import numpy as np
+
+# ==================== COMPILED DECISION TREE / FOREST ====================
+
+# Các mảng phẳng của cây đã compile (cũng là layout của model artifact)
+TREE_ARRAYS = (
+    'feature', 'threshold', 'children_left', 'children_right', 'n_node_samples',
+    'proba', 'node_class', 'walk_feature', 'walk_left', 'walk_right', 'roots',
+)
+
+# Batch lớn với nhiều cây được duyệt theo từng khúc để giới hạn bộ nhớ (số dòng × số cây)
+FOREST_CHUNK_CELLS = 1 << 20
+
+
+def _tree_node_arrays(tree, n_classes, offset):
+    """Mảng node của một sklearn tree_, id node cộng thêm offset (id toàn cục)"""
+    left = tree.children_left.astype(np.int64)
+    right = tree.children_right.astype(np.int64)
+    is_leaf = left == -1
+    local_ids = np.arange(len(left), dtype=np.int64)
+
+    # Xác suất đã chuẩn hóa tại mỗi node (giống DecisionTreeClassifier.predict_proba)
+    value = np.asarray(tree.value[:, 0, :n_classes], dtype=np.float64)
+    normalizer = value.sum(axis=1, keepdims=True)
+    normalizer[normalizer == 0.0] = 1.0
+    proba = value / normalizer
+
+    return {
+        'feature': tree.feature.astype(np.int64),
+        'threshold': tree.threshold.astype(np.float64),
+        'children_left': np.where(is_leaf, -1, left + offset),
+        'children_right': np.where(is_leaf, -1, right + offset),
+        'n_node_samples': tree.n_node_samples.astype(np.int64),
+        'proba': proba,
+        'node_class': proba.argmax(axis=1).astype(np.int64),
+        # Leaf trỏ về chính nó để vòng lặp vectorized không cần kiểm tra leaf
+        'walk_feature': np.where(is_leaf, 0, tree.feature).astype(np.int64),
+        'walk_left': np.where(is_leaf, local_ids, left) + offset,
+        'walk_right': np.where(is_leaf, local_ids, right) + offset,
+    }
+
+
+def _tree_depth(children_left, children_right):
+    """Độ sâu lớn nhất của các cây (vectorized theo từng tầng)"""
+    internal = np.flatnonzero(children_left != -1)
+    depth = np.zeros(len(children_left), dtype=np.int64)
+    while True:
+        updated = depth.copy()
+        updated[children_left[internal]] = depth[internal] + 1
+        updated[children_right[internal]] = depth[internal] + 1
+        if np.array_equal(updated, depth):
+            return int(depth.max()) if len(depth) else 0
+        depth = updated
+
+
+class CompiledTree:
+    """
+    Decision Tree (hoặc Random Forest) đã được "biên dịch" thành các mảng phẳng
+
+    Node của mọi cây nằm chung trong một mảng, roots là id node gốc của từng cây.
+    Dự đoán trả về class index, xác suất và leaf id trong một lần duyệt,
+    không qua bước validate/dispatch của sklearn. Các mảng có thể là np.memmap
+    (model artifact) — class này không copy chúng.
+    """
+
+    def __init__(self, arrays, classes, n_features, max_depth, scaler_mean=None, scaler_scale=None):
+        for name in TREE_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.classes = np.asarray(classes)
+        self.n_features = int(n_features)
+        self.max_depth = int(max_depth)
+        self.n_trees = len(self.roots)
+        self.scaler_mean = scaler_mean
+        self.scaler_scale = scaler_scale
+        self._lists = None
+
+    @classmethod
+    def from_estimator(cls, model):
+        """
+        Tạo CompiledTree từ model sklearn đã fit
+
+        Hỗ trợ DecisionTreeClassifier, RandomForestClassifier và Pipeline
+        (StandardScaler + sampler như SMOTE + một trong hai model trên).
+        Model không hỗ trợ → ValueError.
+        """
+        scaler_mean = scaler_scale = None
+        if hasattr(model, 'steps'):
+            for _, step in model.steps[:-1]:
+                if step is None or step == 'passthrough' or hasattr(step, 'fit_resample'):
+                    continue  # Sampler chỉ chạy lúc fit
+                if type(step).__name__ != 'StandardScaler' or scaler_scale is not None:
+                    raise ValueError(f"Unsupported pipeline step: {type(step).__name__}")
+                n = step.n_features_in_
+                scaler_mean = np.zeros(n) if step.mean_ is None else step.mean_.astype(np.float64)
+                scaler_scale = np.ones(n) if step.scale_ is None else step.scale_.astype(np.float64)
+            model = model.steps[-1][1]
+
+        if hasattr(model, 'tree_'):
+            estimators = [model]
+        elif hasattr(model, 'estimators_') and all(hasattr(e, 'tree_') for e in model.estimators_):
+            estimators = list(model.estimators_)
+        else:
+            raise ValueError(f"Unsupported model: {type(model).__name__}")
+
+        parts, roots, offset = [], [], 0
+        for estimator in estimators:
+            parts.append(_tree_node_arrays(estimator.tree_, model.n_classes_, offset))
+            roots.append(offset)
+            offset += estimator.tree_.node_count
+
+        arrays = {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+        arrays['roots'] = np.asarray(roots, dtype=np.int64)
+        max_depth = _tree_depth(arrays['children_left'], arrays['children_right'])
+        return cls(arrays, model.classes_, model.n_features_in_, max_depth, scaler_mean, scaler_scale)
+
+    def arrays(self):
+        """Các mảng cần lưu vào artifact"""
+        return {name: getattr(self, name) for name in TREE_ARRAYS}
+
+    def _as_matrix(self, X):
+        X = np.asarray(X, dtype=np.float64 if self.scaler_scale is not None else np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, but model expects {self.n_features}")
+        if self.scaler_scale is not None:
+            X = ((X - self.scaler_mean) / self.scaler_scale).astype(np.float32)
+        if not np.isfinite(X).all():
+            raise ValueError("Input X contains NaN or infinity")
+        return X
+
+    def _walk(self, X, history=None):
+        """Duyệt mọi cây cho các dòng của X → node cuối, shape (n_trees, n_rows)"""
+        cols = np.arange(X.shape[0])
+        node = np.repeat(self.roots[:, np.newaxis], X.shape[0], axis=1)
+        for depth in range(1, self.max_depth + 1):
+            go_left = X[cols, self.walk_feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.walk_left[node], self.walk_right[node])
+            if history is not None:
+                history[:, depth] = node[0]
+        return node
+
+    def apply(self, X):
+        """Leaf id (id trong từng cây) cho mỗi dòng: shape (n_rows,) hoặc (n_rows, n_trees)"""
+        node = self._walk(self._as_matrix(X)) - self.roots[:, np.newaxis]
+        return node[0] if self.n_trees == 1 else node.T
+
+    def predict(self, X):
+        """Trả về (class index, xác suất, leaf id) cho 1..N dòng"""
+        X = self._as_matrix(X)
+        if self.n_trees == 1:
+            leaf = self._walk(X)[0]
+            return self.node_class[leaf], self.proba[leaf], leaf
+
+        # Forest: trung bình xác suất các cây (cộng tuần tự giống sklearn)
+        chunk = max(1, FOREST_CHUNK_CELLS // self.n_trees)
+        probas, leaves = [], []
+        for start in range(0, X.shape[0], chunk):
+            node = self._walk(X[start:start + chunk])
+            probas.append(self.proba[node].sum(axis=0) / self.n_trees)
+            leaves.append((node - self.roots[:, np.newaxis]).T)
+        proba = np.concatenate(probas)
+        return proba.argmax(axis=1), proba, np.concatenate(leaves)
+
+    def predict_proba(self, X):
+        return self.predict(X)[1]
+
+    def _row_values(self, row):
+        # Ép về float32 giống sklearn trước khi so sánh với threshold
+        values = self._as_matrix(row)[0].tolist() if self.scaler_scale is not None \
+            else np.asarray(row, dtype=np.float32).ravel().tolist()
+        if len(values) != self.n_features:
+            raise ValueError(f"X has {len(values)} features, but model expects {self.n_features}")
+        if not all(math.isfinite(v) for v in values):
+            raise ValueError("Input X contains NaN or infinity")
+        return values
+
+    def lists(self):
+        """Bản list của các mảng cho đường 1 dòng (index list nhanh hơn index ndarray)"""
+        if self._lists is None:
+            self._lists = (self.children_left.tolist(), self.children_right.tolist(),
+                           self.feature.tolist(), self.threshold.tolist(), self.node_class.tolist(),
+                           self.n_node_samples.tolist())
+        return self._lists
+
+    def predict_one(self, row):
+        """Đường nhanh cho 1 dòng: duyệt cây bằng list Python"""
+        if self.n_trees > 1:
+            class_idx, proba, leaf = self.predict(row)
+            return int(class_idx[0]), proba[0], leaf[0]
+
+        values = self._row_values(row)
+        left, right, feature, threshold, node_class, _ = self.lists()
+        node = 0
+        while left[node] != -1:
+            node = left[node] if values[feature[node]] <= threshold[node] else right[node]
+        return node_class[node], self.proba[node], node
+
+    def path_one(self, row):
+        """Các node trên đường đi root → leaf của 1 dòng (model 1 cây)"""
+        if self.n_trees != 1:
+            raise ValueError("decision_path is only available for a single tree")
+        values = self._row_values(row)
+        left, right, feature, threshold = self.lists()[:4]
+        node, path = 0, [0]
+        while left[node] != -1:
+            node = left[node] if values[feature[node]] <= threshold[node] else right[node]
+            path.append(node)
+        return path
+
+    def decision_path(self, X):
+        """
+        Đường đi trong cây dạng CSR (indptr, indices) giống sklearn decision_path
+
+        Node của mỗi dòng được xếp theo thứ tự duyệt từ root tới leaf.
+        Chỉ áp dụng cho model 1 cây.
+        """
+        if self.n_trees != 1:
+            raise ValueError("decision_path is only available for a single tree")
+        X = self._as_matrix(X)
+        history = np.zeros((X.shape[0], self.max_depth + 1), dtype=np.int64)
+        self._walk(X, history)
+
+        # Sau khi tới leaf node lặp lại chính nó → chỉ giữ bước đầu tiên
+        visited = np.ones(history.shape, dtype=bool)
+        visited[:, 1:] = history[:, 1:] != history[:, :-1]
+        indptr = np.zeros(X.shape[0] + 1, dtype=np.int64)
+        np.cumsum(visited.sum(axis=1), out=indptr[1:])
+        return indptr, history[visited]
+
+    def verification_matrix(self, n_rows=512, seed=0):
+        """Sinh dữ liệu kiểm tra quanh các threshold (dễ lộ sai lệch làm tròn)"""
+        rng = np.random.default_rng(seed)
+        X = rng.normal(size=(n_rows, self.n_features)).astype(np.float32)
+        internal = self.children_left != -1
+        for f in range(self.n_features):
+            thresholds = np.unique(self.threshold[internal & (self.feature == f)])
+            if len(thresholds) == 0:
+                continue
+            candidates = np.concatenate([
+                thresholds,
+                np.nextafter(thresholds.astype(np.float32), np.float32(np.inf)),
+                np.nextafter(thresholds.astype(np.float32), np.float32(-np.inf)),
+            ])
+            X[:, f] = rng.choice(candidates, size=n_rows)
+        if self.scaler_scale is not None:
+            # Threshold nằm trong không gian đã scale → đưa về giá trị gốc
+            X = X.astype(np.float64) * self.scaler_scale + self.scaler_mean
+        return X
+
+    def verify(self, model, X=None):
+        """So sánh với sklearn (oracle): xác suất, class và leaf id phải trùng khớp"""
+        if X is None:
+            X = self.verification_matrix()
+        with warnings.catch_warnings():
+            # Model fit bằng DataFrame sẽ cảnh báo thiếu feature names
+            warnings.simplefilter('ignore')
+            expected_proba = model.predict_proba(X)
+            expected_class = model.predict(X)
+            expected_leaf = model.apply(X) if hasattr(model, 'apply') else None
+        class_idx, proba, leaf = self.predict(X)
+        return (np.allclose(proba, expected_proba)
+                and np.array_equal(self.classes[class_idx], expected_class)
+                and (expected_leaf is None or np.array_equal(leaf, expected_leaf)))
+
+
+def compile_model(model):
+    """
+    Compile model nếu hỗ trợ, ngược lại trả về None
+
+    Model compile xong được kiểm tra lại với sklearn; sai lệch thì bỏ qua
+    để app dùng sklearn như cũ.
+    """
+    if not hasattr(model, 'predict_proba'):
+        return None
+    try:
+        compiled = CompiledTree.from_estimator(model)
+    except ValueError:
+        return None
+    try:
+        if not compiled.verify(model):
+            print(f"Compiled tree mismatch for {type(model).__name__}, using sklearn")
+            return None
+        return compiled
+    except Exception as e:
+        print(f"Error compiling model: {e}")
+        return None
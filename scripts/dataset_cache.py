@@ -0,0 +1,217 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from ingest import INGEST_CHUNK_ROWS, RunningStats, iter_csv
+
+# ==============================
+# CACHE DẠNG CỘT CHO DATASET TRAIN (.aqc)
+# ==============================
+# CSV được parse một lần thành thư mục <tên>-<hash>.aqc trong DATASET_CACHE_DIR:
+#   manifest.json — nguồn (kích thước, sha256), số dòng, dtype từng cột, category,
+#                   thống kê cơ bản, thời gian parse CSV
+#   <i>.bin       — mảng thô của cột thứ i (category lưu mã int32)
+#
+# Các lần chạy sau chỉ mở những cột được chọn bằng np.memmap (không parse, không
+# copy vào RAM cho tới khi pipeline ghi đè cột). Cache gắn với hash nội dung file
+# nguồn: sửa CSV → cache mới, cache cũ của cùng file bị xóa.
+
+DATASET_CACHE_DIR = os.environ.get('DATASET_CACHE_DIR', os.path.join('datasets', '.cache'))
+CACHE_EXTENSION = '.aqc'
+CACHE_FORMAT_VERSION = 1
+HASH_BLOCK_BYTES = 1 << 20
+HASH_INDEX = 'hashes.json'   # đường dẫn → (size, mtime, sha256): không hash lại file chưa đổi
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def source_digest(csv_path, cache_dir=DATASET_CACHE_DIR):
+    """sha256 nội dung file (nhớ theo size + mtime để lần sau không đọc lại cả file)"""
+    stat = os.stat(csv_path)
+    key = os.path.abspath(csv_path)
+    index_path = os.path.join(cache_dir, HASH_INDEX)
+    index = _read_json(index_path) or {}
+    entry = index.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+
+    digest = hashlib.sha256()
+    with open(csv_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    index[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    return index[key]['sha256']
+
+
+def cache_path_for(csv_path, digest, cache_dir=DATASET_CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(cache_dir, f'{stem}-{digest[:16]}{CACHE_EXTENSION}')
+
+
+def is_cache(path):
+    manifest = _read_json(os.path.join(path, 'manifest.json'))
+    return bool(manifest) and manifest.get('format_version') == CACHE_FORMAT_VERSION
+
+
+# ==============================
+# BUILD
+# ==============================
+
+def _column_values(series, categories):
+    """Chunk của một cột → (kind, mảng ghi ra file); categories: giá trị → mã toàn cục"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime', series.to_numpy()   # đơn vị theo chunk đầu, các chunk sau được ép theo
+    if pd.api.types.is_bool_dtype(series) or (pd.api.types.is_numeric_dtype(series)
+                                               and not isinstance(series.dtype, pd.CategoricalDtype)):
+        if series.dtype != np.float32:
+            series = series.astype(np.float64)   # int có NaN ở chunk khác → dtype thống nhất
+        return 'numeric', series.to_numpy()
+
+    # Chuỗi / category: mã int32 theo bảng category của cả file (mỗi chunk có bảng riêng)
+    series = series.astype('category')
+    chunk_categories = [str(value) for value in series.cat.categories]
+    for value in chunk_categories:
+        categories.setdefault(value, len(categories))
+    lookup = np.array([categories[value] for value in chunk_categories] + [-1], dtype=np.int32)
+    return 'category', lookup[series.cat.codes.to_numpy()]   # mã -1 (NaN) → phần tử cuối = -1
+
+
+def build_cache(csv_path, cache_path, digest, chunksize=INGEST_CHUNK_ROWS):
+    """Parse CSV theo chunk (ingest.iter_csv) và ghi cache dạng cột; trả về manifest"""
+    tmp_path = cache_path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    stats = RunningStats()
+    files, columns, categories = {}, {}, {}
+    rows = 0
+    started = time.perf_counter()
+    try:
+        for chunk in iter_csv(csv_path, chunksize, stats=stats):
+            rows += len(chunk)
+            for col in chunk.columns:
+                kind, values = _column_values(chunk[col], categories.setdefault(col, {}))
+                if col not in files:
+                    files[col] = open(os.path.join(tmp_path, f'{len(files)}.bin'), 'wb')
+                    columns[col] = {'file': f'{len(columns)}.bin', 'kind': kind, 'dtype': values.dtype.str}
+                elif values.dtype.str != columns[col]['dtype']:
+                    values = values.astype(columns[col]['dtype'])
+                files[col].write(np.ascontiguousarray(values).tobytes())
+    finally:
+        for f in files.values():
+            f.close()
+
+    for col, info in columns.items():
+        if info['kind'] == 'category':
+            info['categories'] = list(categories[col])
+
+    source_stat = os.stat(csv_path)
+    manifest = {
+        'format_version': CACHE_FORMAT_VERSION,
+        'source': {'path': os.path.abspath(csv_path), 'size': source_stat.st_size, 'sha256': digest},
+        'rows': rows,
+        'columns': columns,
+        'stats': json.loads(stats.describe().to_json()),
+        'csv_seconds': time.perf_counter() - started,
+        'built_at': datetime.now().isoformat()
+    }
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.replace(tmp_path, cache_path)
+    return manifest
+
+
+def remove_stale(csv_path, keep, cache_dir=DATASET_CACHE_DIR):
+    """Xóa cache cũ (hash khác) của cùng file nguồn"""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    removed = []
+    for path in glob.glob(os.path.join(cache_dir, f'{glob.escape(stem)}-*{CACHE_EXTENSION}')):
+        if os.path.abspath(path) != os.path.abspath(keep):
+            manifest = _read_json(os.path.join(path, 'manifest.json')) or {}
+            if manifest.get('source', {}).get('path') in (None, os.path.abspath(csv_path)):
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+    return removed
+
+
+# ==============================
+# LOAD
+# ==============================
+
+def load_cache(cache_path, columns=None, mmap=True):
+    """
+    Cache → (DataFrame, manifest)
+
+    columns: chỉ mở các cột này (cột không có trong cache bị bỏ qua). mmap=True: cột
+    số / thời gian là np.memmap read-only, DataFrame không copy.
+    """
+    with open(os.path.join(cache_path, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    rows = manifest['rows']
+    selected = [col for col in manifest['columns'] if columns is None or col in columns]
+
+    data = {}
+    for col in selected:
+        info = manifest['columns'][col]
+        file_path = os.path.join(cache_path, info['file'])
+        dtype = np.dtype(info['dtype'])
+        if rows == 0:
+            values = np.empty(0, dtype=dtype)
+        elif mmap:
+            values = np.memmap(file_path, dtype=dtype, mode='r', shape=(rows,))
+        else:
+            values = np.fromfile(file_path, dtype=dtype, count=rows)
+        if info['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, info['categories'])
+        data[col] = values
+    return pd.DataFrame(data, columns=selected, copy=False), manifest
+
+
+def load_dataset(csv_path, columns=None, rebuild=False, cache_dir=DATASET_CACHE_DIR,
+                 chunksize=INGEST_CHUNK_ROWS, mmap=True):
+    """
+    CSV (qua cache) → (DataFrame, thống kê cơ bản, info)
+
+    Build cache nếu chưa có, hash nguồn đã đổi hoặc rebuild=True. info: đường dẫn
+    cache, built (True nếu vừa parse CSV), csv_seconds (thời gian parse CSV lúc
+    build), cache_seconds (thời gian mở cache lần này).
+    """
+    digest = source_digest(csv_path, cache_dir)
+    cache_path = cache_path_for(csv_path, digest, cache_dir)
+    built = rebuild or not is_cache(cache_path)
+    if built:
+        build_cache(csv_path, cache_path, digest, chunksize)
+        remove_stale(csv_path, cache_path, cache_dir)
+
+    started = time.perf_counter()
+    df, manifest = load_cache(cache_path, columns, mmap)
+    cache_seconds = time.perf_counter() - started
+
+    summary = pd.DataFrame(manifest['stats'])
+    summary = summary[[col for col in summary.columns if col in df.columns]]
+    info = {
+        'cache_path': cache_path,
+        'built': built,
+        'rows': manifest['rows'],
+        'csv_seconds': manifest['csv_seconds'],
+        'cache_seconds': cache_seconds
+    }
+    return df, summary, info
@@ -0,0 +1,156 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (bật HalvingGridSearchCV)
+from sklearn.model_selection import HalvingGridSearchCV, StratifiedKFold
+
+# ==============================
+# TÌM HYPERPARAMETER (SUCCESSIVE HALVING, SONG SONG)
+# ==============================
+# Vòng đầu chạy mọi cấu hình trên một mẫu nhỏ, mỗi vòng giữ 1/factor cấu hình
+# tốt nhất và tăng số mẫu lên factor lần. Các cấu hình được fit trên process pool
+# (joblib/loky); X, y được ghi ra .npy và mở bằng memmap nên mọi worker đọc chung
+# một bản qua page cache thay vì mỗi worker nhận một bản copy.
+
+SEARCH_N_JOBS = int(os.environ.get('SEARCH_N_JOBS', '-1'))
+SEARCH_FACTOR = int(os.environ.get('SEARCH_FACTOR', '3'))
+SEARCH_CV = int(os.environ.get('SEARCH_CV', '3'))
+SEARCH_SCORING = 'f1_weighted'   # Cùng tiêu chí chọn best model của pipeline
+MIN_CLASS_SAMPLES_PER_FOLD = 12  # SMOTE (k_neighbors=5) cần ≥ 6 mẫu mỗi class; x2 vì mẫu con không stratify
+
+TREE_PARAM_GRID = {
+    'max_depth': [5, 10, 15, 20, None],
+    'min_samples_leaf': [1, 5, 10, 20],
+    'min_samples_split': [2, 10, 20, 50],
+}
+
+FOREST_PARAM_GRID = {
+    'n_estimators': [50, 100, 200],
+    'max_depth': [10, 15, 20, None],
+    'min_samples_leaf': [1, 5, 10],
+    'min_samples_split': [2, 10],
+}
+
+
+def prefixed(param_grid, step):
+    """Grid cho một bước của Pipeline ('max_depth' → 'rf__max_depth')"""
+    return {f'{step}__{name}': values for name, values in param_grid.items()} if step else dict(param_grid)
+
+
+def unprefixed(params, step):
+    if not step:
+        return dict(params)
+    return {name.split('__', 1)[1]: value for name, value in params.items() if name.startswith(f'{step}__')}
+
+
+def min_resources_for(y, cv, factor):
+    """Số mẫu vòng đầu: đủ để class hiếm nhất có MIN_CLASS_SAMPLES_PER_FOLD mẫu trong mỗi fold train"""
+    _, counts = np.unique(y, return_counts=True)
+    needed = math.ceil(MIN_CLASS_SAMPLES_PER_FOLD * cv / (cv - 1) * len(y) / counts.min())
+    return int(min(len(y), max(needed, factor * cv * len(counts))))
+
+
+def memmap_arrays(X, y, folder):
+    """Ghi X, y ra .npy trong folder và mở lại bằng memmap (chỉ đọc)"""
+    paths = {}
+    for name, array in (('X', X), ('y', y)):
+        paths[name] = os.path.join(folder, f'{name}.npy')
+        np.save(paths[name], np.ascontiguousarray(np.asarray(array)))
+    return np.load(paths['X'], mmap_mode='r'), np.load(paths['y'], mmap_mode='r')
+
+
+def leaderboard(search, step=None):
+    """cv_results_ → list các lần đánh giá (cấu hình × vòng), tốt nhất trước"""
+    results = search.cv_results_
+    rows = []
+    for i, params in enumerate(results['params']):
+        rows.append({
+            'iteration': int(results['iter'][i]),
+            'n_samples': int(results['n_resources'][i]),
+            'params': unprefixed(params, step),
+            'mean_score': float(results['mean_test_score'][i]),
+            'std_score': float(results['std_test_score'][i]),
+            'mean_fit_seconds': float(results['mean_fit_time'][i]),
+            'std_fit_seconds': float(results['std_fit_time'][i]),
+            'mean_score_seconds': float(results['mean_score_time'][i]),
+        })
+    # Vòng cuối (nhiều mẫu nhất) trước, trong mỗi vòng điểm cao trước; NaN (fit lỗi) cuối
+    rows.sort(key=lambda r: (-r['iteration'], -(r['mean_score'] if r['mean_score'] == r['mean_score'] else -1)))
+    return rows
+
+
+def halving_search(estimator, param_grid, X, y, step=None, cv=SEARCH_CV, factor=SEARCH_FACTOR,
+                   n_jobs=SEARCH_N_JOBS, scoring=SEARCH_SCORING, random_state=42):
+    """
+    Successive halving trên param_grid → dict kết quả
+
+    step: tên bước trong Pipeline chứa model (grid và best_params không có tiền tố).
+    Trả về {'best_params', 'best_score', 'leaderboard', 'n_candidates', 'n_iterations',
+    'seconds', ...}; không refit (pipeline gọi tự fit với best_params).
+    """
+    grid = prefixed(param_grid, step)
+    n_candidates = int(np.prod([len(values) for values in grid.values()]))
+    folder = tempfile.mkdtemp(prefix='aq_search_')
+    started = time.perf_counter()
+    try:
+        X_mm, y_mm = memmap_arrays(X, y, folder)
+        search = HalvingGridSearchCV(
+            estimator, grid,
+            factor=factor,
+            min_resources=min_resources_for(y_mm, cv, factor),
+            cv=StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state),
+            scoring=scoring,
+            refit=False,
+            return_train_score=False,
+            random_state=random_state,
+            n_jobs=n_jobs,
+        )
+        search.fit(X_mm, y_mm)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return {
+        'best_params': unprefixed(search.best_params_, step),
+        'best_score': float(search.best_score_),
+        'scoring': scoring,
+        'n_candidates': n_candidates,
+        'n_iterations': int(search.n_iterations_),
+        'n_resources': [int(n) for n in search.n_resources_],
+        'n_candidates_per_iteration': [int(n) for n in search.n_candidates_],
+        'cv': cv,
+        'factor': factor,
+        'n_jobs': n_jobs,
+        'seconds': time.perf_counter() - started,
+        'leaderboard': leaderboard(search, step),
+    }
+
+
+def print_search_summary(result, top=10):
+    print(f"\n🔎 Successive halving: {result['n_candidates']} cấu hình, {result['n_iterations']} vòng "
+          f"(số mẫu {result['n_resources']}, số cấu hình {result['n_candidates_per_iteration']}) "
+          f"trong {result['seconds']:.1f}s")
+    print(f"   Best ({result['scoring']} = {result['best_score']:.4f}): {result['best_params']}")
+    print(f"\n   {'Vòng':>4} {'Mẫu':>8} {'Score':>8} {'Fit (s)':>9}  Params")
+    for row in result['leaderboard'][:top]:
+        print(f"   {row['iteration']:>4} {row['n_samples']:>8,} {row['mean_score']:>8.4f} "
+              f"{row['mean_fit_seconds']:>9.3f}  {row['params']}")
+
+
+def leaderboard_path_for(model_path):
+    """model.pkl → model_search.json (leaderboard lưu cạnh model)"""
+    return os.path.splitext(model_path)[0] + '_search.json'
+
+
+def save_search(model_path, result, metadata=None):
+    path = leaderboard_path_for(model_path)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(dict(result, model=os.path.basename(model_path), metadata=metadata or {},
+                       saved_at=datetime.now().isoformat()),
+                  f, ensure_ascii=False, indent=2, default=str)
+    return path
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import time
+
+import imblearn
+import numpy as np
+import pandas as pd
+from imblearn import FunctionSampler
+from imblearn.over_sampling import SMOTE, RandomOverSampler
+from imblearn.under_sampling import RandomUnderSampler
+from sklearn.base import clone
+from sklearn.metrics import f1_score
+from sklearn.neighbors import NearestNeighbors
+from sklearn.utils.class_weight import compute_sample_weight
+
+from stage_cache import CachedStage, StageCache
+
+# ==============================
+# XỬ LÝ MẤT CÂN BẰNG CLASS (CHỌN STRATEGY, CACHE KẾT QUẢ RESAMPLE)
+# ==============================
+#   smote           — SMOTE trên cả tập train (k-NN trên toàn bộ từng class)
+#   smote_subsample — SMOTE với láng giềng tìm trong mẫu con stratified (tối đa
+#                     IMBALANCE_SUBSAMPLE_PER_CLASS dòng / class): láng giềng gần đúng,
+#                     số mẫu sinh thêm vẫn cân bằng theo số dòng thật
+#   random_over     — nhân bản ngẫu nhiên class thiểu số
+#   random_under    — bỏ bớt ngẫu nhiên class đa số
+#   class_weight    — không resample, model dùng class_weight='balanced' (hoặc sample_weight)
+#   none            — giữ nguyên
+# Ma trận sau resample được lưu qua StageCache (key: hash dữ liệu + strategy + code),
+# lần chạy sau với cùng dữ liệu đọc lại thay vì chạy k-NN.
+
+IMBALANCE_STRATEGIES = ('smote', 'smote_subsample', 'random_over', 'random_under', 'class_weight', 'none')
+IMBALANCE_SUBSAMPLE_PER_CLASS = int(os.environ.get('IMBALANCE_SUBSAMPLE_PER_CLASS', 20_000))
+RANDOM_STATE = 42
+LABEL_COLUMN = '__label__'
+
+
+def smote_subsample(X, y, max_per_class=IMBALANCE_SUBSAMPLE_PER_CLASS, k_neighbors=5, random_state=RANDOM_STATE):
+    """
+    SMOTE trên mẫu con stratified → (X gốc + mẫu tổng hợp, y)
+
+    Mỗi class giữ tối đa max_per_class dòng để tìm láng giềng (kd-tree), số mẫu
+    tổng hợp của mỗi class = số dòng class đa số - số dòng thật của class đó.
+    """
+    X, y = np.asarray(X), np.asarray(y)
+    rng = np.random.default_rng(random_state)
+    classes, counts = np.unique(y, return_counts=True)
+    target = counts.max()
+    subsample, wanted = [], {}
+    for label, count in zip(classes, counts):
+        rows = np.flatnonzero(y == label)
+        if count > max_per_class:
+            rows = rng.choice(rows, max_per_class, replace=False)
+        subsample.append(rows)
+        if count < target:
+            wanted[label] = len(rows) + target - count
+    if not wanted:
+        return X, y
+
+    rows = np.sort(np.concatenate(subsample))
+    smote = SMOTE(sampling_strategy=wanted, random_state=random_state,
+                  k_neighbors=NearestNeighbors(n_neighbors=k_neighbors + 1, algorithm='kd_tree'))
+    X_sub, y_sub = smote.fit_resample(X[rows], y[rows])
+    # SMOTE trả về các dòng gốc trước, mẫu tổng hợp nối phía sau
+    return np.vstack([X, X_sub[len(rows):]]), np.concatenate([y, y_sub[len(rows):]])
+
+
+def sampler_for(strategy):
+    """Sampler imblearn của strategy (dùng được trong ImbPipeline); 'passthrough' nếu không resample"""
+    if strategy == 'smote':
+        return SMOTE(random_state=RANDOM_STATE)
+    if strategy == 'smote_subsample':
+        return FunctionSampler(func=smote_subsample, kw_args={'max_per_class': IMBALANCE_SUBSAMPLE_PER_CLASS})
+    if strategy == 'random_over':
+        return RandomOverSampler(random_state=RANDOM_STATE)
+    if strategy == 'random_under':
+        return RandomUnderSampler(random_state=RANDOM_STATE)
+    if strategy in ('class_weight', 'none'):
+        return 'passthrough'
+    raise ValueError(f"Unknown imbalance strategy: {strategy}")
+
+
+def apply_class_weight(estimator, y):
+    """→ (estimator, sample_weight): class_weight='balanced' nếu model hỗ trợ, không thì sample_weight cân bằng"""
+    if 'class_weight' in estimator.get_params():
+        return estimator.set_params(class_weight='balanced'), None
+    return estimator, compute_sample_weight('balanced', y)
+
+
+def data_digest(X, y):
+    """Hash nội dung X (DataFrame) + y"""
+    digest = hashlib.sha256()
+    digest.update(repr([(col, str(dtype)) for col, dtype in X.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    digest.update(np.ascontiguousarray(y).tobytes())
+    return digest.hexdigest()
+
+
+def _resample_frame(df, strategy):
+    """Stage của StageCache: X + cột nhãn → X, nhãn sau resample"""
+    X, y = df.drop(columns=LABEL_COLUMN), df[LABEL_COLUMN].to_numpy()
+    X_res, y_res = sampler_for(strategy).fit_resample(X, y)
+    out = pd.DataFrame(X_res, columns=X.columns).reset_index(drop=True)
+    out[LABEL_COLUMN] = y_res
+    return out
+
+
+def resample(X, y, strategy='smote', cache=None):
+    """
+    Resample (X, y) theo strategy → (X_res, y_res, info)
+
+    cache: StageCache (None: không cache). X là ndarray → X_res là ndarray.
+    info: strategy, status (hit / miss / off / none), seconds, rows_before, rows_after.
+    """
+    started = time.perf_counter()
+    info = {'strategy': strategy, 'status': 'none', 'rows_before': len(X)}
+    if sampler_for(strategy) == 'passthrough':
+        return X, y, dict(info, seconds=time.perf_counter() - started, rows_after=len(X))
+
+    is_array = not isinstance(X, pd.DataFrame)
+    frame = pd.DataFrame(X, columns=[str(i) for i in range(X.shape[1])]) if is_array else X
+    cache = cache or StageCache(enabled=False)
+    input_key = cache.root_key(data_digest(frame, y)) if cache.enabled else None
+    stage = CachedStage(f'imbalance_{strategy}', _resample_frame, {'strategy': strategy},
+                        deps=(sampler_for, smote_subsample, IMBALANCE_SUBSAMPLE_PER_CLASS, RANDOM_STATE,
+                              imblearn.__version__))
+    out = cache.run(input_key, lambda: frame.assign(**{LABEL_COLUMN: np.asarray(y)}), [stage])
+
+    y_res = out[LABEL_COLUMN].to_numpy()
+    X_res = out.drop(columns=LABEL_COLUMN)
+    if is_array:
+        X_res = X_res.to_numpy()
+    return X_res, y_res, dict(info, status=cache.events[-1]['status'],
+                              seconds=time.perf_counter() - started, rows_after=len(X_res))
+
+
+def compare_strategies(estimator, X_train, y_train, X_test, y_test, strategies=IMBALANCE_STRATEGIES, cache=None):
+    """
+    Fit estimator với từng strategy → list kết quả (strategy, cache, số dòng, thời gian
+    resample / fit, F1 weighted / macro trên tập test)
+    """
+    rows = []
+    for strategy in strategies:
+        started = time.perf_counter()
+        X_res, y_res, info = resample(X_train, y_train, strategy, cache)
+        model, sample_weight = clone(estimator), None
+        if strategy == 'class_weight':
+            model, sample_weight = apply_class_weight(model, y_res)
+        fit_started = time.perf_counter()
+        model.fit(X_res, y_res, sample_weight=sample_weight)
+        fit_seconds = time.perf_counter() - fit_started
+        y_pred = model.predict(X_test)
+        rows.append({
+            'strategy': strategy,
+            'status': info['status'],
+            'rows': info['rows_after'],
+            'resample_seconds': info['seconds'],
+            'fit_seconds': fit_seconds,
+            'seconds': time.perf_counter() - started,
+            'f1_weighted': f1_score(y_test, y_pred, average='weighted'),
+            'f1_macro': f1_score(y_test, y_pred, average='macro'),
+        })
+    return rows
+
+
+def print_strategy_report(rows, title=None):
+    if title:
+        print(f"\n{title}")
+    print(f"\n   {'Strategy':<16} {'Cache':>6} {'Dòng':>10} {'Resample':>9} {'Fit':>8} {'Tổng':>8} "
+          f"{'F1 (w)':>8} {'F1 (m)':>8}")
+    for row in rows:
+        print(f"   {row['strategy']:<16} {row['status']:>6} {row['rows']:>10,} {row['resample_seconds']:>8.2f}s "
+              f"{row['fit_seconds']:>7.2f}s {row['seconds']:>7.2f}s {row['f1_weighted']:>8.4f} {row['f1_macro']:>8.4f}")
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import ExtraTreesClassifier, GradientBoostingClassifier, RandomForestClassifier
+from sklearn.metrics import f1_score
+
+from ingest import DATETIME_COLUMNS, concat_chunks, iter_csv
+
+# ==============================
+# RETRAIN TĂNG DẦN (WARM START) TRÊN DỮ LIỆU MỚI
+# ==============================
+# Model lưu kèm watermark: thời điểm đo mới nhất đã ingest + vị trí byte (đầu dòng)
+# trong CSV từ đó trở đi chưa được đọc. Lần cập nhật sau chỉ đọc CSV từ vị trí đó
+# (nếu phần trước vị trí đó không đổi) và giữ các dòng mới hơn watermark → thời
+# gian chỉ phụ thuộc lượng dữ liệu mới, không phụ thuộc lịch sử.
+#
+# RandomForest: thêm RETRAIN_NEW_TREES cây fit trên dữ liệu mới (warm_start) rồi bỏ
+# bấy nhiêu cây cũ nhất; GradientBoosting: thêm stage (không bỏ stage cũ được).
+# Dữ liệu mới được ghép với replay buffer (tối đa REPLAY_PER_CLASS dòng / class
+# lấy từ các lần train trước) để cây mới thấy đủ mọi class. Phần mới nhất
+# (RETRAIN_HOLDOUT_FRACTION theo thời gian) là holdout cuộn: chỉ để đánh giá
+# trước / sau cập nhật, được lưu cùng model (pending) và train ở lần cập nhật sau.
+# Bản model trước mỗi lần cập nhật được giữ lại trong thư mục con MODEL_VERSIONS_DIR
+# (.versions/<model>.v<N>.pkl, app không quét thư mục con nên không serve nhầm bản cũ),
+# tối đa MODEL_VERSIONS_KEEP bản mới nhất.
+
+RETRAIN_NEW_TREES = int(os.environ.get('RETRAIN_NEW_TREES', 25))
+RETRAIN_HOLDOUT_FRACTION = float(os.environ.get('RETRAIN_HOLDOUT_FRACTION', 0.2))
+REPLAY_PER_CLASS = int(os.environ.get('REPLAY_PER_CLASS', 200))
+MODEL_VERSIONS_KEEP = int(os.environ.get('MODEL_VERSIONS_KEEP', 5))
+MODEL_VERSIONS_DIR = '.versions'
+WATERMARK_TAIL_BYTES = 1 << 16   # Hash đoạn cuối trước offset: phát hiện file bị ghi lại
+
+
+def time_column(df):
+    """Cột thời gian đầu tiên của df (theo ingest.DATETIME_COLUMNS) hoặc None"""
+    for col in DATETIME_COLUMNS:
+        if col in df.columns and pd.api.types.is_datetime64_any_dtype(df[col]):
+            return col
+    return None
+
+
+def line_boundary(path):
+    """Vị trí byte ngay sau dòng hoàn chỉnh cuối cùng của file"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        position = size
+        while position > 0:
+            start = max(0, position - WATERMARK_TAIL_BYTES)
+            f.seek(start)
+            block = f.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+    return 0
+
+
+def _tail_digest(path, offset):
+    with open(path, 'rb') as f:
+        start = max(0, offset - WATERMARK_TAIL_BYTES)
+        f.seek(start)
+        return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+
+def csv_watermark(path, times, offset, rows, previous=None):
+    """
+    Watermark sau khi ingest: times (Series thời gian đã đọc, lấy max), offset
+    (byte bắt đầu lần đọc sau), rows (tổng số dòng đã đọc); previous: watermark
+    trước đó (giữ thời điểm cũ nếu dữ liệu mới không có thời gian hợp lệ)
+    """
+    latest = times.max()
+    if previous and previous.get('time') and (pd.isna(latest) or latest < pd.Timestamp(previous['time'])):
+        latest = pd.Timestamp(previous['time'])
+    return {
+        'path': os.path.abspath(path),
+        'column': times.name,
+        'time': None if pd.isna(latest) else pd.Timestamp(latest).isoformat(),
+        'offset': int(offset),
+        'tail_sha256': _tail_digest(path, offset),
+        'rows': int(rows),
+        'created_at': datetime.now().isoformat(),
+    }
+
+
+def read_new_rows(path, watermark, usecols=None):
+    """
+    CSV → (DataFrame các dòng mới hơn watermark, offset cho watermark tiếp theo)
+
+    Đọc từ watermark['offset'] nếu file vẫn giữ nguyên phần trước đó, không thì
+    (file bị ghi lại / cắt ngắn) đọc cả file rồi lọc theo thời gian.
+    """
+    end_offset = line_boundary(path)
+    offset = watermark.get('offset', 0)
+    if offset > end_offset or _tail_digest(path, offset) != watermark.get('tail_sha256'):
+        print(f"⚠️  {path} đã thay đổi trước watermark → đọc lại cả file và lọc theo thời gian")
+        offset = None
+    if offset is not None and offset >= end_offset:
+        return pd.DataFrame(), end_offset
+
+    df = concat_chunks(iter_csv(path, usecols=usecols, offset=offset))
+    column = watermark['column']
+    if watermark.get('time') is not None and column in df.columns:
+        df = df[df[column] > pd.Timestamp(watermark['time'])].reset_index(drop=True)
+    return df, end_offset
+
+
+def rolling_holdout(df, column, fraction=RETRAIN_HOLDOUT_FRACTION):
+    """
+    Tách phần mới nhất (theo thời gian) làm holdout → (train, holdout, cutoff)
+
+    Mọi dòng có thời gian <= cutoff nằm trong train.
+    """
+    if fraction <= 0 or df.empty:
+        return df, df.iloc[:0], df[column].max()
+    cutoff = df[column].quantile(1 - fraction)
+    recent = df[column] > cutoff
+    if recent.all() or not recent.any():
+        return df, df.iloc[:0], df[column].max()
+    return df[~recent], df[recent], cutoff
+
+
+def replay_sample(X, y, per_class=REPLAY_PER_CLASS, random_state=42):
+    """Tối đa per_class dòng ngẫu nhiên mỗi class → (X, y) (X giữ kiểu DataFrame / ndarray)"""
+    y = np.asarray(y)
+    rng = np.random.default_rng(random_state)
+    rows = []
+    for label in np.unique(y):
+        label_rows = np.flatnonzero(y == label)
+        if len(label_rows) > per_class:
+            label_rows = rng.choice(label_rows, per_class, replace=False)
+        rows.append(label_rows)
+    rows = np.sort(np.concatenate(rows)) if rows else np.array([], dtype=np.int64)
+    X_sample = X.iloc[rows].reset_index(drop=True) if isinstance(X, pd.DataFrame) else np.asarray(X)[rows]
+    return X_sample, y[rows]
+
+
+def with_replay(X, y, replay):
+    """Ghép (X, y) mới với replay buffer (X_replay, y_replay)"""
+    if replay is None:
+        return X, np.asarray(y)
+    X_replay, y_replay = replay
+    if isinstance(X, pd.DataFrame):
+        X = pd.concat([X.reset_index(drop=True), X_replay[X.columns]], ignore_index=True)
+    else:
+        X = np.vstack([X, X_replay])
+    return X, np.concatenate([np.asarray(y), y_replay])
+
+
+def supports_warm_start(model):
+    """Model cập nhật tăng dần được không (RandomForest / ExtraTrees / GradientBoosting)"""
+    return isinstance(model, (RandomForestClassifier, ExtraTreesClassifier, GradientBoostingClassifier))
+
+
+def warm_start_update(model, X, y, n_new=RETRAIN_NEW_TREES, random_state=None, sample_weight=None):
+    """
+    Thêm n_new cây / stage fit trên (X, y) vào model đã train → {'added', 'retired', 'size'}
+
+    RandomForest (và forest khác): bỏ n_new cây cũ nhất để giữ nguyên số cây.
+    (X, y) phải có đủ mọi class của model (warm_start tính lại classes_ theo y).
+    """
+    classes = np.unique(y)
+    if not np.array_equal(classes, model.classes_):
+        missing = sorted(set(model.classes_.tolist()) - set(classes.tolist()))
+        raise ValueError(f"Dữ liệu cập nhật thiếu class {missing} (cần replay buffer đủ class)")
+
+    if isinstance(model, GradientBoostingClassifier):
+        size = model.n_estimators_
+        model.set_params(warm_start=True, n_estimators=size + n_new)
+        model.fit(X, y, sample_weight=sample_weight)
+        model.set_params(warm_start=False)
+        return {'added': model.n_estimators_ - size, 'retired': 0, 'size': model.n_estimators_}
+
+    if not supports_warm_start(model):
+        raise ValueError(f"Incremental update not supported for {type(model).__name__}")
+    size = len(model.estimators_)
+    params = {'warm_start': True, 'n_estimators': size + n_new}
+    if random_state is not None:
+        params['random_state'] = random_state   # Seed mới: cây mới không lặp lại bootstrap của cây cũ
+    model.set_params(**params)
+    model.fit(X, y, sample_weight=sample_weight)
+    added = len(model.estimators_) - size
+    model.estimators_ = model.estimators_[added:]   # Cây mới được nối vào cuối → bỏ các cây đầu (cũ nhất)
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+    return {'added': added, 'retired': added, 'size': len(model.estimators_)}
+
+
+def holdout_f1(predict, X, y):
+    return f1_score(y, predict(X), average='weighted') if len(y) else None
+
+
+def archive_version(path, version, keep=MODEL_VERSIONS_KEEP):
+    """
+    Giữ bản trước khi ghi đè: .versions/<model>.v<version>.pkl cạnh file model
+    (None nếu chưa có file hoặc keep <= 0)
+
+    Chỉ giữ keep bản mới nhất, các bản cũ hơn bị xóa.
+    """
+    if not os.path.exists(path):
+        return None
+    folder = os.path.join(os.path.dirname(path), MODEL_VERSIONS_DIR)
+    stem, ext = os.path.splitext(os.path.basename(path))
+    archived = os.path.join(folder, f'{stem}.v{version}{ext}') if keep > 0 else None
+    if archived:
+        os.makedirs(folder, exist_ok=True)
+        shutil.copy2(path, archived)
+    if not os.path.isdir(folder):
+        return archived
+
+    prefix = stem + '.v'
+    versions = []
+    for name in os.listdir(folder):
+        number = name[len(prefix):-len(ext)] if name.startswith(prefix) and name.endswith(ext) else ''
+        if number.isdigit():
+            versions.append((int(number), os.path.join(folder, name)))
+    for _, old in sorted(versions, reverse=True)[max(keep, 0):]:
+        os.remove(old)
+    return archived
+
+
+def print_update_summary(update):
+    print(f"\n🔁 Cập nhật model v{update['version']}: {update['new_rows']:,} dòng mới "
+          f"(train {update['train_rows']:,} + replay {update['replay_rows']:,}, holdout {update['holdout_rows']:,})")
+    print(f"   Cây / stage: +{update['added']} -{update['retired']} → {update['size']}")
+    if update['f1_before'] is not None:
+        print(f"   Holdout F1 (weighted): {update['f1_before']:.4f} → {update['f1_after']:.4f}")
+    print(f"   Watermark: {update['watermark_time']}  ({update['seconds']:.2f}s)")
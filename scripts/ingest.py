@@ -0,0 +1,171 @@
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# ==============================
+# ĐỌC CSV THEO CHUNK (SCHEMA CỐ ĐỊNH)
+# ==============================
+# pd.read_csv mặc định: số float64, chuỗi object, thời gian để nguyên chuỗi, và
+# cả file phải nằm trong RAM trước khi tính thống kê. Ở đây đọc từng chunk với
+# schema rõ ràng (float32 cho các cột đo, datetime64, category cho mã trạm),
+# thống kê được cộng dồn theo chunk nên không cần giữ cả file.
+
+INGEST_CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', 500_000))
+MEMORY_SAMPLE_ROWS = 50_000   # Số dòng đọc theo cách cũ để ước lượng bộ nhớ của pd.read_csv mặc định
+
+FLOAT_DTYPE = np.float32
+MEASURE_COLUMNS = ('PM2.5', 'PM10', 'TSP', 'O3', 'CO', 'NO2', 'SO2', 'Temperature', 'Humidity')
+DATETIME_COLUMNS = ('DateTime', 'Date', 'date', 'datetime', 'Timestamp')
+STATION_COLUMNS = ('Station', 'station', 'Station_ID', 'station_id', 'StationId')
+
+
+def csv_schema(path):
+    """Schema (dtype, cột thời gian, cột trạm) cho các cột có trong header của file"""
+    columns = pd.read_csv(path, nrows=0).columns.tolist()
+    dtype = {col: FLOAT_DTYPE for col in columns if col in MEASURE_COLUMNS}
+    # Mã trạm đọc dạng chuỗi rồi đổi sang category (category của từng chunk được hợp lại khi ghép)
+    dtype.update({col: str for col in columns if col in STATION_COLUMNS})
+    dates = [col for col in columns if col in DATETIME_COLUMNS]
+    stations = [col for col in columns if col in STATION_COLUMNS]
+    return columns, dtype, dates, stations
+
+
+class RunningStats:
+    """
+    Thống kê count / mean / std / min / max / missing cộng dồn theo chunk
+    (gộp mean và phương sai theo Chan et al., tính bằng float64)
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = None
+        self.count = self.mean = self.m2 = self.min = self.max = self.missing = None
+        self.time_range = {}     # cột thời gian → [min, max]
+        self.stations = {}       # cột trạm → set mã trạm
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        self._update_numeric(chunk.select_dtypes(include=[np.number]))
+        for col in chunk.columns:
+            series = chunk[col]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                self.stations.setdefault(col, set()).update(series.cat.categories)
+            elif pd.api.types.is_datetime64_any_dtype(series) and series.notna().any():
+                low, high = series.min(), series.max()
+                current = self.time_range.setdefault(col, [low, high])
+                current[0], current[1] = min(current[0], low), max(current[1], high)
+
+    def _update_numeric(self, numeric):
+        if self.columns is None:
+            self.columns = numeric.columns.tolist()
+            k = len(self.columns)
+            self.count, self.mean, self.m2 = np.zeros(k), np.zeros(k), np.zeros(k)
+            self.min, self.max = np.full(k, np.inf), np.full(k, -np.inf)
+            self.missing = np.zeros(k, dtype=np.int64)
+
+        values = numeric.reindex(columns=self.columns).to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        n = valid.sum(axis=0)
+        self.missing += len(values) - n
+        if not n.any():
+            return
+
+        safe_n = np.maximum(n, 1)
+        mean = np.where(valid, values, 0.0).sum(axis=0) / safe_n
+        m2 = np.where(valid, (values - mean) ** 2, 0.0).sum(axis=0)
+        self.min = np.minimum(self.min, np.where(valid, values, np.inf).min(axis=0))
+        self.max = np.maximum(self.max, np.where(valid, values, -np.inf).max(axis=0))
+
+        total = self.count + n
+        delta = mean - self.mean
+        safe_total = np.maximum(total, 1)
+        self.mean = self.mean + delta * n / safe_total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * n / safe_total
+        self.count = total
+
+    def describe(self):
+        """Giống df.describe() (không có phân vị) + số ô thiếu"""
+        if self.columns is None:
+            return pd.DataFrame()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.m2 / (self.count - 1))
+        has_values = self.count > 0
+        return pd.DataFrame({
+            'count': self.count,
+            'mean': np.where(has_values, self.mean, np.nan),
+            'std': std,
+            'min': np.where(has_values, self.min, np.nan),
+            'max': np.where(has_values, self.max, np.nan),
+            'missing': self.missing,
+        }, index=self.columns).T
+
+
+def iter_csv(path, chunksize=INGEST_CHUNK_ROWS, usecols=None, stats=None, offset=None):
+    """
+    Đọc CSV thành từng chunk đã ép kiểu (float32 / datetime64 / category)
+
+    stats: RunningStats được cập nhật theo từng chunk (dùng khi downstream xử lý
+    theo chunk và không bao giờ giữ cả file).
+    offset: chỉ đọc từ byte này (đầu một dòng dữ liệu); header vẫn lấy ở đầu file.
+    """
+    columns, dtype, dates, stations = csv_schema(path)
+    if usecols is not None:
+        usecols = [col for col in columns if col in usecols]
+        dtype = {col: t for col, t in dtype.items() if col in usecols}
+        dates = [col for col in dates if col in usecols]
+        stations = [col for col in stations if col in usecols]
+
+    with open(path, 'rb') as f:
+        header = {}
+        if offset is not None:
+            f.seek(offset)
+            header = {'header': None, 'names': columns}
+        for chunk in pd.read_csv(f, chunksize=chunksize, usecols=usecols, dtype=dtype, **header):
+            for col in dates:
+                chunk[col] = pd.to_datetime(chunk[col], errors='coerce')
+            for col in stations:
+                chunk[col] = chunk[col].astype('category')
+            if stats is not None:
+                stats.update(chunk)
+            yield chunk
+
+
+def concat_chunks(chunks):
+    """Ghép các chunk, hợp category của từng chunk để cột trạm vẫn là category"""
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame()
+    category_cols = [col for col in chunks[0].columns if isinstance(chunks[0][col].dtype, pd.CategoricalDtype)]
+    merged = {col: union_categoricals([chunk[col] for chunk in chunks]) for col in category_cols}
+    df = pd.concat([chunk.drop(columns=category_cols) for chunk in chunks], ignore_index=True)
+    for col in category_cols:
+        df[col] = pd.Categorical(merged[col])
+    return df[chunks[0].columns]
+
+
+def load_csv(path, chunksize=INGEST_CHUNK_ROWS, usecols=None):
+    """CSV → (DataFrame gọn, RunningStats), đọc theo chunk"""
+    stats = RunningStats()
+    df = concat_chunks(iter_csv(path, chunksize, usecols, stats))
+    return df, stats
+
+
+def memory_comparison(path, df, sample_rows=MEMORY_SAMPLE_ROWS):
+    """
+    Bộ nhớ của df so với pd.read_csv mặc định trên cùng file
+
+    Cách cũ được ước lượng từ sample_rows dòng đầu (đọc cả file theo cách cũ
+    chính là điều cần tránh).
+    """
+    compact = int(df.memory_usage(deep=True).sum())
+    sample = pd.read_csv(path, nrows=sample_rows)
+    if len(sample) == 0:
+        return {'compact_bytes': compact, 'default_bytes': 0, 'reduction': 0.0}
+    default = int(sample.memory_usage(deep=True).sum() / len(sample) * len(df))
+    return {
+        'compact_bytes': compact,
+        'default_bytes': default,
+        'reduction': 1 - compact / default if default else 0.0
+    }
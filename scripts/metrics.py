@@ -0,0 +1,289 @@
+import bisect
+import threading
+import time
+from collections import namedtuple
+
+# ==================== METRICS (PROMETHEUS TEXT FORMAT) ====================
+#
+# Mỗi request được đo bằng một RequestTimer riêng của thread (không lock);
+# khi request kết thúc toàn bộ số đo được ghi vào registry trong một lần
+# lấy lock. Stage nào không chạy trong một request đang được đo thì
+# metrics.stage() là no-op.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 2.5, 10.0)
+BATCH_SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+LOAD_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Số đo của một request đã xong (tuple → pickle được, process worker gửi về process chính)
+RequestRecord = namedtuple('RequestRecord', ['endpoint', 'model_id', 'status', 'seconds', 'stages', 'batch_size'])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Counter theo bộ label (không tự lock, ServingMetrics giữ lock khi ghi)"""
+
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, labels, value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Histogram bucket cố định theo bộ label: [count từng bucket..., sum, count]"""
+
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, labels, value):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        n = len(self.buckets)
+        for labels, state in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state[:n + 1]):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(state[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {state[-1]}')
+        return lines
+
+
+class RequestTimer:
+    """
+    Số đo của request đang chạy trên thread hiện tại
+
+    Cũng là context manager của stage (không cấp phát object mỗi stage);
+    stage không lồng nhau.
+    """
+
+    __slots__ = ('endpoint', 'model_id', 'status', 'started', 'stages', 'batch_size', 'result',
+                 '_stage', '_stage_started')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.model_id = None
+        self.status = 200
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.batch_size = None
+        self.result = None
+        self._stage = None
+
+    def __enter__(self):
+        self._stage_started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stages = self.stages
+        stages[self._stage] = stages.get(self._stage, 0.0) + time.perf_counter() - self._stage_started
+        return False
+
+    def finish(self):
+        self.result = RequestRecord(self.endpoint, self.model_id, self.status,
+                                    time.perf_counter() - self.started, self.stages, self.batch_size)
+        return self.result
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+class _Local(threading.local):
+    timer = None
+
+
+class _Activate:
+    """Gắn timer vào thread hiện tại trong khối with (khôi phục timer cũ khi ra)"""
+
+    __slots__ = ('local', 'timer', 'previous')
+
+    def __init__(self, local, timer):
+        self.local = local
+        self.timer = timer
+
+    def __enter__(self):
+        self.previous = self.local.timer
+        self.local.timer = self.timer
+        return self.timer
+
+    def __exit__(self, exc_type, exc, tb):
+        self.local.timer = self.previous
+        if exc_type is not None:
+            self.timer.status = 500
+        return False
+
+
+class _Track(_Activate):
+    """Context manager của ServingMetrics.track(): kết thúc và ghi request khi ra"""
+
+    __slots__ = ('metrics', 'defer')
+
+    def __init__(self, metrics, endpoint, defer):
+        super().__init__(metrics._local, RequestTimer(endpoint))
+        self.metrics = metrics
+        self.defer = defer
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        record = self.timer.finish()
+        if not self.defer:
+            self.metrics.record(record)
+        return False
+
+
+class ServingMetrics:
+    """
+    Metrics của API: request / lỗi / latency theo endpoint và model_id,
+    latency theo stage, batch size, thời gian load model
+
+    track(endpoint) bao một request; bên trong stage(name), set_model(),
+    observe_batch() ghi vào request của thread hiện tại.
+    """
+
+    UNKNOWN_MODEL = 'unknown'  # model_id không có trong registry (tránh label tùy ý từ client)
+
+    def __init__(self, namespace='aq'):
+        ns = namespace
+        self._lock = threading.Lock()
+        self._local = _Local()
+        self._collectors = []
+        self.requests = Counter(f'{ns}_requests_total', 'Requests by endpoint, model and HTTP status',
+                                ('endpoint', 'model_id', 'status'))
+        self.errors = Counter(f'{ns}_request_errors_total', 'Requests with HTTP status >= 400',
+                              ('endpoint', 'model_id'))
+        self.latency = Histogram(f'{ns}_request_duration_seconds', 'End-to-end handler latency',
+                                 ('endpoint', 'model_id'), LATENCY_BUCKETS)
+        self.stage_latency = Histogram(f'{ns}_stage_duration_seconds', 'Latency of each request stage',
+                                       ('endpoint', 'model_id', 'stage'), STAGE_BUCKETS)
+        self.batch_size = Histogram(f'{ns}_batch_size', 'Rows per batch/stream request',
+                                    ('endpoint', 'model_id'), BATCH_SIZE_BUCKETS)
+        self.model_loads = Counter(f'{ns}_model_loads_total', 'Model loads by result',
+                                   ('model_id', 'result'))
+        self.model_load_seconds = Histogram(f'{ns}_model_load_duration_seconds',
+                                            'Model load + warm-up duration', ('model_id',), LOAD_BUCKETS)
+        self._metrics = [self.requests, self.errors, self.latency, self.stage_latency,
+                         self.batch_size, self.model_loads, self.model_load_seconds]
+
+    # ---------- đo trong request ----------
+
+    def track(self, endpoint, defer=False):
+        """
+        with metrics.track('/api/predict') as req: ... ; req.status = status
+
+        defer=True: không ghi vào registry, record nằm ở req.result (process worker
+        trả về để process chính gọi record()).
+        """
+        return _Track(self, endpoint, defer)
+
+    def activate(self, timer):
+        """
+        Đo tiếp một RequestTimer trên thread hiện tại (request kéo dài nhiều bước,
+        vd. stream theo chunk); ghi bằng record(timer.finish()) khi xong.
+        """
+        return _Activate(self._local, timer)
+
+    def stage(self, name):
+        timer = self._local.timer
+        if timer is None:
+            return _NO_STAGE
+        timer._stage = name
+        return timer
+
+    def set_model(self, model_id):
+        timer = self._local.timer
+        if timer is not None:
+            timer.model_id = model_id
+
+    def observe_batch(self, rows):
+        timer = self._local.timer
+        if timer is not None:
+            timer.batch_size = (timer.batch_size or 0) + rows
+
+    # ---------- ghi ----------
+
+    def record(self, record):
+        model_id = record.model_id or self.UNKNOWN_MODEL
+        key = (record.endpoint, model_id)
+        with self._lock:
+            self.requests.inc((record.endpoint, model_id, str(record.status)))
+            if record.status >= 400:
+                self.errors.inc(key)
+            self.latency.observe(key, record.seconds)
+            for name, seconds in record.stages.items():
+                self.stage_latency.observe((record.endpoint, model_id, name), seconds)
+            if record.batch_size is not None:
+                self.batch_size.observe(key, record.batch_size)
+
+    def observe_model_load(self, model_id, seconds, ok):
+        with self._lock:
+            self.model_loads.inc((model_id, 'success' if ok else 'failure'))
+            if ok:
+                self.model_load_seconds.observe((model_id,), seconds)
+
+    def add_collector(self, collector):
+        """collector() → list (name, type, help, [(labels dict, value), ...]) đọc lúc scrape"""
+        self._collectors.append(collector)
+
+    # ---------- xuất ----------
+
+    def render(self):
+        """Toàn bộ metrics dạng Prometheus text exposition format"""
+        with self._lock:
+            lines = [line for metric in self._metrics for line in metric.render()]
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+from datetime import datetime
+import numpy as np
+
+from compiled_tree import CompiledTree, TREE_ARRAYS, compile_model
+from preprocessor import PREPROCESSOR_ARRAYS, FittedPreprocessor
+
+# ==================== MODEL ARTIFACT (.aqm) ====================
+#
+# Một artifact là một thư mục <tên>.aqm gồm:
+#   manifest.json  — feature names, class labels, kiểu model, dtype/shape các mảng
+#   <mảng>.npy     — mảng phẳng của cây (xem TREE_ARRAYS), thống kê scaler và
+#                    preprocessor (median / khoảng kẹp, xem preprocessor.py) nếu có
+#
+# File .npy được mở bằng np.load(mmap_mode='r'): không copy vào RAM, nhiều
+# worker process dùng chung page cache, thời gian load không phụ thuộc kích thước model.
+
+ARTIFACT_EXTENSION = '.aqm'
+ARTIFACT_FORMAT_VERSION = 1
+
+
+def artifact_path_for(pkl_path):
+    """Đường dẫn artifact tương ứng với file pkl (model.pkl → model.aqm)"""
+    return os.path.splitext(pkl_path)[0] + ARTIFACT_EXTENSION
+
+
+def is_artifact(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'manifest.json'))
+
+
+class LabelDecoder:
+    """Thay cho LabelEncoder khi serving: chỉ cần classes_ và inverse_transform"""
+
+    def __init__(self, classes):
+        self.classes_ = np.asarray(classes, dtype=object)
+
+    def inverse_transform(self, y):
+        return self.classes_[np.asarray(y, dtype=np.int64)]
+
+
+class ArtifactModel:
+    """
+    Model load từ artifact, có interface giống sklearn (predict, predict_proba, apply)
+
+    tree_ trỏ về CompiledTree khi model là một cây → decision path dùng được như cũ.
+    """
+
+    def __init__(self, compiled, manifest):
+        self.compiled = compiled
+        self.model_type = manifest['model_type']
+        self.classes_ = compiled.classes
+        self.n_classes_ = len(compiled.classes)
+        self.n_features_in_ = compiled.n_features
+        if manifest.get('feature_importances') is not None:
+            self.feature_importances_ = np.asarray(manifest['feature_importances'])
+        if compiled.n_trees == 1 and compiled.scaler_scale is None:
+            self.tree_ = compiled
+
+    def predict_proba(self, X):
+        return self.compiled.predict(X)[1]
+
+    def predict(self, X):
+        return self.classes_[self.compiled.predict(X)[0]]
+
+    def apply(self, X):
+        return self.compiled.apply(X)
+
+    def get_depth(self):
+        return self.compiled.max_depth
+
+    def get_n_leaves(self):
+        return int((self.compiled.children_left == -1).sum())
+
+
+def save_artifact(path, model, feature_names, label_encoder, metadata=None, preprocessor=None):
+    """
+    Ghi model ra artifact .aqm (ghi vào thư mục tạm rồi rename để không lộ bản dở dang)
+
+    Trả về đường dẫn artifact, hoặc None nếu model không compile được (artifact cũ
+    cùng tên bị xóa, để serving không load nhầm model trước đó thay cho pkl mới).
+    """
+    compiled = compile_model(model)
+    if compiled is None:
+        print(f"⚠️  Model {type(model).__name__} không hỗ trợ artifact, chỉ lưu pkl")
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+
+    final_model = model.steps[-1][1] if hasattr(model, 'steps') else model
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    arrays = compiled.arrays()
+    if compiled.scaler_scale is not None:
+        arrays['scaler_mean'] = compiled.scaler_mean
+        arrays['scaler_scale'] = compiled.scaler_scale
+    if preprocessor is not None:
+        arrays.update(preprocessor.arrays())
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array))
+
+    importances = getattr(final_model, 'feature_importances_', None)
+    manifest = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'model_type': type(model).__name__,
+        'estimator_type': type(final_model).__name__,
+        'feature_names': list(feature_names) if feature_names is not None else None,
+        'classes': compiled.classes.tolist(),
+        'class_labels': [str(c) for c in label_encoder.classes_] if label_encoder is not None else None,
+        'n_features': compiled.n_features,
+        'n_trees': compiled.n_trees,
+        'max_depth': compiled.max_depth,
+        'feature_importances': importances.tolist() if importances is not None else None,
+        'arrays': {name: {'dtype': str(a.dtype), 'shape': list(a.shape)} for name, a in arrays.items()},
+        'preprocessor': preprocessor.manifest() if preprocessor is not None else None,
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'metadata': metadata or {},
+    }
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, default=str)
+
+    # Đổi tên bản cũ sang một bên, đưa bản mới vào rồi mới xóa bản cũ: path chỉ vắng
+    # mặt giữa hai lần rename (không phải suốt lúc rmtree), luôn là artifact hoàn chỉnh
+    old_path = path + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+
+def load_artifact(path, mmap=True):
+    """
+    Load artifact → dict cùng cấu trúc với load_model_from_file
+
+    mmap=True: các mảng là np.memmap chỉ đọc (zero-copy).
+    """
+    with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format: {manifest.get('format_version')}")
+
+    mmap_mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+              for name in manifest['arrays']}
+    compiled = CompiledTree(
+        {name: arrays[name] for name in TREE_ARRAYS},
+        classes=np.asarray(manifest['classes']),
+        n_features=manifest['n_features'],
+        max_depth=manifest['max_depth'],
+        scaler_mean=arrays.get('scaler_mean'),
+        scaler_scale=arrays.get('scaler_scale'),
+    )
+    class_labels = manifest.get('class_labels')
+    preprocessor = None
+    if manifest.get('preprocessor') is not None:
+        preprocessor = FittedPreprocessor.from_artifact(
+            manifest['preprocessor'], {name: arrays[name] for name in PREPROCESSOR_ARRAYS})
+    return {
+        'model': ArtifactModel(compiled, manifest),
+        'compiled': compiled,
+        'feature_names': manifest.get('feature_names'),
+        'label_encoder': LabelDecoder(class_labels) if class_labels is not None else None,
+        'preprocessor': preprocessor,
+        'manifest': manifest,
+    }
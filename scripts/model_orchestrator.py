@@ -0,0 +1,114 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, parallel_config
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+from sklearn.utils.class_weight import compute_sample_weight
+
+# ==============================
+# TRAIN NHIỀU MODEL ĐỒNG THỜI (CORE BUDGET CHUNG)
+# ==============================
+# Mỗi model được tách thành các task độc lập: 1 lần fit trên tập train (đã resample)
+# và cv lần fit trên các fold của tập train gốc. Task của mọi model chạy chung một
+# process pool (joblib/loky) gồm tối đa TRAIN_CORE_BUDGET worker; mỗi task dùng
+# 1 core (n_jobs=1, 1 thread BLAS/OpenMP) nên tổng số core không vượt budget.
+# Mảng lớn hơn MEMMAP_MIN_BYTES được joblib ghi ra file một lần, worker mở bằng
+# memmap thay vì nhận bản copy. Task của fold trả về prediction out-of-fold: CV
+# score tính lại từ đó, không cần fit thêm lần nào.
+
+TRAIN_CORE_BUDGET = int(os.environ.get('TRAIN_CORE_BUDGET', os.cpu_count() or 1))
+MEMMAP_MIN_BYTES = '1M'
+CV_FOLDS = 5
+
+
+def _n_jobs_params(estimator):
+    """Các tham số n_jobs (kể cả trong Pipeline) → giá trị hiện tại"""
+    return {name: value for name, value in estimator.get_params().items()
+            if name == 'n_jobs' or name.endswith('__n_jobs')}
+
+
+def single_core(estimator):
+    """Bản clone với mọi n_jobs (kể cả trong Pipeline) = 1"""
+    return clone(estimator).set_params(**{name: 1 for name in _n_jobs_params(estimator)})
+
+
+def _as_frame(X, columns):
+    """Giữ tên feature như lúc fit trên DataFrame (không copy memmap)"""
+    return X if columns is None else pd.DataFrame(X, columns=columns, copy=False)
+
+
+def _run_task(name, fold, estimator, columns, X_fit, y_fit, fit_rows, predict_sets, sample_weight=None):
+    """
+    Fit estimator trên X_fit[fit_rows] (fit_rows=None: cả mảng) rồi predict từng (X, rows) trong
+    predict_sets → (name, fold, model, predictions, fit_seconds, seconds)
+
+    sample_weight: mảng trọng số của X_fit, hoặc 'balanced' → cân bằng class theo y của các dòng fit.
+
+    Model chỉ được trả về cho task fit cuối (fold=None); model của fold bị bỏ.
+    """
+    started = time.perf_counter()
+    if fit_rows is not None:
+        X_fit, y_fit = X_fit[fit_rows], y_fit[fit_rows]
+    if isinstance(sample_weight, str):
+        sample_weight = compute_sample_weight(sample_weight, y_fit)
+    model = estimator.fit(_as_frame(X_fit, columns), y_fit, sample_weight=sample_weight)
+    fit_seconds = time.perf_counter() - started
+    predictions = [model.predict(_as_frame(X if rows is None else X[rows], columns)) for X, rows in predict_sets]
+    return name, fold, model if fold is None else None, predictions, fit_seconds, time.perf_counter() - started
+
+
+def train_models(models, X_fit, y_fit, X_train, y_train, X_test, cv=CV_FOLDS, core_budget=TRAIN_CORE_BUDGET,
+                 sample_weight=None):
+    """
+    Train các models đồng thời → yield (name, kết quả) theo thứ tự model xong
+
+    X_fit / y_fit: dữ liệu fit model cuối (vd. sau resample); sample_weight: {name: trọng số
+    cân bằng class của từng dòng X_fit} cho lần fit cuối của model đó, fit của mỗi fold dùng
+    trọng số cân bằng tính lại từ y của fold. CV chạy trên X_train / y_train với
+    StratifiedKFold(cv) (cùng fold như cross_val_score(cv=cv)).
+    Model trả về được đặt lại n_jobs như trong models (chỉ lúc train mới chạy 1 core).
+    Kết quả: {'model', 'y_pred_train', 'y_pred_test', 'cv_scores' (accuracy từng
+    fold), 'cv_pred' (prediction out-of-fold trên X_train), 'fit_seconds',
+    'cv_seconds' (tổng thời gian các task fold)}.
+    """
+    columns = list(X_train.columns) if isinstance(X_train, pd.DataFrame) else None
+    X_fit, X_train, X_test = (np.ascontiguousarray(np.asarray(X)) for X in (X_fit, X_train, X_test))
+    y_fit, y_train = np.asarray(y_fit), np.asarray(y_train)
+    folds = list(StratifiedKFold(n_splits=cv).split(X_train, y_train))
+
+    # Task fit cuối (lâu nhất) được xếp trước các fold
+    estimators = {name: single_core(estimator) for name, estimator in models.items()}
+    sample_weight = sample_weight or {}
+    tasks = [delayed(_run_task)(name, None, estimator, columns, X_fit, y_fit, None,
+                                [(X_train, None), (X_test, None)], sample_weight.get(name))
+             for name, estimator in estimators.items()]
+    tasks += [delayed(_run_task)(name, k, clone(estimator), columns, X_train, y_train, train_rows,
+                                 [(X_train, val_rows)],
+                                 'balanced' if sample_weight.get(name) is not None else None)
+              for name, estimator in estimators.items()
+              for k, (train_rows, val_rows) in enumerate(folds)]
+
+    remaining = {name: cv + 1 for name in models}
+    partial = {name: {'cv_scores': np.zeros(cv), 'cv_pred': np.empty_like(y_train), 'cv_seconds': 0.0}
+               for name in models}
+    n_workers = max(1, min(core_budget, len(tasks)))
+    with parallel_config(backend='loky', inner_max_num_threads=1):
+        outputs = Parallel(n_jobs=n_workers, return_as='generator_unordered',
+                           max_nbytes=MEMMAP_MIN_BYTES, mmap_mode='r')(tasks)
+        for name, fold, model, predictions, fit_seconds, seconds in outputs:
+            result = partial[name]
+            if fold is None:
+                model.set_params(**_n_jobs_params(models[name]))
+                result.update(model=model, y_pred_train=predictions[0], y_pred_test=predictions[1],
+                              fit_seconds=fit_seconds)
+            else:
+                val_rows = folds[fold][1]
+                result['cv_pred'][val_rows] = predictions[0]
+                result['cv_scores'][fold] = np.mean(predictions[0] == y_train[val_rows])
+                result['cv_seconds'] += seconds
+            remaining[name] -= 1
+            if remaining[name] == 0:
+                yield name, partial.pop(name)
@@ -0,0 +1,391 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import MappingProxyType
+
+# ==================== MODEL REGISTRY (LAZY + LRU + SNAPSHOT) ====================
+
+# Một model trên đĩa: (mtime_ns, size) để phát hiện thay đổi nhanh, content_hash để xác nhận
+ModelEntry = namedtuple('ModelEntry', ['model_id', 'path', 'mtime_ns', 'size', 'content_hash'])
+
+
+def same_model(a, b):
+    """Hai entry cùng một model đã load được (cùng file, cùng nội dung)"""
+    return a is not None and b is not None and a.path == b.path and a.content_hash == b.content_hash
+
+
+class RegistrySnapshot:
+    """Danh sách model bất biến tại một thời điểm (model_id → ModelEntry)"""
+
+    def __init__(self, version, entries):
+        self.version = version
+        self.entries = MappingProxyType(dict(entries))
+        self.created_at = datetime.now().isoformat()
+
+
+def _model_files(path):
+    """Các file tạo nên model: file pkl, hoặc mọi file trong thư mục artifact"""
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    return [path]
+
+
+def file_signature(path):
+    """(mtime_ns mới nhất, tổng size) của model — đổi khi file được ghi lại"""
+    stats = [os.stat(p) for p in _model_files(path)]
+    return max(s.st_mtime_ns for s in stats), sum(s.st_size for s in stats)
+
+
+def content_hash(path, chunk_size=1 << 20):
+    """SHA-256 nội dung model (artifact: gồm cả tên file)"""
+    digest = hashlib.sha256()
+    for file_path in _model_files(path):
+        digest.update(os.path.basename(file_path).encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def estimate_model_bytes(model_data):
+    """
+    Ước lượng bộ nhớ của một model đã load
+
+    Mảng của cây đã compile được tính chính xác (kể cả memmap), phần object
+    sklearn được ước lượng bằng kích thước file pkl.
+    """
+    total = 0
+    compiled = model_data.get('compiled')
+    if compiled is not None:
+        total += sum(a.nbytes for a in compiled.arrays().values())
+    if model_data.get('format') == 'pickle':
+        try:
+            total += os.path.getsize(model_data['path'])
+        except OSError:
+            pass
+    return total
+
+
+class ModelRegistry:
+    """
+    Danh sách model trên đĩa (snapshot có version) + cache LRU các model trong RAM
+
+    - reload(): so sánh mtime/size rồi hash nội dung, chỉ load model mới hoặc đã đổi,
+      sau đó thay snapshot trong một bước — request đang chạy vẫn dùng snapshot cũ
+    - get(): load khi dùng lần đầu; nhiều request đồng thời cho cùng model
+      chỉ kích hoạt một lần load (single-flight)
+    - khi tổng bộ nhớ vượt memory_budget_bytes, model ít dùng gần đây nhất bị evict
+    - model load lỗi được ghi nhớ theo hash nội dung: get() trả về None ngay, không
+      load lại file lỗi ở mỗi request cho tới lần reload (scan) sau
+    """
+
+    def __init__(self, loader, memory_budget_bytes, on_load=None):
+        self.loader = loader
+        self.on_load = on_load   # on_load(model_id, seconds, ok) sau mỗi lần load (metrics)
+        self.memory_budget = memory_budget_bytes
+        self._lock = threading.Lock()
+        self._versions = itertools.count(1)
+        self._snapshot = RegistrySnapshot(0, {})
+        self._resident = OrderedDict()   # model_id → (ModelEntry, model_data), thứ tự LRU
+        self._load_locks = {}
+        self._failed = {}                # model_id → ModelEntry đã load lỗi
+        self._info = {}
+        self._reload_lock = threading.Lock()
+        self._reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-reload')
+        self.last_reload = None
+
+    # ---------- snapshot ----------
+
+    def snapshot(self):
+        """Snapshot hiện tại (bất biến, đọc không cần lock)"""
+        return self._snapshot
+
+    def model_ids(self):
+        return list(self._snapshot.entries.keys())
+
+    def __contains__(self, model_id):
+        return model_id in self._snapshot.entries
+
+    def resident_ids(self):
+        with self._lock:
+            return list(self._resident.keys())
+
+    @staticmethod
+    def _new_info(entry):
+        return {
+            'filename': os.path.basename(entry.path),
+            'filepath': entry.path,
+            'content_hash': entry.content_hash,
+            'model_type': None,
+            'format': None,
+            'has_feature_names': None,
+            'has_label_encoder': None,
+            'compiled': None,
+            'state': 'not_loaded',
+            'loaded_at': None,
+            'last_used': None,
+            'memory_bytes': 0,
+            'load_count': 0,
+            'eviction_count': 0,
+            'load_seconds': None
+        }
+
+    def metadata(self, model_id=None):
+        """Metadata (bản copy) của một model hoặc của tất cả models"""
+        with self._lock:
+            if model_id is not None:
+                info = self._info.get(model_id)
+                return dict(info) if info is not None else None
+            return {mid: dict(info) for mid, info in self._info.items()}
+
+    # ---------- reload ----------
+
+    def _scan(self, model_paths, current):
+        """So sánh model_paths với snapshot hiện tại → (entries mới, added, updated, unchanged)"""
+        entries, added, updated, unchanged = {}, [], [], []
+        for model_id, path in model_paths.items():
+            old = current.get(model_id)
+            try:
+                mtime_ns, size = file_signature(path)
+                if old is not None and old.path == path and (old.mtime_ns, old.size) == (mtime_ns, size):
+                    entries[model_id] = old
+                    unchanged.append(model_id)
+                    continue
+                entry = ModelEntry(model_id, path, mtime_ns, size, content_hash(path))
+            except OSError as e:
+                print(f"Cannot read model '{model_id}' at {path}: {e}")
+                continue
+            if old is None:
+                added.append(model_id)
+            elif old.path == path and old.content_hash == entry.content_hash:
+                # Chỉ mtime đổi (touch / copy lại cùng nội dung) → không load lại
+                unchanged.append(model_id)
+            else:
+                updated.append(model_id)
+            entries[model_id] = entry
+        return entries, added, updated, unchanged
+
+    def reload(self, model_paths, preload=True):
+        """
+        Cập nhật registry theo model_paths ({model_id: path})
+
+        preload=True: load trước các model mới/đã đổi rồi mới swap snapshot, model load
+        lỗi giữ bản cũ. preload=False (lúc start server): chỉ ghi nhận, load khi dùng.
+        Trả về báo cáo added/updated/removed kèm thời gian.
+        """
+        with self._reload_lock:
+            started = time.perf_counter()
+            current = self._snapshot.entries
+            entries, added, updated, unchanged = self._scan(model_paths, current)
+            removed = [model_id for model_id in current if model_id not in entries]
+            scan_seconds = time.perf_counter() - started
+
+            loaded, failed, load_seconds = {}, {}, {}
+            if preload:
+                for model_id in added + updated:
+                    load_started = time.perf_counter()
+                    model_data = self.loader(entries[model_id].path)
+                    load_seconds[model_id] = time.perf_counter() - load_started
+                    ok = bool(model_data) and model_data.get('model') is not None
+                    self._notify_load(model_id, load_seconds[model_id], ok)
+                    if ok:
+                        loaded[model_id] = model_data
+                        continue
+                    failed[model_id] = entries[model_id].path
+                    if model_id in current:
+                        entries[model_id] = current[model_id]   # Giữ bản đang chạy
+                    else:
+                        del entries[model_id]
+            added = [m for m in added if m not in failed]
+            updated = [m for m in updated if m not in failed]
+
+            with self._lock:
+                snapshot = RegistrySnapshot(next(self._versions), entries)
+                self._snapshot = snapshot
+                self._failed.clear()   # File đã được scan lại → cho phép load lại
+                for model_id in removed:
+                    self._resident.pop(model_id, None)
+                    self._info.pop(model_id, None)
+                    self._load_locks.pop(model_id, None)
+                for model_id in added + updated:
+                    self._resident.pop(model_id, None)
+                    self._info[model_id] = self._new_info(entries[model_id])
+                    if model_id in loaded:
+                        self._install(entries[model_id], loaded[model_id], load_seconds[model_id])
+                self._enforce_budget(keep=None)
+
+            report = {
+                'version': snapshot.version,
+                'added': added,
+                'updated': updated,
+                'removed': removed,
+                'unchanged': unchanged,
+                'failed': failed,
+                'timings': {
+                    'scan_seconds': scan_seconds,
+                    'load_seconds': load_seconds,
+                    'total_seconds': time.perf_counter() - started
+                },
+                'finished_at': datetime.now().isoformat()
+            }
+            self.last_reload = report
+            return report
+
+    def reload_async(self, scan_fn, preload=True, callback=None):
+        """
+        Chạy scan_fn() (→ model_paths) và reload trên thread nền, trả về Future
+
+        callback(report) được gọi trên thread nền sau khi swap snapshot.
+        """
+        def run():
+            report = self.reload(scan_fn(), preload)
+            if callback is not None:
+                callback(report)
+            return report
+        return self._reload_executor.submit(run)
+
+    def preload(self, model_ids=None, workers=4):
+        """
+        Load song song các model (mặc định: tất cả) trong thread pool
+
+        Dừng nhận model mới khi đã chạm memory budget. Trả về
+        {model_id: {'status', 'seconds'}} theo thứ tự model_ids.
+        """
+        model_ids = self.model_ids() if model_ids is None else list(model_ids)
+
+        def load(model_id):
+            if self.stats()['memory_bytes'] >= self.memory_budget:
+                return model_id, {'status': 'skipped_budget', 'seconds': 0.0}
+            started = time.perf_counter()
+            model_data = self.get(model_id)
+            return model_id, {
+                'status': 'ready' if model_data is not None else 'failed',
+                'seconds': time.perf_counter() - started
+            }
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='model-preload') as pool:
+            return dict(pool.map(load, model_ids))
+
+    # ---------- load / evict ----------
+
+    def get(self, model_id, snapshot=None):
+        """
+        Lấy model theo snapshot (mặc định: snapshot hiện tại), load nếu chưa có trong RAM
+
+        None nếu model không tồn tại hoặc load lỗi (kể cả lỗi đã ghi nhớ từ trước).
+        """
+        entry = (snapshot or self._snapshot).entries.get(model_id)
+        if entry is None:
+            return None
+        with self._lock:
+            model_data = self._resident_data(entry)
+            if model_data is not None:
+                return model_data
+            if same_model(self._failed.get(model_id), entry):
+                return None
+            load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+
+        with load_lock:
+            # Request khác có thể vừa load xong trong lúc chờ lock
+            with self._lock:
+                model_data = self._resident_data(entry)
+                if model_data is not None:
+                    return model_data
+                if same_model(self._failed.get(model_id), entry):
+                    return None
+
+            started = time.perf_counter()
+            model_data = self.loader(entry.path)
+            elapsed = time.perf_counter() - started
+            self._notify_load(model_id, elapsed, bool(model_data) and model_data.get('model') is not None)
+
+            with self._lock:
+                if not same_model(self._snapshot.entries.get(model_id), entry):
+                    # Snapshot đã đổi trong lúc load → chỉ dùng cho request này
+                    return model_data if model_data and model_data.get('model') is not None else None
+                if not model_data or model_data.get('model') is None:
+                    self._info[model_id]['state'] = 'failed'
+                    self._failed[model_id] = entry
+                    return None
+                self._install(entry, model_data, elapsed)
+                self._enforce_budget(keep=model_id)
+            return model_data
+
+    def _notify_load(self, model_id, seconds, ok):
+        if self.on_load is not None:
+            self.on_load(model_id, seconds, ok)
+
+    def _resident_data(self, entry):
+        resident = self._resident.get(entry.model_id)
+        if resident is None or not same_model(resident[0], entry):
+            return None
+        self._touch(entry.model_id)
+        return resident[1]
+
+    def _install(self, entry, model_data, load_seconds):
+        """Đưa model vào LRU (gọi khi đang giữ self._lock)"""
+        model_id = entry.model_id
+        model = model_data['model']
+        info = self._info[model_id]
+        self._resident[model_id] = (entry, model_data)
+        info.update(model_data.get('timings', {}))
+        info.update({
+            'filename': os.path.basename(model_data['path']),
+            'filepath': model_data['path'],
+            'model_type': getattr(model, 'model_type', type(model).__name__),
+            'format': model_data.get('format'),
+            'has_feature_names': model_data.get('feature_names') is not None,
+            'has_label_encoder': model_data.get('label_encoder') is not None,
+            'compiled': model_data.get('compiled') is not None,
+            'state': 'resident',
+            'loaded_at': datetime.now().isoformat(),
+            'memory_bytes': estimate_model_bytes(model_data),
+            'load_count': info['load_count'] + 1,
+            'load_seconds': load_seconds
+        })
+        self._touch(model_id)
+
+    def _touch(self, model_id):
+        self._resident.move_to_end(model_id)
+        self._info[model_id]['last_used'] = datetime.now().isoformat()
+
+    def _enforce_budget(self, keep):
+        """Evict model LRU cho tới khi tổng bộ nhớ ≤ budget (luôn giữ model vừa dùng)"""
+        usage = sum(self._info[mid]['memory_bytes'] for mid in self._resident)
+        for model_id in list(self._resident.keys()):
+            if usage <= self.memory_budget:
+                break
+            if model_id == keep:
+                continue
+            usage -= self._info[model_id]['memory_bytes']
+            self._evict(model_id)
+
+    def _evict(self, model_id):
+        # Request đang chạy vẫn giữ tham chiếu model_data nên không bị ảnh hưởng
+        del self._resident[model_id]
+        info = self._info[model_id]
+        info['state'] = 'evicted'
+        info['eviction_count'] += 1
+        print(f"Evicted model '{model_id}' ({info['memory_bytes'] / 1e6:.1f} MB)")
+
+    def evict(self, model_id):
+        with self._lock:
+            if model_id in self._resident:
+                self._evict(model_id)
+                return True
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'snapshot_version': self._snapshot.version,
+                'available': len(self._snapshot.entries),
+                'resident': len(self._resident),
+                'memory_bytes': sum(self._info[mid]['memory_bytes'] for mid in self._resident),
+                'memory_budget_bytes': self.memory_budget
+            }
@@ -0,0 +1,124 @@
+import json
+import numpy as np
+
+# ==================== PAYLOAD FORMATS (/api/predict-batch) ====================
+#
+# Ngoài JSON theo dòng ({"samples": [{...}, ...]}) batch còn nhận/trả về:
+#   columnar — JSON một mảng cho mỗi feature: {"columns": {"PM2.5": [...], ...}}
+#   binary   — ma trận little-endian float32/float64 (row-major), header
+#              X-Feature-Order: PM2.5,PM10,...  và X-Dtype: float32|float64
+#   arrow    — Arrow IPC stream (cần pyarrow)
+# Cột được map thẳng sang thứ tự feature của model bằng numpy, không lặp từng ô.
+
+BINARY_MIMETYPE = 'application/octet-stream'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+BATCH_FORMATS = ('json', 'columnar', 'binary', 'arrow')
+BINARY_DTYPES = {'float32': '<f4', 'float64': '<f8'}
+BINARY_RESULT_COLUMNS = ['class_index', 'confidence', 'level']
+
+
+class PayloadError(ValueError):
+    """Payload không hợp lệ → 400 (415 nếu thiếu thư viện)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class BinaryResponse:
+    """Response không phải JSON của batch (binary / Arrow)"""
+
+    def __init__(self, body, mimetype, headers):
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = headers
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise PayloadError('Arrow IPC requires pyarrow: pip install pyarrow', status=415)
+    return pyarrow
+
+
+def align_columns(columns, n_rows, feature_order):
+    """
+    {tên feature: mảng 1 chiều} → ma trận X (n_rows × len(feature_order)), float64
+
+    Feature thiếu = 0 (giống sample.get(f, 0) của JSON theo dòng).
+    """
+    X = np.zeros((n_rows, len(feature_order)), dtype=np.float64)
+    for j, name in enumerate(feature_order):
+        column = columns.get(name)
+        if column is None:
+            continue
+        column = np.asarray(column, dtype=np.float64)
+        if column.shape != (n_rows,):
+            raise PayloadError(f'Column "{name}" has {column.size} values, expected {n_rows}')
+        X[:, j] = column
+    return X
+
+
+def columnar_to_matrix(columns, feature_order):
+    """JSON columnar {"PM2.5": [...], ...} → X"""
+    if not isinstance(columns, dict) or not columns:
+        raise PayloadError('columns must be a non-empty object of feature → array')
+    try:
+        n_rows = len(next(iter(columns.values())))
+        return align_columns(columns, n_rows, feature_order)
+    except (TypeError, ValueError) as e:
+        if isinstance(e, PayloadError):
+            raise
+        raise PayloadError(f'Invalid column values: {e}')
+
+
+def binary_to_matrix(body, feature_header, dtype_name, feature_order):
+    """Ma trận raw little-endian + header thứ tự cột → X theo feature_order (zero-copy khi đọc)"""
+    if not feature_header:
+        raise PayloadError('Missing X-Feature-Order header')
+    names = [name.strip() for name in feature_header.split(',')]
+    dtype = BINARY_DTYPES.get((dtype_name or 'float64').lower())
+    if dtype is None:
+        raise PayloadError(f'Unsupported X-Dtype: {dtype_name} (use float32 or float64)')
+    row_bytes = len(names) * np.dtype(dtype).itemsize
+    if len(body) % row_bytes:
+        raise PayloadError(f'Body size {len(body)} is not a multiple of row size {row_bytes}')
+    matrix = np.frombuffer(body, dtype=dtype).reshape(-1, len(names))
+    return align_columns({name: matrix[:, j] for j, name in enumerate(names)}, matrix.shape[0], feature_order)
+
+
+def arrow_to_matrix(body, feature_order):
+    """Arrow IPC stream → X (mỗi feature là một cột số)"""
+    pa = _require_pyarrow()
+    try:
+        table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    except pa.ArrowInvalid as e:
+        raise PayloadError(f'Invalid Arrow IPC stream: {e}')
+    columns = {name: table.column(name).to_numpy() for name in table.column_names if name in feature_order}
+    return align_columns(columns, table.num_rows, feature_order)
+
+
+def encode_binary(class_index, confidence, level, dtype_name, labels):
+    """Kết quả → (bytes, headers): ma trận [class_index, confidence, level] little-endian"""
+    dtype = BINARY_DTYPES.get((dtype_name or 'float32').lower(), '<f4')
+    matrix = np.column_stack([class_index, confidence, level]).astype(dtype)
+    headers = {
+        'X-Columns': ','.join(BINARY_RESULT_COLUMNS),
+        'X-Dtype': 'float32' if dtype == '<f4' else 'float64',
+        'X-Rows': str(matrix.shape[0]),
+        # Header chỉ chứa ASCII → nhãn được escape dạng JSON
+        'X-Class-Labels': json.dumps([str(label) for label in labels]),
+    }
+    return matrix.tobytes(), headers
+
+
+def encode_arrow(columns):
+    """{tên cột: mảng/list} → Arrow IPC stream bytes"""
+    pa = _require_pyarrow()
+    table = pa.table(columns)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# ==================== PREDICTION CACHE ====================
+
+def split_thresholds(model, compiled=None):
+    """
+    Threshold của mọi split trong model (theo đơn vị feature gốc) → {feature index: mảng threshold tăng dần}
+
+    Đọc từ CompiledTree nếu có, không thì từ sklearn: cây, forest, GradientBoosting
+    và Pipeline (StandardScaler được đảo ngược). Model không có cây → {}.
+    """
+    mean = scale = None
+    if compiled is not None:
+        internal = compiled.children_left != -1
+        features, thresholds = compiled.feature[internal], compiled.threshold[internal]
+        mean, scale = compiled.scaler_mean, compiled.scaler_scale
+    else:
+        if hasattr(model, 'steps'):
+            for _, step in model.steps[:-1]:
+                if type(step).__name__ == 'StandardScaler':
+                    mean, scale = step.mean_, step.scale_
+            model = model.steps[-1][1]
+        if hasattr(model, 'tree_'):
+            trees = [model.tree_]
+        elif hasattr(model, 'estimators_'):
+            trees = [e.tree_ for e in np.ravel(model.estimators_) if hasattr(e, 'tree_')]
+        else:
+            return {}
+        if not trees:
+            return {}
+        features = np.concatenate([t.feature[t.children_left != -1] for t in trees])
+        thresholds = np.concatenate([t.threshold[t.children_left != -1] for t in trees])
+
+    features = np.asarray(features, dtype=np.int64)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    if scale is not None:
+        thresholds = thresholds * np.asarray(scale)[features] + np.asarray(mean)[features]
+    return {int(f): np.unique(thresholds[features == f]) for f in np.unique(features)}
+
+
+def cache_steps(thresholds, feature_order, default_step, fraction=0.1):
+    """
+    Bước lượng tử của từng feature, lấy từ threshold của model
+
+    Bước = fraction (< 1) × khoảng cách nhỏ nhất giữa hai threshold liền nhau của
+    feature → mỗi bucket chứa tối đa một threshold. Feature chỉ có một threshold dùng bước
+    nhỏ nhất của model; feature không được split (không ảnh hưởng kết quả) hoặc
+    model không có cây dùng default_step.
+    """
+    steps = {}
+    for i, f in enumerate(feature_order):
+        values = thresholds.get(i)
+        if values is not None and len(values) > 1:
+            steps[f] = float(np.diff(values).min()) * fraction
+    finest = min(steps.values(), default=default_step)
+    for i, f in enumerate(feature_order):
+        if f not in steps:
+            steps[f] = finest if i in thresholds else default_step
+    return steps
+
+
+def quantize_features(features, feature_order, steps):
+    """
+    Lượng tử hóa vector feature theo bước riêng của từng feature → (key, features đã lượng tử hóa)
+
+    Các giá trị cùng bucket cho ra cùng một key và cùng một vector (tâm bucket),
+    nên predict trên vector đã lượng tử hóa luôn cho cùng kết quả với một key.
+    Giá trị không phải số được giữ nguyên để không đụng nhau.
+    """
+    key, quantized = [], {}
+    for f in feature_order:
+        value = features.get(f, 0)
+        step = steps.get(f)
+        try:
+            bucket = round(float(value) / step) if step else float(value)
+            key.append(bucket)
+            quantized[f] = bucket * step if step else float(value)
+        except (TypeError, ValueError, OverflowError):
+            key.append(('raw', repr(value)))
+            quantized[f] = value
+    return tuple(key), quantized
+
+
+class PredictionCache:
+    """
+    LRU cache có giới hạn kích thước và TTL cho response của /api/predict
+
+    Key: (model_id, model version, vector feature đã lượng tử hóa).
+    """
+
+    def __init__(self, max_size=10000, ttl_seconds=300.0):
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl_seconds)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, payload = entry
+            if expires_at < now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, key, payload):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, model_id=None):
+        """Xóa các entry của một model (hoặc toàn bộ cache nếu model_id=None)"""
+        with self._lock:
+            if model_id is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [k for k in self._entries if k[0] == model_id]
+                for k in keys:
+                    del self._entries[k]
+                removed = len(keys)
+            self.invalidations += removed
+            return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
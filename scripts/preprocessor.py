@@ -0,0 +1,123 @@
+import warnings
+
+import numpy as np
+
+# ==============================
+# PREPROCESSOR ĐÃ FIT (TRAIN + SERVING)
+# ==============================
+# Thống kê của mọi cột (median, mean, std) được tính trong một lần trên cả ma
+# trận. Khi train: điền median rồi bỏ dòng có bất kỳ cột nào ngoài mean ± z·std
+# (một mask chung, không phụ thuộc thứ tự cột). Preprocessor được lưu cùng model
+# (pkl + artifact) để serving điền median và kẹp giá trị vào đúng khoảng đó.
+
+PREPROCESSOR_FORMAT_VERSION = 1
+PREPROCESSOR_ARRAYS = ('prep_median', 'prep_lower', 'prep_upper')
+
+
+class FittedPreprocessor:
+    """
+    Median (điền giá trị thiếu) và khoảng [lower, upper] của từng cột
+
+    z=None: chỉ điền median, không giới hạn khoảng (lower = -inf, upper = +inf).
+    """
+
+    def __init__(self, columns, median, lower, upper, z=None):
+        self.columns = list(columns)
+        self.median = np.asarray(median, dtype=np.float64)
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.z = z
+
+    @classmethod
+    def fit_transform(cls, df, columns, z=3.0):
+        """Fit trên df[columns] → (preprocessor, df đã điền median và lọc outlier)"""
+        values = df[columns].to_numpy(dtype=np.float64)
+        missing = np.isnan(values)
+        missing_cols = np.flatnonzero(missing.any(axis=0))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)   # Cột toàn NaN → median NaN
+            median = np.nanmedian(values, axis=0)
+        if len(missing_cols):
+            values = np.where(missing, median, values)
+
+        if z is None:
+            lower = np.full(len(columns), -np.inf)
+            upper = np.full(len(columns), np.inf)
+        else:
+            mean = values.mean(axis=0)
+            std = values.std(axis=0, ddof=1) if len(values) > 1 else np.zeros(len(columns))
+            lower, upper = mean - z * std, mean + z * std
+
+        preprocessor = cls(columns, median, lower, upper, z)
+        preprocessor.missing_counts = dict(zip(columns, missing.sum(axis=0).tolist()))   # Để in báo cáo
+        return preprocessor, preprocessor._apply(df, values, missing_cols)
+
+    def transform(self, df, drop_outliers=True):
+        """
+        Áp dụng median / khoảng đã fit lên dữ liệu mới
+
+        drop_outliers=True: bỏ dòng ngoài khoảng như lúc fit; False: kẹp giá trị vào
+        [lower, upper] như lúc serving (cột được kẹp thành float64).
+        """
+        values = df[self.columns].to_numpy(dtype=np.float64)
+        missing = np.isnan(values)
+        missing_cols = np.flatnonzero(missing.any(axis=0))
+        if len(missing_cols):
+            values = np.where(missing, self.median, values)
+        if drop_outliers:
+            return self._apply(df, values, missing_cols)
+        out = df.copy()
+        out[self.columns] = np.clip(values, self.lower, self.upper)
+        return out
+
+    def _apply(self, df, values, missing_cols):
+        keep = ((values >= self.lower) & (values <= self.upper)).all(axis=1) if self.z is not None else None
+        if keep is not None and not keep.all():
+            out = df.loc[keep]
+        elif len(missing_cols):
+            keep, out = None, df.copy()
+        else:
+            return df
+        for j in missing_cols:
+            col = self.columns[j]
+            column_values = values[:, j] if keep is None else values[keep, j]
+            out[col] = column_values.astype(df[col].dtype, copy=False)
+        return out
+
+    # ---------- serving ----------
+
+    def aligned(self, feature_order):
+        """(median, lower, upper) theo thứ tự feature của model; feature không có thống kê giữ nguyên"""
+        index = {name: i for i, name in enumerate(self.columns)}
+        fill = np.full(len(feature_order), np.nan)
+        lower = np.full(len(feature_order), -np.inf)
+        upper = np.full(len(feature_order), np.inf)
+        for k, name in enumerate(feature_order):
+            i = index.get(name)
+            if i is not None:
+                fill[k], lower[k], upper[k] = self.median[i], self.lower[i], self.upper[i]
+        return fill, lower, upper
+
+    # ---------- lưu trong artifact ----------
+
+    def arrays(self):
+        return dict(zip(PREPROCESSOR_ARRAYS, (self.median, self.lower, self.upper)))
+
+    def manifest(self):
+        return {'format_version': PREPROCESSOR_FORMAT_VERSION, 'columns': self.columns, 'z': self.z}
+
+    @classmethod
+    def from_artifact(cls, manifest, arrays):
+        if manifest.get('format_version') != PREPROCESSOR_FORMAT_VERSION:
+            raise ValueError(f"Unsupported preprocessor format: {manifest.get('format_version')}")
+        median, lower, upper = (np.asarray(arrays[name]) for name in PREPROCESSOR_ARRAYS)
+        return cls(manifest['columns'], median, lower, upper, manifest.get('z'))
+
+
+def apply_preprocessing(X, fill, lower, upper):
+    """Điền median cho NaN và kẹp X vào [lower, upper] (các mảng đã aligned theo cột của X)"""
+    X = np.asarray(X, dtype=np.float64)
+    missing = np.isnan(X)
+    if missing.any():
+        X = np.where(missing, fill, X)
+    return np.clip(X, lower, upper)
@@ -0,0 +1,174 @@
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# ==================== REQUEST PROFILING ====================
+#
+# Profile một request đang chạy trên server (không cần restart): cProfile
+# (deterministic) bao quanh handler, kết quả là top hàm theo cumulative time
+# trong response và/hoặc file .prof (mở bằng snakeviz, pstats, ...).
+
+PROFILE_OUTPUTS = ('response', 'file')
+
+
+def _safe_name(value):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(value))
+
+
+def top_functions(profile, limit):
+    """cProfile.Profile → top `limit` hàm theo cumulative time"""
+    stats = pstats.Stats(profile)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            'function': name,
+            'file': filename,
+            'line': line,
+            'calls': calls,
+            'primitive_calls': primitive_calls,
+            'tottime': tottime,
+            'cumtime': cumtime
+        }
+        for (filename, line, name), (primitive_calls, calls, tottime, cumtime, _) in rows
+    ]
+
+
+class RequestProfiler:
+    """
+    Chạy handler dưới cProfile theo yêu cầu
+
+    - request gửi profile=true|response|file: chỉ profile request đó
+    - arm(model_id, count): profile count request tiếp theo của model_id
+      (kết quả xem qua recent(), vì response thuộc về client khác)
+
+    Mỗi lần chỉ một request được profile (cProfile không chạy chồng nhau được),
+    request profile khác chờ lượt. Arm chỉ có hiệu lực trong process đã nhận nó
+    (ASGI --executor process: admin endpoint trả về 409).
+    """
+
+    def __init__(self, output_dir, top_n=25, default_output='response', keep_recent=50):
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self.default_output = default_output
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._local = threading.local()
+        self._armed = {}   # model_id → {'remaining', 'output', 'armed_at'}
+        self._recent = deque(maxlen=keep_recent)
+        self._count = 0
+
+    # ---------- arm (admin) ----------
+
+    def arm(self, model_id, count, output='file'):
+        with self._lock:
+            self._armed[model_id] = {
+                'remaining': int(count),
+                'output': output,
+                'armed_at': datetime.now().isoformat()
+            }
+            return dict(self._armed[model_id])
+
+    def disarm(self, model_id):
+        with self._lock:
+            return self._armed.pop(model_id, None) is not None
+
+    def armed(self):
+        with self._lock:
+            return {model_id: dict(state) for model_id, state in self._armed.items()}
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    # ---------- chọn request ----------
+
+    def active(self):
+        """True nếu thread hiện tại đang chạy một request được profile"""
+        return getattr(self._local, 'active', False)
+
+    def choose(self, model_id, flag):
+        """
+        (output, armed) nếu request này cần profile, ngược lại None
+
+        flag: giá trị profile của request (true | response | file). Nếu request không
+        bật, lấy một lượt từ arm của model_id.
+        """
+        if self.active():
+            return None   # Đang ở trong một request được profile
+        value = str(flag).lower() if flag is not None else ''
+        if value in PROFILE_OUTPUTS:
+            return value, False
+        if value in ('1', 'true', 'yes'):
+            return self.default_output, False
+        with self._lock:
+            state = self._armed.get(model_id)
+            if state is None:
+                return None
+            state['remaining'] -= 1
+            if state['remaining'] <= 0:
+                del self._armed[model_id]
+            return state['output'], True
+
+    # ---------- chạy ----------
+
+    def run(self, choice, model_id, endpoint, handler, *args):
+        """
+        Chạy handler(*args) → (payload, status) dưới cProfile
+
+        choice = choose(...). 'response': thêm payload['profile'] (top hàm); 'file': ghi
+        .prof, đường dẫn nằm trong payload['profile'] (response nhị phân: header
+        X-Profile-File). Request do arm chọn được lưu vào recent() thay vì response.
+        """
+        output, armed = choice
+        profile = cProfile.Profile()
+
+        with self._run_lock:
+            self._local.active = True
+            started = time.perf_counter()
+            try:
+                profile.enable()
+                try:
+                    payload, status = handler(*args)
+                finally:
+                    profile.disable()
+            finally:
+                self._local.active = False
+            elapsed = time.perf_counter() - started
+
+        report = {
+            'model_id': model_id,
+            'endpoint': endpoint,
+            'status': status,
+            'profiler': 'cProfile',
+            'wall_seconds': elapsed,
+            'profiled_at': datetime.now().isoformat()
+        }
+        if output == 'file' or not (armed or isinstance(payload, dict)):
+            report['file'] = self._dump(profile, model_id, endpoint)
+        if output == 'response' or armed:
+            report['top_functions'] = top_functions(profile, self.top_n)
+
+        if armed:
+            with self._lock:
+                self._recent.append(report)
+        elif isinstance(payload, dict):
+            payload = dict(payload, profile=report)
+        else:
+            payload.headers['X-Profile-File'] = report['file']
+        return payload, status
+
+    def _dump(self, profile, model_id, endpoint):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with self._lock:
+            self._count += 1
+            count = self._count
+        endpoint_name = _safe_name(endpoint.strip('/').replace('/', '-'))
+        filename = f"{_safe_name(model_id)}_{endpoint_name}_{datetime.now().strftime('%Y%m%d-%H%M%S')}_{count}.prof"
+        path = os.path.join(self.output_dir, filename)
+        profile.dump_stats(path)
+        return path
@@ -0,0 +1,77 @@
+import numpy as np
+
+from preprocessor import apply_preprocessing
+
+# ==================== SERVING PLAN ====================
+
+
+class ServingPlan:
+    """
+    Những gì không đổi với một model, tính sẵn một lần khi load
+
+    - feature_order / feature_index: thứ tự cột của X
+    - classes: nhãn encoded theo thứ tự cột của predict_proba
+    - class_names: nhãn đã decode, prob_keys: key của all_probabilities
+    - category / color / level: bảng thông tin hiển thị cho từng class
+    - preprocess: median / khoảng kẹp của preprocessor lúc train, aligned theo feature_order
+    - cache_steps: bước lượng tử từng feature cho prediction cache (app gán khi cache bật)
+    """
+
+    def __init__(self, model_data, default_feature_order, category_info):
+        model = model_data['model']
+        label_encoder = model_data['label_encoder']
+
+        self.feature_order = list(model_data['feature_names'] or default_feature_order)
+        self.feature_index = {name: i for i, name in enumerate(self.feature_order)}
+        self.model_type = getattr(model, 'model_type', type(model).__name__)
+        self.has_tree = hasattr(model, 'tree_')
+        self.cache_steps = {}
+
+        compiled = model_data.get('compiled')
+        classes = compiled.classes if compiled is not None else getattr(model, 'classes_', None)
+        self.classes = np.asarray(classes) if classes is not None else None
+        self.has_proba = compiled is not None or hasattr(model, 'predict_proba')
+
+        n_classes = len(self.classes) if self.classes is not None else 0
+        self.class_names = self._decode(label_encoder, self.classes)
+        # Key của all_probabilities giữ như trước: nhãn của cột thứ i
+        self.prob_keys = [str(name) for name in self._decode(label_encoder, np.arange(n_classes))] \
+            if label_encoder else [str(i) for i in range(n_classes)]
+
+        preprocessor = model_data.get('preprocessor')
+        self.has_preprocessor = preprocessor is not None
+        if self.has_preprocessor:
+            self.fill, self.lower, self.upper = preprocessor.aligned(self.feature_order)
+
+        infos = [category_info(name) for name in self.class_names]
+        self.color = np.array([info['color'] for info in infos], dtype=object)
+        self.level = np.array([info['level'] for info in infos], dtype=np.int64)
+        self.category_info = [
+            {'category': name, 'color': info['color'], 'level': info['level']}
+            for name, info in zip(self.class_names, infos)
+        ]
+
+    @staticmethod
+    def _decode(label_encoder, encoded):
+        if encoded is None:
+            return []
+        if label_encoder:
+            try:
+                return list(label_encoder.inverse_transform(encoded))
+            except Exception:
+                pass
+        return [str(value) for value in encoded]
+
+    def row(self, features):
+        """Dict feature của một request → X (1 dòng), feature thiếu = 0"""
+        return np.array([[features.get(f, 0) for f in self.feature_order]])
+
+    def preprocess(self, X):
+        """Điền median (NaN / null) và kẹp giá trị như lúc train; model không có preprocessor → X"""
+        if not self.has_preprocessor:
+            return X
+        return apply_preprocessing(X, self.fill, self.lower, self.upper)
+
+    def class_index(self, encoded):
+        """Nhãn encoded (kết quả model.predict) → vị trí trong classes"""
+        return np.searchsorted(self.classes, encoded)
@@ -0,0 +1,195 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+# ==============================
+# CACHE KẾT QUẢ CÁC STAGE TIỀN XỬ LÝ (PIPELINE TRAIN)
+# ==============================
+# Output (DataFrame) của mỗi stage được lưu thành <stage>-<key>.pkl. Key là hash của:
+#   key của input (stage trước, hoặc hash dataset + cấu hình load cho stage đầu)
+#   + tham số của stage + "phiên bản code" (hash source của hàm và các phụ thuộc)
+# → đổi dữ liệu, tham số hay code của một stage thì stage đó và các stage sau chạy lại.
+# Dung lượng giới hạn bởi STAGE_CACHE_MAX_BYTES, xóa file dùng lâu nhất trước (LRU
+# theo mtime, được cập nhật mỗi lần hit).
+
+STAGE_CACHE_DIR = os.environ.get('STAGE_CACHE_DIR', os.path.join('datasets', '.cache', 'stages'))
+STAGE_CACHE_MAX_BYTES = int(os.environ.get('STAGE_CACHE_MAX_BYTES', 2 * 1024**3))
+STAGE_CACHE_EXTENSION = '.pkl'
+
+# params: kwargs truyền vào func(df, **params); deps: hàm / module / giá trị mà kết quả
+# phụ thuộc (source hoặc repr được đưa vào key)
+CachedStage = namedtuple('CachedStage', ['name', 'func', 'params', 'deps'], defaults=({}, ()))
+
+
+def code_version(*objects):
+    """Hash source của hàm / class / module (giá trị thường: repr)"""
+    digest = hashlib.sha256()
+    for obj in objects:
+        if inspect.ismodule(obj) or inspect.isfunction(obj) or inspect.isclass(obj) or inspect.ismethod(obj):
+            try:
+                text = inspect.getsource(obj)
+            except (OSError, TypeError):
+                text = f'{obj.__module__}.{obj.__qualname__}' if hasattr(obj, '__qualname__') else repr(obj)
+        else:
+            text = repr(obj)
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def stage_key(name, input_key, params, version):
+    payload = json.dumps({
+        'stage': name,
+        'input': input_key,
+        'params': params,
+        'code': version,
+        'pandas': pd.__version__,   # pickle DataFrame không chắc đọc được giữa các bản pandas
+    }, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class StageCache:
+    """
+    Chạy chuỗi stage DataFrame → DataFrame, bỏ qua các stage có output trong cache
+
+    enabled=False: chạy toàn bộ, không đọc / ghi cache (summary vẫn ghi thời gian).
+    """
+
+    def __init__(self, cache_dir=STAGE_CACHE_DIR, max_bytes=STAGE_CACHE_MAX_BYTES, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.events = []   # {'stage', 'status': hit | skipped | miss | off, 'seconds', 'bytes'}
+
+    def root_key(self, dataset_hash, params=None, deps=()):
+        """Key của dữ liệu đầu vào (hash dataset + cấu hình / code của bước load)"""
+        return stage_key('load', dataset_hash, params or {}, code_version(*deps))
+
+    def _path(self, name, key):
+        return os.path.join(self.cache_dir, f'{name}-{key[:24]}{STAGE_CACHE_EXTENSION}')
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                df = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            try:
+                os.remove(path)   # File hỏng / không đọc được → coi như miss
+            except OSError:
+                pass
+            return None
+        os.utime(path)   # Đánh dấu vừa dùng (LRU)
+        return df
+
+    def _save(self, path, df):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def run(self, input_key, load_input, stages, timer=None):
+        """
+        Chạy stages trên load_input() → DataFrame của stage cuối
+
+        Tìm stage muộn nhất đã có trong cache: load output của nó (không gọi
+        load_input() và các stage trước), rồi chỉ chạy các stage sau nó.
+        timer: StageTimer (stage đọc từ cache được đo dưới tên của stage đó).
+        """
+        keys = []
+        key = input_key
+        for stage in stages:
+            key = stage_key(stage.name, key, stage.params, code_version(stage.func, *stage.deps)) \
+                if self.enabled else None
+            keys.append(key)
+
+        df, start = None, 0
+        if self.enabled:
+            for i in range(len(stages) - 1, -1, -1):
+                path = self._path(stages[i].name, keys[i])
+                if not os.path.exists(path):
+                    continue
+                started = time.perf_counter()
+                with _timed(timer, stages[i].name):
+                    df = self._load(path)
+                if df is None:
+                    continue
+                for stage in stages[:i]:
+                    self.events.append({'stage': stage.name, 'status': 'skipped', 'seconds': 0.0, 'bytes': None})
+                self.events.append({'stage': stages[i].name, 'status': 'hit',
+                                    'seconds': time.perf_counter() - started, 'bytes': os.path.getsize(path)})
+                print(f"\n⚡ Stage cache: dùng lại output của {stages[i].name} ({path})")
+                start = i + 1
+                break
+
+        if start == 0:
+            df = load_input()
+        for stage, key in zip(stages[start:], keys[start:]):
+            started = time.perf_counter()
+            with _timed(timer, stage.name):
+                df = stage.func(df, **stage.params)
+            event = {'stage': stage.name, 'status': 'miss' if self.enabled else 'off',
+                     'seconds': time.perf_counter() - started, 'bytes': None}
+            if self.enabled:
+                event['bytes'] = self._save(self._path(stage.name, key), df)
+            self.events.append(event)
+
+        if self.enabled:
+            self.evict()
+        return df
+
+    def evict(self):
+        """Xóa file ít dùng gần đây nhất cho tới khi tổng dung lượng <= max_bytes"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(STAGE_CACHE_EXTENSION):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed.append(path)
+        return removed
+
+    def summary(self):
+        """Bảng hit / miss từng stage (in cuối main)"""
+        lines = []
+        for event in self.events:
+            size = f"  {event['bytes'] / 1024**2:8.1f} MB" if event['bytes'] else ''
+            lines.append(f"   {event['stage']:<25s}: {event['status'].upper():<7s} {event['seconds']:8.3f}s{size}")
+        hits = sum(event['status'] in ('hit', 'skipped') for event in self.events)
+        lines.append(f"   → {hits}/{len(self.events)} stage không phải tính lại")
+        return '\n'.join(lines)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _timed(timer, name):
+    return timer.stage(name) if timer is not None else _NullStage()
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# ==============================
+# ĐO THỜI GIAN & BỘ NHỚ TỪNG STAGE (PIPELINE TRAIN)
+# ==============================
+
+RSS_SAMPLE_INTERVAL = 0.005  # Giây giữa 2 lần đọc RSS khi đo peak
+
+
+def current_rss():
+    """RSS hiện tại của process (bytes), None nếu không đọc được (không phải Linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _RSSSampler:
+    """Thread nền đọc RSS định kỳ, giữ giá trị lớn nhất"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.peak = current_rss() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss() or 0)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss() or 0)
+        return self.peak
+
+
+class StageTimer:
+    """
+    Ghi lại wall time (và peak memory) của từng stage
+
+    memory: None (chỉ đo thời gian, gần như không tốn gì), 'rss' (peak RSS của
+    process trong stage, lấy mẫu bằng thread nền) hoặc 'tracemalloc' (peak bộ nhớ
+    cấp phát bởi Python/NumPy trong stage, chính xác hơn nhưng chậm hơn).
+    Stage chạy nhiều lần (vd. fit cho từng model) được cộng dồn thời gian.
+    Stage không lồng nhau.
+    """
+
+    def __init__(self, memory=None):
+        if memory not in (None, 'rss', 'tracemalloc'):
+            raise ValueError(f"Unknown memory mode: {memory}")
+        self.memory = memory
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        sampler = _RSSSampler(RSS_SAMPLE_INTERVAL) if self.memory == 'rss' else None
+        if self.memory == 'tracemalloc':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        rss_before = current_rss()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            entry['seconds'] += elapsed
+            entry['calls'] += 1
+            rss_after = current_rss()
+            if rss_after is not None and rss_before is not None:
+                entry['rss_after_bytes'] = rss_after
+                entry['rss_delta_bytes'] = entry.get('rss_delta_bytes', 0) + rss_after - rss_before
+            if sampler is not None:
+                entry['peak_rss_bytes'] = max(entry.get('peak_rss_bytes', 0), sampler.stop())
+            if self.memory == 'tracemalloc':
+                peak = tracemalloc.get_traced_memory()[1] - traced_before
+                entry['peak_alloc_bytes'] = max(entry.get('peak_alloc_bytes', 0), peak)
+
+    def report(self):
+        """{stage: {seconds, calls, ...memory}} theo thứ tự chạy"""
+        return {name: dict(entry) for name, entry in self.stages.items()}
+
+    def summary(self):
+        """Bảng thời gian từng stage (in cuối pipeline)"""
+        total = sum(entry['seconds'] for entry in self.stages.values()) or 1.0
+        lines = []
+        for name, entry in self.stages.items():
+            line = f"   {name:<25s}: {entry['seconds']:9.3f}s ({entry['seconds'] / total * 100:5.1f}%)"
+            if 'peak_rss_bytes' in entry:
+                line += f"  peak RSS {entry['peak_rss_bytes'] / 1024**2:8.1f} MB"
+            if 'peak_alloc_bytes' in entry:
+                line += f"  peak alloc {entry['peak_alloc_bytes'] / 1024**2:8.1f} MB"
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+import numpy as np
+
+# ==================== STREAMING BATCH (NDJSON / CSV) ====================
+#
+# Body được đọc từng dòng và gom thành chunk cố định: bộ nhớ chỉ phụ thuộc
+# chunk_size, không phụ thuộc độ dài input.
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/json-lines')
+CSV_MIMETYPES = ('text/csv', 'application/csv')
+CSV_RESULT_FIELDS = ['index', 'category', 'confidence', 'color', 'level']
+
+
+def stream_format(mimetype, default='ndjson'):
+    """'ndjson' hoặc 'csv' theo Content-Type / Accept"""
+    if mimetype in CSV_MIMETYPES:
+        return 'csv'
+    if mimetype in NDJSON_MIMETYPES:
+        return 'ndjson'
+    return default
+
+
+def iter_text_lines(stream, encoding='utf-8'):
+    """Đọc stream bytes theo từng dòng (bỏ dòng trống)"""
+    for raw in stream:
+        line = raw.decode(encoding).strip()
+        if line:
+            yield line
+
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ndjson_chunks(lines, feature_order, chunk_size):
+    """Mỗi dòng là một object feature → lần lượt các ma trận X (chunk_size dòng)"""
+    for chunk in _chunks(lines, chunk_size):
+        samples = []
+        for line in chunk:
+            sample = json.loads(line)
+            if not isinstance(sample, dict):
+                raise ValueError(f"Expected a JSON object per line, got: {line[:80]}")
+            samples.append(sample)
+        yield np.array([[sample.get(f, 0) for f in feature_order] for sample in samples], dtype=np.float64)
+
+
+def csv_chunks(lines, feature_order, chunk_size):
+    """Dòng đầu là header tên cột → lần lượt các ma trận X theo feature_order (cột thiếu/ô trống = 0)"""
+    reader = csv.reader(lines)
+    header = [name.strip() for name in next(reader, [])]
+    positions = [header.index(f) if f in header else None for f in feature_order]
+    for chunk in _chunks(reader, chunk_size):
+        yield np.array([
+            [float(row[p]) if p is not None and p < len(row) and row[p].strip() else 0.0 for p in positions]
+            for row in chunk
+        ], dtype=np.float64)
+
+
+def format_ndjson(results):
+    return ''.join(json.dumps(result, ensure_ascii=False) + '\n' for result in results)
+
+
+def format_csv(results, header=False):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_RESULT_FIELDS, extrasaction='ignore', lineterminator='\n')
+    if header:
+        writer.writeheader()
+    writer.writerows(results)
+    return buffer.getvalue()
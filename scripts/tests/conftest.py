@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các module trong scripts/ được import trực tiếp (giống khi chạy python scripts/<file>.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
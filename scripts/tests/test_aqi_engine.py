@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import train_model as v1
+from aqi_engine import AQI_CATEGORY_THRESHOLDS, EPA_BREAKPOINTS, EPA_LABELS, V2_BREAKPOINTS, V2_LABELS, AQIEngine
+from train_model_v2 import AQICalculator
+
+# ==============================
+# AQIEngine KHỚP VỚI HÀM SCALAR CŨ
+# ==============================
+
+V1_SCALAR = {
+    'PM2.5': v1.calc_aqi_pm25,
+    'PM10': v1.calc_aqi_pm10,
+    'O3': v1.calc_aqi_o3,
+    'CO': v1.calc_aqi_co,
+    'NO2': v1.calc_aqi_no2,
+    'SO2': v1.calc_aqi_so2,
+}
+
+V2_SCALAR = {
+    'PM2.5': AQICalculator().calc_pm25,
+    'PM10': AQICalculator().calc_pm10,
+    'CO': AQICalculator().calc_co,
+}
+
+
+def sample_concentrations(breakpoints):
+    """Mọi biên breakpoint (và ±0.05 quanh đó, rơi vào khoảng hở), giá trị âm, vượt đoạn cuối"""
+    edges = np.asarray(breakpoints, dtype=np.float64)[:, :2].ravel()
+    top = edges.max()
+    rng = np.random.default_rng(0)
+    return np.concatenate([
+        edges, edges + 0.05, edges - 0.05, np.nextafter(edges, np.inf), np.nextafter(edges, -np.inf),
+        [0.0, -0.0, -0.01, -1.0, -500.0],
+        [top + 0.01, top + 1.0, top * 10],
+        rng.uniform(-10, top * 1.2, 2000),
+    ])
+
+
+@pytest.mark.parametrize('pollutant', sorted(V1_SCALAR))
+def test_v1_matches_scalar(pollutant):
+    conc = sample_concentrations(EPA_BREAKPOINTS[pollutant])
+    if pollutant == 'CO':
+        conc = np.concatenate([conc, conc * 1150])   # µg/m³ (> 100) được đổi sang ppm
+    expected = np.array([V1_SCALAR[pollutant](c) for c in conc])
+    np.testing.assert_array_equal(AQIEngine().sub_index(pollutant, conc), expected)
+
+
+@pytest.mark.parametrize('pollutant', sorted(V2_SCALAR))
+def test_v2_matches_scalar(pollutant):
+    conc = sample_concentrations(V2_BREAKPOINTS[pollutant])
+    if pollutant == 'CO':
+        conc = np.concatenate([conc, conc * 1150])
+    expected = np.array([V2_SCALAR[pollutant](c) for c in conc])
+    engine = AQIEngine(V2_BREAKPOINTS, negative_as_zero=True)
+    np.testing.assert_array_equal(engine.sub_index(pollutant, conc), expected)
+
+
+def test_v2_labels_match_scalar():
+    aqi = np.concatenate([AQI_CATEGORY_THRESHOLDS, np.nextafter(AQI_CATEGORY_THRESHOLDS, np.inf),
+                          [-5.0, 0.0, 500.0, 1e6]])
+    expected = [AQICalculator().get_label(a) for a in aqi]
+    assert list(AQIEngine().labels(aqi, V2_LABELS)) == expected
+
+
+# ==============================
+# NaN: HÀNH VI MỚI (CỐ Ý KHÁC HÀM SCALAR)
+# ==============================
+
+@pytest.mark.parametrize('pollutant', sorted(V1_SCALAR))
+def test_v1_nan_is_missing_not_top_band(pollutant):
+    # Hàm scalar cũ: NaN không rơi vào đoạn nào → I_high của đoạn cuối (row thành 'Nguy hại')
+    assert V1_SCALAR[pollutant](np.nan) == EPA_BREAKPOINTS[pollutant][-1][3]
+    assert np.isnan(AQIEngine().sub_index(pollutant, [np.nan])).all()
+
+
+@pytest.mark.parametrize('pollutant', sorted(V2_SCALAR))
+def test_v2_nan_is_missing_not_zero(pollutant):
+    # AQICalculator cũ: NaN → 0
+    assert V2_SCALAR[pollutant](np.nan) == 0
+    engine = AQIEngine(V2_BREAKPOINTS, negative_as_zero=True)
+    assert np.isnan(engine.sub_index(pollutant, [np.nan])).all()
+
+
+def test_v1_labels_skip_nan_and_drop_all_nan_rows():
+    df = pd.DataFrame({
+        'PM2.5': [np.nan, np.nan, 10.0],
+        'PM10': [np.nan, 200.0, np.nan],
+        'O3': [np.nan, np.nan, np.nan],
+        'CO': [np.nan, np.nan, np.nan],
+        'NO2': [np.nan, np.nan, np.nan],
+        'SO2': [np.nan, np.nan, np.nan],
+    })
+    labeled = v1.create_pollution_labels(df)
+    # Cả dòng NaN → không có AQI / nhãn (bị bỏ khi dropna), không còn là 'Nguy hại'
+    assert np.isnan(labeled['AQI'].iloc[0]) and pd.isna(labeled['Pollution_Level'].iloc[0])
+    # NaN được bỏ qua khi lấy max các AQI thành phần
+    assert labeled['AQI'].iloc[1] == v1.calc_aqi_pm10(200.0)
+    assert labeled['AQI'].iloc[2] == v1.calc_aqi_pm25(10.0)
+    assert list(labeled['Pollution_Level'].iloc[1:]) == [EPA_LABELS[2], EPA_LABELS[0]]
+    assert labeled.dropna(subset=['Pollution_Level']).index.tolist() == [1, 2]
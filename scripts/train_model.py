@@ -1,24 +1,61 @@
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score
-# from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, f1_score
 from sklearn.preprocessing import LabelEncoder
-from imblearn.over_sampling import SMOTE
+from imblearn.pipeline import Pipeline as ImbPipeline
 import pickle
+import time
 import matplotlib.pyplot as plt
 # import seaborn as sns
 from datetime import datetime
+from aqi_engine import AQIEngine, EPA_LABELS
+from model_artifact import save_artifact, artifact_path_for, is_artifact
+from model_orchestrator import TRAIN_CORE_BUDGET, train_models
+from incremental import (RETRAIN_HOLDOUT_FRACTION, RETRAIN_NEW_TREES, archive_version,
+                         csv_watermark, holdout_f1, line_boundary, print_update_summary,
+                         read_new_rows, replay_sample, rolling_holdout, supports_warm_start,
+                         time_column, warm_start_update, with_replay)
+from imbalance import (IMBALANCE_STRATEGIES, apply_class_weight, compare_strategies,
+                       print_strategy_report, resample, sampler_for)
+from hyperparam_search import TREE_PARAM_GRID, halving_search, print_search_summary, save_search
+from preprocessor import FittedPreprocessor
+import aqi_engine
+import ingest
+from dataset_cache import load_dataset, source_digest
+from stage_cache import CachedStage, StageCache
+from stage_timer import StageTimer
 import warnings
 warnings.filterwarnings('ignore')
 
 # ==============================
 # 1. LOAD DỮ LIỆU
 # ==============================
-def load_data(file_path):
-    """Load và hiển thị thông tin cơ bản về dataset"""
-    df = pd.read_csv(file_path)
+# Cột gốc pipeline dùng (các cột khác trong CSV không được load)
+DATA_COLUMNS = ['PM2.5', 'PM10', 'TSP', 'O3', 'CO', 'NO2', 'SO2',
+                'Temperature', 'Humidity', 'DateTime', 'Date']
+
+def load_data(file_path, as_chunks=False, stats=None, columns=None, cache=True, rebuild_cache=False):
+    """
+    Load và hiển thị thông tin cơ bản về dataset
+
+    Đọc theo chunk với schema gọn (float32 / datetime / category), thống kê cộng dồn
+    theo chunk. as_chunks=True: trả về iterator các chunk (stats: RunningStats được
+    cập nhật khi duyệt) thay vì ghép thành một DataFrame.
+    columns: chỉ load các cột này. cache=True: đọc qua cache dạng cột (dataset_cache),
+    CSV chỉ được parse lại khi nội dung đổi hoặc rebuild_cache=True.
+    """
+    if as_chunks:
+        return ingest.iter_csv(file_path, usecols=columns, stats=stats)
+
+    cache_info = None
+    if cache:
+        df, summary, cache_info = load_dataset(file_path, columns, rebuild=rebuild_cache)
+    else:
+        df, stats = ingest.load_csv(file_path, usecols=columns)
+        summary = stats.describe()
     print("="*70)
     print("📂 LOAD DỮ LIỆU")
     print("="*70)
@@ -26,7 +63,15 @@ def load_data(file_path):
     print(f"✓ Số cột: {len(df.columns)}")
     print(f"✓ Các cột: {df.columns.tolist()}")
     print(f"\n📊 Thống kê cơ bản:")
-    print(df.describe())
+    print(summary)
+    if cache_info:
+        speedup = cache_info['csv_seconds'] / max(cache_info['cache_seconds'], 1e-9)
+        status = "vừa build từ CSV" if cache_info['built'] else "dùng lại"
+        print(f"\n⚡ Cache {cache_info['cache_path']} ({status}): parse CSV {cache_info['csv_seconds']:.2f}s, "
+              f"load cache {cache_info['cache_seconds']:.3f}s (nhanh hơn {speedup:,.0f}x)")
+    memory = ingest.memory_comparison(file_path, df)
+    print(f"\n💾 Bộ nhớ: {memory['compact_bytes'] / 1024**2:.1f} MB "
+          f"(pd.read_csv mặc định ≈ {memory['default_bytes'] / 1024**2:.1f} MB, giảm {memory['reduction']:.0%})")
     return df
 
 
@@ -175,6 +220,19 @@ def calc_aqi_so2(conc):
     return linear_interpolation(conc, breakpoints)
 
 
+AQI_ENGINE = AQIEngine()
+
+# Cột AQI thành phần: (pollutant, cột nguồn)
+AQI_COLUMNS = {
+    'AQI_PM25': ('PM2.5', 'PM2.5'),
+    'AQI_PM10': ('PM10', 'PM10'),
+    'AQI_O3': ('O3', 'O3'),
+    'AQI_CO': ('CO', 'CO'),
+    'AQI_NO2': ('NO2', 'NO2'),
+    'AQI_SO2': ('SO2', 'SO2'),
+}
+
+
 # ==============================
 # 3. GÁN NHÃN POLLUTION LEVEL
 # ==============================
@@ -238,34 +296,16 @@ def create_pollution_labels(df):
         df['PM10'] = df['TSP'] / 1.5
         print("✓ Đã ước lượng PM10 từ TSP (PM10 = TSP / 1.5)")
     
-    # Tính AQI cho từng chất ô nhiễm
-    df['AQI_PM25'] = df['PM2.5'].apply(calc_aqi_pm25)
-    df['AQI_PM10'] = df['PM10'].apply(calc_aqi_pm10)
-    df['AQI_O3'] = df['O3'].apply(calc_aqi_o3)
-    df['AQI_CO'] = df['CO'].apply(calc_aqi_co)
-    df['AQI_NO2'] = df['NO2'].apply(calc_aqi_no2)
-    df['AQI_SO2'] = df['SO2'].apply(calc_aqi_so2)
+    # Tính AQI cho từng chất ô nhiễm (vectorized trên cả cột)
+    sub_aqi = AQI_ENGINE.sub_indices(df, AQI_COLUMNS)
+    for col in sub_aqi.columns:
+        df[col] = sub_aqi[col]
     
     # AQI tổng hợp = max của tất cả AQI (theo chuẩn EPA)
-    aqi_cols = ['AQI_PM25', 'AQI_PM10', 'AQI_O3', 'AQI_CO', 'AQI_NO2', 'AQI_SO2']
-    df['AQI'] = df[aqi_cols].max(axis=1)
+    df['AQI'] = AQI_ENGINE.max_aqi(sub_aqi)
     
     # Gán nhãn theo thang AQI chuẩn
-    def aqi_to_label(aqi):
-        if aqi <= 50:
-            return 'Tốt'
-        elif aqi <= 100:
-            return 'Trung bình'
-        elif aqi <= 150:
-            return 'Không tốt cho người nhạy cảm'
-        elif aqi <= 200:
-            return 'Không tốt cho sức khỏe'
-        elif aqi <= 300:
-            return 'Rất xấu'
-        else:
-            return 'Nguy hại'
-    
-    df['Pollution_Level'] = df['AQI'].apply(aqi_to_label)
+    df['Pollution_Level'] = AQI_ENGINE.labels(df['AQI'], EPA_LABELS)
     
     # Thống kê phân bố
     print("\n✓ Hoàn tất tính AQI!")
@@ -341,7 +381,13 @@ def create_features(df):
 # 5. TIỀN XỬ LÝ DỮ LIỆU
 # ==============================
 def preprocess_data(df):
-    """Xử lý missing values và outliers"""
+    """
+    Xử lý missing values và outliers
+    
+    Thống kê của mọi cột tính trong một lần, outlier lọc bằng một mask chung
+    (FittedPreprocessor). Preprocessor đã fit nằm trong df.attrs['preprocessor']
+    để lưu cùng model cho serving.
+    """
     print("\n" + "="*70)
     print("🔍 TIỀN XỬ LÝ DỮ LIỆU")
     print("="*70)
@@ -353,24 +399,19 @@ def preprocess_data(df):
     exclude_cols = ['AQI', 'AQI_PM25', 'AQI_PM10', 'AQI_O3', 'AQI_CO', 'AQI_NO2', 'AQI_SO2']
     numeric_cols = [col for col in numeric_cols if col not in exclude_cols]
     
+    # Điền median + loại bỏ outliers cực đoan (> 3 std)
+    before = len(df)
+    preprocessor, df = FittedPreprocessor.fit_transform(df, numeric_cols, z=3.0)
+    
     print(f"\n📋 Kiểm tra missing values:")
-    missing = df[numeric_cols].isnull().sum()
-    if missing.any():
-        print(missing[missing > 0])
+    missing = {col: count for col, count in preprocessor.missing_counts.items() if count > 0}
+    if missing:
+        print(pd.Series(missing))
         print("   → Điền bằng median")
-        for col in numeric_cols:
-            df[col] = df[col].fillna(df[col].median())
     else:
         print("   ✓ Không có giá trị thiếu")
     
-    # Loại bỏ outliers cực đoan (> 3 std)
     print(f"\n📋 Loại bỏ outliers:")
-    before = len(df)
-    for col in numeric_cols:
-        mean = df[col].mean()
-        std = df[col].std()
-        df = df[(df[col] >= mean - 3*std) & (df[col] <= mean + 3*std)]
-    
     after = len(df)
     removed = before - after
     if removed > 0:
@@ -380,88 +421,139 @@ def preprocess_data(df):
     
     # Loại bỏ dòng còn NaN
     df = df.dropna()
+    df.attrs['preprocessor'] = preprocessor
     
     print(f"\n✓ Còn lại {len(df):,} dòng sau tiền xử lý")
     
     return df
 
 
+# Các stage tiền xử lý được cache theo dữ liệu + code (xem stage_cache.py)
+PREPROCESS_STAGES = [
+    CachedStage('create_pollution_labels', create_pollution_labels, deps=(aqi_engine, AQI_COLUMNS, EPA_LABELS)),
+    CachedStage('create_features', create_features),
+    CachedStage('preprocess_data', preprocess_data, deps=(FittedPreprocessor,)),
+]
+
+
 # ==============================
 # 6. TRAIN MODELS
 # ==============================
-def train_multiple_models(X_train, X_test, y_train, y_test, label_encoder, use_smote=True):
+# Cấu hình Decision Tree khi không search (cũng là model tham chiếu khi so sánh strategy mất cân bằng)
+TREE_PARAMS = {'max_depth': 15, 'min_samples_split': 50, 'min_samples_leaf': 20}
+
+def search_tree_params(X_train, y_train, imbalance='smote'):
+    """
+    Tìm max_depth / min_samples_leaf / min_samples_split cho Decision Tree bằng
+    successive halving (resample chạy trong từng fold, không rò rỉ sang fold test)
+    """
+    tree = DecisionTreeClassifier(class_weight='balanced', random_state=42)
+    sampler = sampler_for(imbalance)
+    resampled = sampler != 'passthrough'
+    estimator = ImbPipeline([('sampler', sampler), ('model', tree)]) if resampled else tree
+    result = halving_search(estimator, TREE_PARAM_GRID, X_train, y_train, step='model' if resampled else None)
+    print_search_summary(result)
+    return result
+
+
+def train_multiple_models(X_train, X_test, y_train, y_test, label_encoder, use_smote=True, timer=None,
+                          search=False, on_result=None, imbalance=None, cache=None):
     """
     Train và so sánh nhiều models
+    
+    Các models (cùng cross-validation 5 fold) train đồng thời trong một process pool
+    (model_orchestrator, TRAIN_CORE_BUDGET core); bảng so sánh được in dần khi từng
+    model xong. on_result(results): gọi sau mỗi model xong (vd. vẽ lại plot_results).
+    imbalance: strategy xử lý mất cân bằng (imbalance.IMBALANCE_STRATEGIES); mặc định 'smote'
+    ('none' nếu use_smote=False). cache: StageCache lưu ma trận sau resample.
+    timer: StageTimer ghi thời gian các stage resample / search / fit (gồm cross-validation) / evaluation
+    search: tìm hyperparameter cho Decision Tree (successive halving) thay vì dùng cấu hình cố định;
+    kết quả (kèm leaderboard) nằm trong results['Decision Tree']['search']
     """
+    timer = timer or StageTimer()
     print("\n" + "="*70)
     print("🤖 TRAIN MULTIPLE MODELS")
     print("="*70)
     
-    # SMOTE để cân bằng classes
-    if use_smote:
-        print("\n⏳ Áp dụng SMOTE để cân bằng classes...")
-        smote = SMOTE(random_state=42)
-        X_train_res, y_train_res = smote.fit_resample(X_train, y_train)
-        print(f"   Trước SMOTE: {len(X_train):,} samples")
-        print(f"   Sau SMOTE: {len(X_train_res):,} samples")
-    else:
-        X_train_res, y_train_res = X_train, y_train
+    # Cân bằng classes (SMOTE, random over/under-sampling, class weight...)
+    strategy = imbalance or ('smote' if use_smote else 'none')
+    print(f"\n⏳ Xử lý mất cân bằng classes: {strategy}...")
+    with timer.stage('resample'):
+        X_train_res, y_train_res, resample_info = resample(X_train, y_train, strategy, cache)
+    print(f"   Trước: {len(X_train):,} samples")
+    print(f"   Sau:   {len(X_train_res):,} samples ({resample_info['seconds']:.2f}s, cache: {resample_info['status']})")
+    
+    # Hyperparameter của Decision Tree: cố định hoặc tìm bằng successive halving
+    tree_params = TREE_PARAMS
+    search_result = None
+    if search:
+        print("\n⏳ Tìm hyperparameter cho Decision Tree (successive halving)...")
+        with timer.stage('search'):
+            search_result = search_tree_params(X_train, y_train, strategy)
+        tree_params = search_result['best_params']
     
     # Define models
     models = {
         'Decision Tree': DecisionTreeClassifier(
+            **tree_params,
+            class_weight='balanced',
+            random_state=42
+        ),
+        'Random Forest': RandomForestClassifier(
+            n_estimators=100,
             max_depth=15,
             min_samples_split=50,
             min_samples_leaf=20,
             class_weight='balanced',
+            random_state=42,
+            n_jobs=-1
+        ),
+        'Gradient Boosting': GradientBoostingClassifier(
+            n_estimators=100,
+            max_depth=8,
+            learning_rate=0.1,
             random_state=42
         )
-        # 'Random Forest': RandomForestClassifier(
-        #     n_estimators=100,
-        #     max_depth=15,
-        #     min_samples_split=50,
-        #     min_samples_leaf=20,
-        #     class_weight='balanced',
-        #     random_state=42,
-        #     n_jobs=-1
-        # ),
-        # 'Gradient Boosting': GradientBoostingClassifier(
-        #     n_estimators=100,
-        #     max_depth=8,
-        #     learning_rate=0.1,
-        #     random_state=42
-        # )
     }
     
-    results = {}
+    # class_weight: model không có class_weight (Gradient Boosting) dùng sample_weight cân bằng
+    sample_weight = {}
+    if strategy == 'class_weight':
+        for name in models:
+            models[name], sample_weight[name] = apply_class_weight(models[name], y_train_res)
     
-    for name, model in models.items():
-        print(f"\n{'='*70}")
-        print(f"📊 Training: {name}")
-        print(f"{'='*70}")
-        
-        # Train
-        model.fit(X_train_res, y_train_res)
-        
-        # Predict
-        y_pred_train = model.predict(X_train)
-        y_pred_test = model.predict(X_test)
-        
-        # Metrics
-        train_acc = accuracy_score(y_train, y_pred_train)
-        test_acc = accuracy_score(y_test, y_pred_test)
-        f1_weighted = f1_score(y_test, y_pred_test, average='weighted')
-        f1_macro = f1_score(y_test, y_pred_test, average='macro')
+    print(f"\n⏳ Train {len(models)} models + CV 5 fold đồng thời (core budget: {TRAIN_CORE_BUDGET})...")
+    
+    # So sánh models (mỗi dòng in ra khi model đó train xong)
+    print(f"\n{'='*96}")
+    print("📊 SO SÁNH MODELS")
+    print(f"{'='*96}")
+    print(f"\n{'Model':<20} {'Train Acc':>10} {'Test Acc':>10} {'F1 (w)':>10} {'F1 (m)':>10} "
+          f"{'CV Acc':>17} {'Fit (s)':>8} {'CV (s)':>8}")
+    print("-" * 96)
+    
+    results = {}
+    stream = train_models(models, X_train_res, y_train_res, X_train, y_train, X_test, sample_weight=sample_weight)
+    while True:
+        with timer.stage('fit'):
+            name, trained = next(stream, (None, None))
+        if name is None:
+            break
         
-        # Cross-validation
-        cv_scores = cross_val_score(model, X_train, y_train, cv=5, scoring='accuracy')
+        with timer.stage('evaluation'):
+            # Metrics (prediction đã tính trong worker)
+            y_pred_test = trained['y_pred_test']
+            train_acc = accuracy_score(y_train, trained['y_pred_train'])
+            test_acc = accuracy_score(y_test, y_pred_test)
+            f1_weighted = f1_score(y_test, y_pred_test, average='weighted')
+            f1_macro = f1_score(y_test, y_pred_test, average='macro')
+            cv_scores = trained['cv_scores']
+            # F1 trên prediction out-of-fold: dùng lại kết quả các fold, không fit lại
+            cv_f1 = f1_score(y_train, trained['cv_pred'], average='weighted')
         
-        print(f"\n📊 Metrics:")
-        print(f"   Train Accuracy:     {train_acc:.4f} ({train_acc*100:.2f}%)")
-        print(f"   Test Accuracy:      {test_acc:.4f} ({test_acc*100:.2f}%)")
-        print(f"   F1 Score (weighted): {f1_weighted:.4f}")
-        print(f"   F1 Score (macro):    {f1_macro:.4f}")
-        print(f"   CV Accuracy:        {cv_scores.mean():.4f} ± {cv_scores.std():.4f}")
+        print(f"{name:<20} {train_acc:>10.4f} {test_acc:>10.4f} {f1_weighted:>10.4f} {f1_macro:>10.4f} "
+              f"{cv_scores.mean():>8.4f} ± {cv_scores.std():.4f} "
+              f"{trained['fit_seconds']:>8.1f} {trained['cv_seconds']:>8.1f}")
         
         # Overfitting check
         gap = train_acc - test_acc
@@ -473,26 +565,26 @@ def train_multiple_models(X_train, X_test, y_train, y_test, label_encoder, use_s
             print(f"   ✓ Model generalize tốt (gap = {gap*100:.1f}%)")
         
         results[name] = {
-            'model': model,
+            'model': trained['model'],
             'train_acc': train_acc,
             'test_acc': test_acc,
             'f1_weighted': f1_weighted,
             'f1_macro': f1_macro,
             'cv_mean': cv_scores.mean(),
             'cv_std': cv_scores.std(),
-            'y_pred_test': y_pred_test
+            'cv_f1_weighted': cv_f1,
+            'cv_pred': trained['cv_pred'],
+            'fit_seconds': trained['fit_seconds'],
+            'cv_seconds': trained['cv_seconds'],
+            'y_pred_test': y_pred_test,
+            'imbalance': resample_info
         }
+        if name == 'Decision Tree' and search_result is not None:
+            results[name]['search'] = search_result
+        if on_result is not None:
+            on_result(results)
     
-    # So sánh models
-    print(f"\n{'='*70}")
-    print("📊 SO SÁNH MODELS")
-    print(f"{'='*70}")
-    print(f"\n{'Model':<20} {'Train Acc':>10} {'Test Acc':>10} {'F1 (w)':>10} {'CV Acc':>15}")
-    print("-" * 70)
-    
-    for name, res in results.items():
-        print(f"{name:<20} {res['train_acc']:>10.4f} {res['test_acc']:>10.4f} "
-              f"{res['f1_weighted']:>10.4f} {res['cv_mean']:>10.4f} ± {res['cv_std']:.4f}")
+    print("-" * 96)
     
     # Chọn best model (dựa trên F1 weighted)
     best_name = max(results, key=lambda x: results[x]['f1_weighted'])
@@ -557,8 +649,15 @@ def detailed_evaluation(model, X_test, y_test, label_encoder, model_name):
 # ==============================
 # 8. LƯU MODEL
 # ==============================
-def save_model(model, feature_names, label_encoder, model_name, filename="air_quality_model.pkl"):
-    """Lưu model và metadata"""
+def save_model(model, feature_names, label_encoder, model_name, filename="air_quality_model.pkl",
+               preprocessor=None, search=None, imbalance=None, extra=None):
+    """
+    Lưu model và metadata (preprocessor: FittedPreprocessor để serving áp dụng lên request)
+    
+    imbalance: strategy xử lý mất cân bằng đã dùng khi train (ghi vào metadata)
+    extra: field bổ sung cho cập nhật tăng dần (model_version, watermark, replay, pending, updates)
+    search: kết quả hyperparameter search → leaderboard ghi ra <model>_search.json cạnh model
+    """
     print(f"\n{'='*70}")
     print("💾 LƯU MODEL")
     print(f"{'='*70}")
@@ -569,8 +668,12 @@ def save_model(model, feature_names, label_encoder, model_name, filename="air_qu
         'feature_names': feature_names,
         'label_encoder': label_encoder,
         'training_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'version': '2.0'
+        'version': '2.0',
+        'preprocessor': preprocessor,
+        'hyperparameters': search['best_params'] if search else None,
+        'imbalance': imbalance
     }
+    model_data.update(extra or {})
     
     with open(filename, 'wb') as f:
         pickle.dump(model_data, f)
@@ -580,6 +683,20 @@ def save_model(model, feature_names, label_encoder, model_name, filename="air_qu
     print(f"   - Features: {len(feature_names)}")
     print(f"   - Classes: {len(label_encoder.classes_)}")
     print(f"   - Training date: {model_data['training_date']}")
+    
+    # Artifact memory-mapped cho serving (app.py ưu tiên load nếu có)
+    artifact = save_artifact(
+        artifact_path_for(filename), model, feature_names, label_encoder,
+        metadata={'model_name': model_name, 'training_date': model_data['training_date'],
+                  'version': model_data['version'], 'model_version': model_data.get('model_version', 1),
+                  'watermark': (model_data.get('watermark') or {}).get('time')},
+        preprocessor=preprocessor
+    )
+    if artifact:
+        print(f"✓ Đã lưu artifact: {artifact}")
+    
+    if search:
+        print(f"✓ Đã lưu leaderboard: {save_search(filename, search, {'model_name': model_name})}")
 
 
 # ==============================
@@ -628,23 +745,38 @@ def plot_results(results, label_encoder, save_path="model_comparison.png"):
 # ==============================
 # 10. MAIN PIPELINE
 # ==============================
-def main(csv_file, use_smote=True):
-    """Main training pipeline"""
+def main(csv_file, use_smote=True, timer=None, cache=True, rebuild_cache=False, use_stage_cache=True,
+         search=False, imbalance=None, compare_imbalance=False):
+    """
+    Main training pipeline
+    
+    timer: StageTimer (benchmark_training.py truyền vào để đo thời gian / bộ nhớ từng stage)
+    cache / rebuild_cache: đọc dữ liệu qua cache dạng cột (xem load_data)
+    use_stage_cache: bỏ qua labels / features / preprocess nếu output đã có trong stage cache
+    search: tìm hyperparameter (successive halving, song song) trước khi train
+    imbalance: strategy xử lý mất cân bằng (mặc định SMOTE nếu use_smote); ma trận sau resample
+    nằm trong stage cache. compare_imbalance: in wall time + F1 của mọi strategy (Decision Tree)
+    """
+    timer = timer or StageTimer()
     print("\n" + "="*70)
     print("🚀 AIR QUALITY MODEL TRAINING PIPELINE v2.0")
     print("="*70)
     
-    # 1. Load data
-    df = load_data(csv_file)
-    
-    # 2. Create labels
-    df = create_pollution_labels(df)
+    # Vị trí cuối CSV trước khi đọc: lần cập nhật tăng dần sau đọc tiếp từ đây
+    csv_offset = line_boundary(csv_file)
     
-    # 3. Feature engineering
-    df = create_features(df)
+    # 1. Load data (chỉ khi stage cache không có sẵn kết quả tiền xử lý)
+    def load():
+        with timer.stage('load_data'):
+            return load_data(csv_file, columns=DATA_COLUMNS, cache=cache, rebuild_cache=rebuild_cache)
     
-    # 4. Preprocess
-    df = preprocess_data(df)
+    # 2-4. Create labels → feature engineering → preprocess
+    stage_cache = StageCache(enabled=use_stage_cache)
+    input_key = None
+    if use_stage_cache:
+        input_key = stage_cache.root_key(source_digest(csv_file), {'columns': DATA_COLUMNS}, (load_data, ingest))
+    df = stage_cache.run(input_key, load, PREPROCESS_STAGES, timer)
+    preprocessor = df.attrs.get('preprocessor')
     
     # 5. Select features
     # Base features
@@ -678,37 +810,178 @@ def main(csv_file, use_smote=True):
         print(f"   {i} → {label:25s} ({count:6,d} samples)")
     
     # 7. Train/test split
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y_encoded, test_size=0.2, stratify=y_encoded, random_state=42
-    )
+    with timer.stage('split'):
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y_encoded, test_size=0.2, stratify=y_encoded, random_state=42
+        )
     
     print(f"\n📊 Train/Test Split:")
     print(f"   Train: {len(X_train):,} samples ({len(X_train)/len(X)*100:.1f}%)")
     print(f"   Test:  {len(X_test):,} samples ({len(X_test)/len(X)*100:.1f}%)")
     
-    # 8. Train models
+    # So sánh các strategy xử lý mất cân bằng trên cùng một Decision Tree
+    if compare_imbalance:
+        with timer.stage('compare_imbalance'):
+            rows = compare_strategies(
+                DecisionTreeClassifier(**TREE_PARAMS, class_weight='balanced', random_state=42),
+                X_train, y_train, X_test, y_test, cache=stage_cache
+            )
+        print_strategy_report(rows, "⚖️  SO SÁNH STRATEGY MẤT CÂN BẰNG (Decision Tree)")
+    
+    # 8. Train models (biểu đồ so sánh được vẽ lại mỗi khi một model xong)
+    def plot_progress(results):
+        with timer.stage('plot_results'):
+            plot_results(results, le)
+    
     best_model, results, best_name = train_multiple_models(
-        X_train, X_test, y_train, y_test, le, use_smote=use_smote
+        X_train, X_test, y_train, y_test, le, use_smote=use_smote, timer=timer, search=search,
+        on_result=plot_progress, imbalance=imbalance, cache=stage_cache
     )
     
     # 9. Detailed evaluation
-    detailed_evaluation(best_model, X_test, y_test, le, best_name)
-    
-    # 10. Visualize
-    plot_results(results, le)
-    
-    # 11. Save model
-    save_model(best_model, feature_cols, le, best_name)
+    with timer.stage('evaluation'):
+        detailed_evaluation(best_model, X_test, y_test, le, best_name)
+    
+    # 10. Save model (kèm watermark + replay buffer cho update_model)
+    column = time_column(df)
+    incremental_state = {
+        'model_version': 1,
+        'watermark': csv_watermark(csv_file, df[column], csv_offset, len(df)) if column else None,
+        'replay': replay_sample(X_train, y_train),
+        'pending': None,
+        'updates': []
+    }
+    with timer.stage('save'):
+        save_model(best_model, feature_cols, le, best_name, preprocessor=preprocessor,
+                   search=results[best_name].get('search'),
+                   imbalance=results[best_name]['imbalance']['strategy'], extra=incremental_state)
     
     print("\n" + "="*70)
     print("✅ TRAINING HOÀN TẤT!")
     print("="*70)
+    print("\n⏱️  Thời gian từng stage:")
+    print(timer.summary())
+    print("\n📦 Stage cache:")
+    print(stage_cache.summary())
     
     return best_model, results, feature_cols, le
 
 
 # ==============================
-# 11. DEMO PREDICTION
+# 11. CẬP NHẬT TĂNG DẦN (DỮ LIỆU MỚI)
+# ==============================
+def update_model(csv_file, model_file="air_quality_model.pkl", timer=None, new_trees=RETRAIN_NEW_TREES,
+                 holdout_fraction=RETRAIN_HOLDOUT_FRACTION):
+    """
+    Cập nhật model đã lưu bằng các dòng mới hơn watermark (warm start, xem incremental.py)
+    
+    Random Forest: thêm new_trees cây fit trên dữ liệu mới, bỏ bấy nhiêu cây cũ nhất;
+    Gradient Boosting: thêm stage (không bỏ được → model lớn dần, predict chậm dần).
+    Model khác (Decision Tree) → thoát trước khi đọc CSV. Labels / features như lúc train,
+    preprocessor đã lưu được áp dụng (không fit lại). Bản cũ được giữ lại
+    (.versions/<model>.v<N>.pkl, tối đa MODEL_VERSIONS_KEEP bản).
+    Trả về thông tin lần cập nhật (None nếu không có dữ liệu mới).
+    """
+    timer = timer or StageTimer()
+    print("\n" + "="*70)
+    print("🔁 CẬP NHẬT MODEL VỚI DỮ LIỆU MỚI")
+    print("="*70)
+    
+    with open(model_file, 'rb') as f:
+        data = pickle.load(f)
+    watermark = data.get('watermark')
+    if not watermark:
+        raise ValueError(f"{model_file} không có watermark → cần train đầy đủ một lần (train_model.py)")
+    if not supports_warm_start(data['model']):
+        # Kiểm tra trước khi đọc CSV (vd. --search chọn Decision Tree)
+        raise SystemExit(f"\n❌ Model {data.get('model_name', type(data['model']).__name__)} không cập nhật "
+                         f"tăng dần được (chỉ Random Forest / Gradient Boosting) → train lại đầy đủ")
+    
+    started = time.perf_counter()
+    with timer.stage('load_data'):
+        new_df, offset = read_new_rows(csv_file, watermark, usecols=DATA_COLUMNS)
+    print(f"\n📥 {len(new_df):,} dòng mới sau {watermark['time']}")
+    if new_df.empty:
+        print("   ✓ Model đã cập nhật, không có dữ liệu mới")
+        return None
+    
+    # Holdout cuộn: phần mới nhất để đánh giá, lưu lại (pending) và train ở lần sau
+    column = watermark['column']
+    pending = data.get('pending')
+    df = new_df if pending is None else pd.concat([pending, new_df], ignore_index=True)
+    train_raw, holdout_raw, _ = rolling_holdout(df[df[column].notna()], column, holdout_fraction)
+    
+    model, le, feature_names = data['model'], data['label_encoder'], data['feature_names']
+    preprocessor = data.get('preprocessor')
+    
+    def prepare(raw):
+        """Labels + features + preprocessor đã lưu → (X, y); bỏ dòng có nhãn model chưa biết"""
+        if raw.empty:
+            return pd.DataFrame(columns=feature_names), np.array([], dtype=np.int64)
+        with timer.stage('prepare_data'):
+            part = create_features(create_pollution_labels(raw))
+            if preprocessor is not None:
+                part = preprocessor.transform(part, drop_outliers=False)   # Kẹp như lúc serving
+            part = part.dropna()
+            part = part[part['Pollution_Level'].isin(le.classes_)]
+        return part[feature_names], le.transform(part['Pollution_Level'])
+    
+    X_new, y_new = prepare(train_raw)
+    X_hold, y_hold = prepare(holdout_raw)
+    if len(y_new) == 0:
+        print("   ⚠️  Không còn dòng hợp lệ để train sau tiền xử lý")
+        return None
+    
+    # Dữ liệu mới + replay buffer (đủ mọi class cho cây mới), resample như lúc train
+    replay = data.get('replay')
+    X_fit, y_fit = with_replay(X_new, y_new, replay)
+    strategy = data.get('imbalance') or 'none'
+    with timer.stage('resample'):
+        try:
+            X_fit, y_fit, _ = resample(X_fit, y_fit, strategy)
+        except ValueError as e:
+            print(f"   ⚠️  Không resample được ({e}) → train trên dữ liệu gốc")
+    sample_weight = None
+    if strategy == 'class_weight':
+        model, sample_weight = apply_class_weight(model, y_fit)
+    
+    version = data.get('model_version', 1) + 1
+    f1_before = holdout_f1(model.predict, X_hold, y_hold)
+    with timer.stage('fit'):
+        trees = warm_start_update(model, X_fit, y_fit, new_trees, random_state=42 + version,
+                                  sample_weight=sample_weight)
+    f1_after = holdout_f1(model.predict, X_hold, y_hold)
+    
+    watermark = csv_watermark(csv_file, new_df[column], offset, watermark['rows'] + len(new_df),
+                              previous=watermark)
+    update = dict(trees, version=version, date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                  new_rows=len(new_df), train_rows=len(y_new), replay_rows=len(replay[1]) if replay else 0,
+                  holdout_rows=len(y_hold), f1_before=f1_before, f1_after=f1_after,
+                  watermark_time=watermark['time'], seconds=time.perf_counter() - started)
+    print_update_summary(update)
+    
+    extra = {
+        'model_version': version,
+        'watermark': watermark,
+        'replay': replay_sample(*with_replay(X_new, y_new, replay)),
+        'pending': holdout_raw if len(holdout_raw) else None,
+        'updates': data.get('updates', []) + [update],
+        'hyperparameters': data.get('hyperparameters')
+    }
+    with timer.stage('save'):
+        archived = archive_version(model_file, version - 1)
+        if archived:
+            print(f"\n✓ Đã giữ bản trước: {archived}")
+        save_model(model, feature_names, le, data.get('model_name', 'Unknown'), filename=model_file,
+                   preprocessor=preprocessor, imbalance=data.get('imbalance'), extra=extra)
+    
+    print("\n⏱️  Thời gian từng stage:")
+    print(timer.summary())
+    return update
+
+
+# ==============================
+# 12. DEMO PREDICTION
 # ==============================
 def predict_demo(model_file="air_quality_model.pkl"):
     """Demo dự đoán với dữ liệu mẫu"""
@@ -825,7 +1098,7 @@ def predict_demo(model_file="air_quality_model.pkl"):
 
 
 # ==============================
-# 12. TEST VỚI NHIỀU SCENARIOS
+# 13. TEST VỚI NHIỀU SCENARIOS
 # ==============================
 def test_scenarios(model_file="air_quality_model.pkl"):
     """Test model với nhiều scenarios khác nhau"""
@@ -933,13 +1206,28 @@ def test_scenarios(model_file="air_quality_model.pkl"):
 # RUN ALL
 # ==============================
 if __name__ == "__main__":
-    import sys
-    
-    # Check if data file exists
-    csv_file = "datasets/air_quality_data.csv"
-    
-    if len(sys.argv) > 1:
-        csv_file = sys.argv[1]
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Train air quality model')
+    parser.add_argument('csv_file', nargs='?', default="datasets/air_quality_data.csv")
+    parser.add_argument('--rebuild-cache', action='store_true', help='Parse lại CSV và build lại cache dạng cột')
+    parser.add_argument('--no-cache', action='store_true', help='Đọc thẳng từ CSV, không dùng cache')
+    parser.add_argument('--no-stage-cache', action='store_true',
+                        help='Tính lại labels / features / preprocess, không dùng stage cache')
+    parser.add_argument('--search', action='store_true',
+                        help='Tìm hyperparameter Decision Tree bằng successive halving (song song)')
+    parser.add_argument('--imbalance', choices=IMBALANCE_STRATEGIES, default='smote',
+                        help='Cách xử lý mất cân bằng classes (mặc định: smote)')
+    parser.add_argument('--compare-imbalance', action='store_true',
+                        help='So sánh wall time + F1 của mọi strategy mất cân bằng trước khi train')
+    parser.add_argument('--update', action='store_true',
+                        help='Chỉ cập nhật air_quality_model.pkl bằng các dòng mới hơn watermark '
+                             '(warm start; Random Forest / Gradient Boosting). Gradient Boosting: '
+                             'mỗi lần thêm stage vĩnh viễn → model lớn dần, latency predict tăng dần')
+    parser.add_argument('--new-trees', type=int, default=RETRAIN_NEW_TREES,
+                        help=f'Số cây / stage thêm vào mỗi lần --update (mặc định: {RETRAIN_NEW_TREES})')
+    args = parser.parse_args()
+    csv_file = args.csv_file
     
     print("\n" + "="*70)
     print("🌍 AIR QUALITY PREDICTION MODEL - TRAINING & EVALUATION")
@@ -947,25 +1235,35 @@ if __name__ == "__main__":
     print(f"📂 Data file: {csv_file}")
     
     try:
-        # 1. Train models
-        model, results, features, label_encoder = main(csv_file, use_smote=True)
+        if args.update:
+            # Chỉ cập nhật model đã lưu bằng dữ liệu mới (không train lại từ đầu)
+            update_model(csv_file, new_trees=args.new_trees)
+        else:
+            # 1. Train models
+            model, results, features, label_encoder = main(
+                csv_file, use_smote=True, cache=not args.no_cache, rebuild_cache=args.rebuild_cache,
+                use_stage_cache=not args.no_stage_cache, search=args.search,
+                imbalance=args.imbalance, compare_imbalance=args.compare_imbalance
+            )
         
-        # 2. Demo prediction
-        predict_demo()
+            # 2. Demo prediction
+            predict_demo()
         
-        # 3. Test scenarios
-        test_scenarios()
+            # 3. Test scenarios
+            test_scenarios()
         
-        print("\n" + "="*70)
-        print("✅ ALL TASKS COMPLETED SUCCESSFULLY!")
-        print("="*70)
-        print("\n📁 Output files:")
-        print("   - air_quality_model.pkl (trained model)")
-        print("   - model_comparison.png (visualization)")
+            print("\n" + "="*70)
+            print("✅ ALL TASKS COMPLETED SUCCESSFULLY!")
+            print("="*70)
+            print("\n📁 Output files:")
+            print("   - air_quality_model.pkl (trained model)")
+            if is_artifact(artifact_path_for("air_quality_model.pkl")):
+                print("   - air_quality_model.aqm/ (memory-mapped artifact cho serving)")
+            print("   - model_comparison.png (visualization)")
         
     except FileNotFoundError:
         print(f"\n❌ Error: File '{csv_file}' not found!")
-        print("Usage: python train_model.py [path_to_csv]")
+        print("Usage: python train_model.py [path_to_csv] [--rebuild-cache | --no-cache]")
     except Exception as e:
         print(f"\n❌ Error: {e}")
         import traceback
@@ -1,15 +1,28 @@
 import pandas as pd
 import numpy as np
 import pickle
+import time
 import matplotlib.pyplot as plt
 from datetime import datetime
-from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, confusion_matrix, f1_score
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.pipeline import Pipeline
-from imblearn.over_sampling import SMOTE
+from sklearn.base import clone
 from imblearn.pipeline import Pipeline as ImbPipeline
+from aqi_engine import AQIEngine, V2_BREAKPOINTS, V2_LABELS
+from model_artifact import save_artifact, artifact_path_for
+from incremental import (RETRAIN_HOLDOUT_FRACTION, RETRAIN_NEW_TREES, archive_version, csv_watermark,
+                         holdout_f1, line_boundary, print_update_summary, read_new_rows, replay_sample,
+                         rolling_holdout, time_column, warm_start_update, with_replay)
+from imbalance import IMBALANCE_STRATEGIES, compare_strategies, print_strategy_report, resample, sampler_for
+from hyperparam_search import FOREST_PARAM_GRID, halving_search, print_search_summary, save_search
+from preprocessor import FittedPreprocessor
+from dataset_cache import load_dataset
+from ingest import iter_csv, load_csv, memory_comparison
+from stage_cache import StageCache
+from stage_timer import StageTimer
 
 # ==============================
 # 1. CẬP NHẬT AQI CALCULATOR (ĐỦ CÁC KHÍ)
@@ -48,10 +61,22 @@ class AQICalculator:
 class AirQualityModel:
     def __init__(self):
         self.aqi_calc = AQICalculator()
+        self.aqi_engine = AQIEngine(V2_BREAKPOINTS, negative_as_zero=True)
         self.le = LabelEncoder()
         self.model = None
+        self.preprocessor = None
+        self.search_result = None
+        self.hyperparameters = None
+        self.imbalance = None
+        # Cập nhật tăng dần (incremental.py)
+        self.model_version = 1
+        self.watermark = None
+        self.replay = None
+        self.pending = None
+        self.updates = []
 
-    def prepare_data(self, df):
+    def prepare_data(self, df, fit=True):
+        """fit=False: dùng self.preprocessor đã fit (dữ liệu mới khi cập nhật model)"""
         df = df.copy()
 
         # 1. Tính PM10 từ TSP theo yêu cầu của bạn
@@ -59,21 +84,26 @@ class AirQualityModel:
             df['PM10'] = df['TSP'] / 1.5
             print("✓ Đã tính PM10 = TSP / 1.5")
 
-        # 2. Xử lý giá trị thiếu cho các cột quan trọng
+        # 2. Xử lý giá trị thiếu cho các cột quan trọng (median giữ lại để serving điền giống vậy)
         numeric_cols = ['PM2.5', 'PM10', 'O3', 'CO', 'NO2', 'SO2', 'Temperature', 'Humidity']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = df[col].fillna(df[col].median())
-
-        # 3. Tính AQI cho từng thành phần
-        df['AQI_PM25'] = df['PM2.5'].apply(self.aqi_calc.calc_pm25)
-        df['AQI_PM10'] = df['PM10'].apply(self.aqi_calc.calc_pm10)
-        df['AQI_CO'] = df['CO'].apply(self.aqi_calc.calc_co)
+        if fit:
+            self.preprocessor, df = FittedPreprocessor.fit_transform(
+                df, [col for col in numeric_cols if col in df.columns], z=None)
+        else:
+            df = self.preprocessor.transform(df)
+
+        # 3. Tính AQI cho từng thành phần (vectorized trên cả cột)
+        sub_aqi = self.aqi_engine.sub_indices(df, {
+            'AQI_PM25': ('PM2.5', 'PM2.5'),
+            'AQI_PM10': ('PM10', 'PM10'),
+            'AQI_CO': ('CO', 'CO'),
+        })
+        for col in sub_aqi.columns:
+            df[col] = sub_aqi[col]
         
         # AQI tổng hợp (Max của tất cả chỉ số phụ)
-        aqi_subs = [c for c in df.columns if 'AQI_' in c]
-        df['AQI_Max'] = df[aqi_subs].max(axis=1)
-        df['Target'] = df['AQI_Max'].apply(self.aqi_calc.get_label)
+        df['AQI_Max'] = self.aqi_engine.max_aqi(sub_aqi)
+        df['Target'] = self.aqi_engine.labels(df['AQI_Max'], V2_LABELS)
 
         # 4. Feature Engineering
         df['PM_ratio'] = df['PM2.5'] / (df['PM10'] + 1e-6)
@@ -87,9 +117,18 @@ class AirQualityModel:
 
         return df
 
-    def train(self, df):
+    def train(self, df, timer=None, search=False, imbalance='smote', compare_imbalance=False, cache=None):
+        """
+        timer: StageTimer đo từng stage (prepare_data, split, scale, resample, fit, evaluation)
+        search: tìm hyperparameter của RandomForest (successive halving, song song) trước khi fit
+        imbalance: strategy xử lý mất cân bằng (imbalance.IMBALANCE_STRATEGIES)
+        compare_imbalance: in wall time + F1 của RandomForest với mọi strategy
+        cache: StageCache lưu ma trận sau resample (None: không cache)
+        """
+        timer = timer or StageTimer()
         print("--- Đang bắt đầu huấn luyện ---")
-        df = self.prepare_data(df)
+        with timer.stage('prepare_data'):
+            df = self.prepare_data(df)
         
         # Chọn các feature thực tế nhất (loại bỏ AQI trực tiếp để tránh rò rỉ dữ liệu)
         self.feature_cols = ['PM2.5', 'PM10', 'O3', 'CO', 'NO2', 'SO2', 
@@ -102,23 +141,53 @@ class AirQualityModel:
         y = self.le.fit_transform(df['Target'])
         
         # Split data
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, stratify=y, random_state=42)
+        with timer.stage('split'):
+            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, stratify=y, random_state=42)
 
-        # Pipeline hoàn chỉnh
+        # Pipeline hoàn chỉnh (sampler chỉ chạy lúc fit)
+        self.imbalance = imbalance
         pipeline = ImbPipeline([
             ('scaler', StandardScaler()),
-            ('smote', SMOTE(random_state=42)),
+            ('sampler', sampler_for(imbalance)),
             ('rf', RandomForestClassifier(n_estimators=100, max_depth=15, random_state=42, n_jobs=-1))
         ])
+        if imbalance == 'class_weight':
+            pipeline.set_params(rf__class_weight='balanced')
+
+        if search:
+            print("\nĐang tìm hyperparameter cho RandomForest (successive halving)...")
+            # RF trong từng worker chạy 1 luồng: song song ở mức cấu hình, không chồng lên nhau
+            candidate = clone(pipeline).set_params(rf__n_jobs=1)
+            with timer.stage('search'):
+                self.search_result = halving_search(candidate, FOREST_PARAM_GRID, X_train, y_train, step='rf')
+            print_search_summary(self.search_result)
+            self.hyperparameters = self.search_result['best_params']
+            pipeline.set_params(**{f'rf__{name}': value for name, value in self.search_result['best_params'].items()})
 
-        pipeline.fit(X_train, y_train)
+        # Fit từng bước (giống pipeline.fit) để đo riêng resample và RF
+        steps = pipeline.named_steps
+        with timer.stage('scale'):
+            X_scaled = steps['scaler'].fit_transform(X_train)
+        if compare_imbalance:
+            with timer.stage('compare_imbalance'):
+                rows = compare_strategies(steps['rf'], X_scaled, y_train, steps['scaler'].transform(X_test), y_test,
+                                          cache=cache)
+            print_strategy_report(rows, "So sánh strategy mất cân bằng (RandomForest):")
+        with timer.stage('resample'):
+            X_res, y_res, info = resample(X_scaled, y_train, imbalance, cache)
+        print(f"\nResample ({imbalance}): {info['rows_before']:,} → {info['rows_after']:,} dòng "
+              f"trong {info['seconds']:.2f}s (cache: {info['status']})")
+        with timer.stage('fit'):
+            steps['rf'].fit(X_res, y_res)
         self.model = pipeline
+        self.replay = replay_sample(X_train, y_train)
         
         # Đánh giá
-        y_pred = pipeline.predict(X_test)
-        print(f"\nHuấn luyện xong! F1 Score: {f1_score(y_test, y_pred, average='weighted'):.4f}")
-        print("\nBáo cáo phân loại:")
-        print(classification_report(y_test, y_pred, target_names=self.le.classes_))
+        with timer.stage('evaluation'):
+            y_pred = pipeline.predict(X_test)
+            print(f"\nHuấn luyện xong! F1 Score: {f1_score(y_test, y_pred, average='weighted'):.4f}")
+            print("\nBáo cáo phân loại:")
+            print(classification_report(y_test, y_pred, target_names=self.le.classes_))
         
         return pipeline
     def save(self, path="air_quality_v2.pkl"):
@@ -126,15 +195,137 @@ class AirQualityModel:
             'model': self.model,
             'feature_names': self.feature_cols,
             'label_encoder': self.le,
+            'preprocessor': self.preprocessor,
+            'hyperparameters': self.hyperparameters,
+            'imbalance': self.imbalance,
+            'model_version': self.model_version,
+            'watermark': self.watermark,
+            'replay': self.replay,
+            'pending': self.pending,
+            'updates': self.updates,
             'date': datetime.now()
         }
         with open(path, 'wb') as f:
             pickle.dump(data, f)
         print(f"Đã lưu mô hình tại {path}")
+        
+        # Artifact memory-mapped cho serving (scaler + các cây của forest)
+        artifact = save_artifact(artifact_path_for(path), self.model, self.feature_cols, self.le,
+                                 metadata={'date': data['date'], 'model_version': self.model_version,
+                                           'watermark': (self.watermark or {}).get('time')},
+                                 preprocessor=self.preprocessor)
+        if artifact:
+            print(f"Đã lưu artifact tại {artifact}")
+        if self.search_result:
+            print(f"Đã lưu leaderboard tại {save_search(path, self.search_result)}")
+
+    @classmethod
+    def load(cls, path="air_quality_v2.pkl"):
+        """Model đã lưu bởi save() (để cập nhật tăng dần)"""
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        aq_model = cls()
+        aq_model.model = data['model']
+        aq_model.feature_cols = data['feature_names']
+        aq_model.le = data['label_encoder']
+        aq_model.preprocessor = data.get('preprocessor')
+        aq_model.hyperparameters = data.get('hyperparameters')
+        aq_model.imbalance = data.get('imbalance')
+        aq_model.model_version = data.get('model_version', 1)
+        aq_model.watermark = data.get('watermark')
+        aq_model.replay = data.get('replay')
+        aq_model.pending = data.get('pending')
+        aq_model.updates = data.get('updates', [])
+        return aq_model
+
+    def update(self, csv_path, timer=None, new_trees=RETRAIN_NEW_TREES, holdout_fraction=RETRAIN_HOLDOUT_FRACTION):
+        """
+        Cập nhật model bằng các dòng mới hơn watermark (không đọc lại lịch sử)
+
+        Thêm new_trees cây RandomForest fit trên dữ liệu mới + replay buffer (warm_start),
+        bỏ bấy nhiêu cây cũ nhất; đánh giá trước / sau trên holdout cuộn (phần mới nhất).
+        Trả về thông tin lần cập nhật, None nếu không có dữ liệu mới.
+        """
+        if not self.watermark:
+            raise ValueError("Model không có watermark → cần train đầy đủ một lần trước khi cập nhật")
+        timer = timer or StageTimer()
+        started = time.perf_counter()
+        with timer.stage('load_data'):
+            new_df, offset = read_new_rows(csv_path, self.watermark, usecols=DATA_COLUMNS)
+        print(f"{len(new_df):,} dòng mới sau {self.watermark['time']}")
+        if new_df.empty:
+            return None
+
+        # Holdout cuộn: phần mới nhất chỉ để đánh giá, được train ở lần cập nhật sau
+        column = self.watermark['column']
+        df = new_df if self.pending is None else pd.concat([self.pending, new_df], ignore_index=True)
+        train_raw, holdout_raw, _ = rolling_holdout(df[df[column].notna()], column, holdout_fraction)
+
+        def prepare(raw):
+            if raw.empty:
+                return pd.DataFrame(columns=self.feature_cols), np.array([], dtype=np.int64)
+            with timer.stage('prepare_data'):
+                part = self.prepare_data(raw, fit=False)
+                part = part[part['Target'].isin(self.le.classes_)]   # Bỏ nhãn model chưa biết
+            return part[self.feature_cols], self.le.transform(part['Target'])
+
+        X_new, y_new = prepare(train_raw)
+        X_hold, y_hold = prepare(holdout_raw)
+        if len(y_new) == 0:
+            return None
 
-def load_data(file_path):
-    """Load và hiển thị thông tin cơ bản về dataset"""
-    df = pd.read_csv(file_path)
+        # Dữ liệu mới + replay buffer (đủ mọi class cho cây mới), scaler giữ nguyên như lúc train
+        steps = self.model.named_steps
+        X_fit, y_fit = with_replay(X_new, y_new, self.replay)
+        with timer.stage('scale'):
+            X_scaled = steps['scaler'].transform(X_fit)
+        with timer.stage('resample'):
+            try:
+                X_scaled, y_fit, _ = resample(X_scaled, y_fit, self.imbalance or 'none')
+            except ValueError as e:
+                print(f"Không resample được ({e}) → train trên dữ liệu gốc")
+
+        f1_before = holdout_f1(self.model.predict, X_hold, y_hold)
+        with timer.stage('fit'):
+            trees = warm_start_update(steps['rf'], X_scaled, y_fit, new_trees, random_state=42 + self.model_version)
+        f1_after = holdout_f1(self.model.predict, X_hold, y_hold)
+
+        self.model_version += 1
+        self.watermark = csv_watermark(csv_path, new_df[column], offset, self.watermark['rows'] + len(new_df),
+                                       previous=self.watermark)
+        update = dict(trees, version=self.model_version, date=datetime.now(), new_rows=len(new_df),
+                      train_rows=len(y_new), replay_rows=len(self.replay[1]) if self.replay else 0,
+                      holdout_rows=len(y_hold), f1_before=f1_before, f1_after=f1_after,
+                      watermark_time=self.watermark['time'], seconds=time.perf_counter() - started)
+        self.replay = replay_sample(*with_replay(X_new, y_new, self.replay))
+        self.pending = holdout_raw if len(holdout_raw) else None
+        self.updates.append(update)
+        print_update_summary(update)
+        return update
+
+# Cột gốc pipeline dùng (các cột khác trong CSV không được load)
+# (DateTime không phải feature, chỉ dùng làm watermark cho cập nhật tăng dần)
+DATA_COLUMNS = ['PM2.5', 'PM10', 'TSP', 'O3', 'CO', 'NO2', 'SO2', 'Temperature', 'Humidity', 'date', 'DateTime']
+
+def load_data(file_path, as_chunks=False, stats=None, columns=None, cache=True, rebuild_cache=False):
+    """
+    Load và hiển thị thông tin cơ bản về dataset
+
+    Đọc theo chunk với schema gọn (float32 / datetime / category), thống kê cộng dồn
+    theo chunk. as_chunks=True: trả về iterator các chunk (stats: RunningStats được
+    cập nhật khi duyệt) thay vì ghép thành một DataFrame.
+    columns: chỉ load các cột này. cache=True: đọc qua cache dạng cột (dataset_cache),
+    CSV chỉ được parse lại khi nội dung đổi hoặc rebuild_cache=True.
+    """
+    if as_chunks:
+        return iter_csv(file_path, usecols=columns, stats=stats)
+
+    cache_info = None
+    if cache:
+        df, summary, cache_info = load_dataset(file_path, columns, rebuild=rebuild_cache)
+    else:
+        df, stats = load_csv(file_path, usecols=columns)
+        summary = stats.describe()
     print("="*70)
     print("LOAD DỮ LIỆU")
     print("="*70)
@@ -142,13 +333,59 @@ def load_data(file_path):
     print(f"✓ Số cột: {len(df.columns)}")
     print(f"✓ Các cột: {df.columns.tolist()}")
     print(f"\nThống kê cơ bản:")
-    print(df.describe())
+    print(summary)
+    if cache_info:
+        speedup = cache_info['csv_seconds'] / max(cache_info['cache_seconds'], 1e-9)
+        status = "vừa build từ CSV" if cache_info['built'] else "dùng lại"
+        print(f"\nCache {cache_info['cache_path']} ({status}): parse CSV {cache_info['csv_seconds']:.2f}s, "
+              f"load cache {cache_info['cache_seconds']:.3f}s (nhanh hơn {speedup:,.0f}x)")
+    memory = memory_comparison(file_path, df)
+    print(f"\nBộ nhớ: {memory['compact_bytes'] / 1024**2:.1f} MB "
+          f"(pd.read_csv mặc định ≈ {memory['default_bytes'] / 1024**2:.1f} MB, giảm {memory['reduction']:.0%})")
     return df
 # ==============================
 # 3. CHẠY PIPELINE
 # ==============================
 
-df = load_data("datasets/air_quality_data.csv")
-aq_model = AirQualityModel()
-aq_model.train(df)
-aq_model.save()
\ No newline at end of file
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Train air quality model v2')
+    parser.add_argument('csv_file', nargs='?', default="datasets/air_quality_data.csv")
+    parser.add_argument('--rebuild-cache', action='store_true', help='Parse lại CSV và build lại cache dạng cột')
+    parser.add_argument('--no-cache', action='store_true', help='Đọc thẳng từ CSV, không dùng cache')
+    parser.add_argument('--search', action='store_true',
+                        help='Tìm hyperparameter RandomForest bằng successive halving (song song)')
+    parser.add_argument('--imbalance', choices=IMBALANCE_STRATEGIES, default='smote',
+                        help='Cách xử lý mất cân bằng classes (mặc định: smote)')
+    parser.add_argument('--compare-imbalance', action='store_true',
+                        help='So sánh wall time + F1 của mọi strategy mất cân bằng trước khi train')
+    parser.add_argument('--no-stage-cache', action='store_true',
+                        help='Resample lại, không dùng ma trận đã lưu trong stage cache')
+    parser.add_argument('--model', default="air_quality_v2.pkl", help='File model (lưu / cập nhật)')
+    parser.add_argument('--update', action='store_true',
+                        help='Chỉ cập nhật model đã lưu bằng các dòng mới hơn watermark (warm start)')
+    parser.add_argument('--new-trees', type=int, default=RETRAIN_NEW_TREES,
+                        help=f'Số cây thêm (và bỏ) mỗi lần --update (mặc định: {RETRAIN_NEW_TREES})')
+    args = parser.parse_args()
+
+    if args.update:
+        aq_model = AirQualityModel.load(args.model)
+        if aq_model.update(args.csv_file, new_trees=args.new_trees):
+            archived = archive_version(args.model, aq_model.model_version - 1)
+            if archived:
+                print(f"Đã giữ bản trước tại {archived}")
+            aq_model.save(args.model)
+        else:
+            print("Không có dữ liệu mới để cập nhật")
+    else:
+        # Vị trí cuối CSV trước khi đọc: lần --update sau đọc tiếp từ đây
+        csv_offset = line_boundary(args.csv_file)
+        df = load_data(args.csv_file, columns=DATA_COLUMNS, cache=not args.no_cache, rebuild_cache=args.rebuild_cache)
+        aq_model = AirQualityModel()
+        aq_model.train(df, search=args.search, imbalance=args.imbalance, compare_imbalance=args.compare_imbalance,
+                       cache=StageCache(enabled=not args.no_stage_cache))
+        column = time_column(df)
+        if column:
+            aq_model.watermark = csv_watermark(args.csv_file, df[column], csv_offset, len(df))
+        aq_model.save(args.model)